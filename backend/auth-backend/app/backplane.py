@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import threading
+
+from sqlalchemy.engine import make_url
+
+# --- 📡 CHAT BACKPLANE TRANSPORTS ---
+# With several uvicorn workers each process only holds its own websockets.
+# Workers exchange small JSON envelopes over one of these transports so chat
+# messages and presence reach users connected to any worker:
+#   local    - single process, nothing leaves the worker (default)
+#   broker   - TCP fan-out broker, run `python chat_broker.py` next to the API
+#   postgres - LISTEN/NOTIFY on the main database, no extra service
+# Every transport has the same shape: start(on_message, on_connect), publish(envelope),
+# stop(). on_connect runs after each (re)connect so the worker can resync presence.
+# Envelopes may echo back to the sender; the chat manager drops its own.
+
+CHAT_BACKPLANE = os.getenv("CHAT_BACKPLANE", "local")
+CHAT_BROKER_ADDR = os.getenv("CHAT_BROKER_ADDR", "127.0.0.1:8765")
+PG_CHANNEL = "chat_backplane"
+PG_PAYLOAD_LIMIT = 7900  # NOTIFY payloads must stay under 8000 bytes
+RECONNECT_SECONDS = 2
+
+
+def encode(envelope: dict) -> str:
+    return json.dumps(envelope, separators=(",", ":"), default=str)
+
+
+class LocalTransport:
+    async def start(self, on_message, on_connect=None):
+        pass
+
+    async def publish(self, envelope: dict):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class BrokerTransport:
+    """Newline-delimited JSON over TCP to chat_broker.py, reconnecting on loss."""
+
+    def __init__(self, addr: str = CHAT_BROKER_ADDR):
+        host, port = addr.rsplit(":", 1)
+        self.host, self.port = host, int(port)
+        self._writer = None
+        self._task = None
+
+    async def start(self, on_message, on_connect=None):
+        self._task = asyncio.create_task(self._run(on_message, on_connect))
+
+    async def _run(self, on_message, on_connect):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_connection(self.host, self.port)
+                print(f"Chat backplane connected to broker {self.host}:{self.port}")
+                if on_connect:
+                    await on_connect()
+                while line := await reader.readline():
+                    await on_message(json.loads(line))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Chat broker connection lost: {e}")
+            self._writer = None
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def publish(self, envelope: dict):
+        if self._writer is None:
+            return  # broker down: cross-worker delivery pauses, local still works
+        try:
+            self._writer.write(encode(envelope).encode() + b"\n")
+            await self._writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(f"Chat broker publish failed: {e}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._writer:
+            self._writer.close()
+
+
+class PostgresTransport:
+    """LISTEN/NOTIFY on a dedicated psycopg2 connection, polled from the event loop."""
+
+    def __init__(self, database_url: str = None):
+        url = make_url(database_url or os.getenv("DATABASE_URL"))
+        self.dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self._listen = None
+        self._notify = None
+        self._on_message = None
+        self._on_connect = None
+        self._loop = None
+        self._send_lock = threading.Lock()
+
+    def _connect(self):
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    async def start(self, on_message, on_connect=None):
+        self._on_message = on_message
+        self._on_connect = on_connect
+        self._loop = asyncio.get_running_loop()
+        await self._listen_forever()
+
+    async def _listen_forever(self):
+        try:
+            self._listen = await self._loop.run_in_executor(None, self._connect)
+            with self._listen.cursor() as cur:
+                cur.execute(f"LISTEN {PG_CHANNEL}")
+            self._loop.add_reader(self._listen.fileno(), self._drain)
+            if self._on_connect:
+                await self._on_connect()
+        except Exception as e:
+            print(f"Chat LISTEN connection failed: {e}")
+            self._loop.call_later(RECONNECT_SECONDS, lambda: asyncio.ensure_future(self._listen_forever()))
+
+    def _drain(self):
+        try:
+            self._listen.poll()
+        except Exception as e:
+            print(f"Chat LISTEN connection lost: {e}")
+            self._loop.remove_reader(self._listen.fileno())
+            self._loop.call_later(RECONNECT_SECONDS, lambda: asyncio.ensure_future(self._listen_forever()))
+            return
+        while self._listen.notifies:
+            note = self._listen.notifies.pop(0)
+            asyncio.ensure_future(self._on_message(json.loads(note.payload)))
+
+    def _send(self, payload: str):
+        with self._send_lock:
+            self._send_locked(payload)
+
+    def _send_locked(self, payload: str):
+        if self._notify is None or self._notify.closed:
+            self._notify = self._connect()
+        with self._notify.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (PG_CHANNEL, payload))
+
+    async def publish(self, envelope: dict):
+        payload = encode(envelope)
+        if len(payload.encode()) > PG_PAYLOAD_LIMIT:
+            # Too big for NOTIFY; the message is still saved and shows up in history
+            print(f"Chat envelope of {len(payload)} bytes not relayed over NOTIFY")
+            return
+        try:
+            await self._loop.run_in_executor(None, self._send, payload)
+        except Exception as e:
+            print(f"Chat NOTIFY failed: {e}")
+            self._notify = None
+
+    async def stop(self):
+        for conn in (self._listen, self._notify):
+            if conn is not None and not conn.closed:
+                if conn is self._listen:
+                    self._loop.remove_reader(conn.fileno())
+                conn.close()
+
+
+def make_transport(kind: str = CHAT_BACKPLANE):
+    if kind == "broker":
+        return BrokerTransport()
+    if kind == "postgres":
+        return PostgresTransport()
+    if kind == "local":
+        return LocalTransport()
+    raise ValueError(f"Unknown CHAT_BACKPLANE {kind!r} (local | broker | postgres)")
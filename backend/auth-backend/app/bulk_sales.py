@@ -0,0 +1,181 @@
+import os
+from collections import defaultdict
+
+from sqlalchemy import select, insert, func, cast, Integer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import Product, SalesInvoice, SalesInvoiceItem
+from .stock import take_stock, StockConflict, sales_product_ids
+from .valuation import invalidate_checkpoints
+from .receivables import post_invoice
+from .last_rates import record_sales
+
+# --- 📥 BULK SALES INVOICE SUBMISSION ---
+# Offline field orders arrive in one batch at sync time. Instead of one
+# transaction per order, the whole batch is planned in memory:
+#   * every product in the batch (picked in search, else by name) is read in
+#     one query (stock + code)
+#   * orders are checked in the order sent; one that can't be covered by the
+#     stock left after the orders before it fails on its own
+#   * orders sent without an invoice number get a consecutive block of
+#     numbers after the current highest
+# and the accepted orders are written with one multi-row INSERT per table and
+# one guarded stock UPDATE (stock.take_stock), then committed together.
+# If another counter sells or takes an invoice number between the plan and
+# the write, the guarded UPDATE / unique index refuses, and the batch is
+# re-planned against fresh figures (up to RETRIES times). If stock still moves
+# under it after that, the next plans count contested products at no more than
+# the stock the refusal reported, so orders that no longer fit fail on their
+# own and the rest of the batch is saved.
+
+MAX_INVOICES = int(os.getenv("BULK_INVOICE_LIMIT", "1000"))
+RETRIES = 3
+
+
+def _next_invoice_no(db: Session) -> int:
+    # Same rule as /sales-invoice/next-no
+    return (db.query(func.max(cast(SalesInvoice.invoice_no, Integer))).scalar() or 0) + 1
+
+
+def _plan(db: Session, invoices: list, caps: dict = None):
+    # caps: product id -> stock seen by a refused write (None = no longer in the master)
+    flat = sales_product_ids(db, [r for inv in invoices for r in inv.rows])
+    row_ids, start = [], 0
+    for inv in invoices:
+        row_ids.append(flat[start:start + len(inv.rows)])
+        start += len(inv.rows)
+    ids = {product_id for product_id in flat if product_id is not None}
+    products = {
+        product_id: (name, code, stock or 0) for product_id, name, code, stock in db.execute(
+            select(Product.id, Product.name, Product.code, Product.current_stock).where(Product.id.in_(ids))
+        )
+    } if ids else {}
+    given = [inv.header.invoiceNo.strip() for inv in invoices if inv.header.invoiceNo.strip()]
+    taken = {no for (no,) in db.execute(
+        select(SalesInvoice.invoice_no).where(SalesInvoice.invoice_no.in_(given))
+    )} if given else set()
+
+    left = {product_id: stock for product_id, (_, _, stock) in products.items()}
+    for product_id, available in (caps or {}).items():
+        if available is None:
+            left.pop(product_id, None)
+        elif product_id in left:
+            left[product_id] = min(left[product_id], available)
+    seen = set()
+    results, accepted = [], []
+    for index, (inv, inv_ids) in enumerate(zip(invoices, row_ids)):
+        invoice_no = inv.header.invoiceNo.strip()
+        error, shortages = None, []
+        if not inv.rows:
+            error = "Invoice has no rows"
+        elif invoice_no and (invoice_no in taken or invoice_no in seen):
+            error = f"Invoice number {invoice_no} already exists"
+        else:
+            wanted, unmatched = defaultdict(int), defaultdict(int)
+            for r, product_id in zip(inv.rows, inv_ids):
+                if product_id is None:
+                    unmatched[r.name] += r.qty + r.free
+                else:
+                    wanted[product_id] += r.qty + r.free
+            for product_id, qty in wanted.items():
+                if product_id not in left:
+                    shortages.append({"product": products[product_id][0] if product_id in products else product_id,
+                                      "product_id": product_id, "requested": qty, "available": None,
+                                      "reason": "not in product master"})
+                elif qty > left[product_id]:
+                    shortages.append({"product": products[product_id][0], "product_id": product_id,
+                                      "requested": qty, "available": left[product_id],
+                                      "reason": "insufficient stock"})
+            for name, qty in unmatched.items():
+                shortages.append({"product": name, "product_id": None, "requested": qty, "available": None,
+                                  "reason": "not in product master"})
+            if shortages:
+                error = "Not enough stock to bill this invoice"
+            else:
+                for product_id, qty in wanted.items():
+                    left[product_id] -= qty
+        if error:
+            result = {"index": index, "status": "failed", "invoice_no": invoice_no or None, "error": error}
+            if shortages:
+                result["shortages"] = shortages
+            results.append(result)
+            continue
+        if invoice_no:
+            seen.add(invoice_no)
+        accepted.append((index, invoice_no, inv, inv_ids))
+        results.append(None)  # filled in once numbers are allocated
+
+    next_no = _next_invoice_no(db) if any(not no for _, no, _, _ in accepted) else None
+    numbered = []
+    for index, invoice_no, inv, inv_ids in accepted:
+        if not invoice_no:
+            while str(next_no) in seen:  # skip numbers the batch itself brought
+                next_no += 1
+            invoice_no = str(next_no)
+            next_no += 1
+        numbered.append((invoice_no, inv, inv_ids))
+        results[index] = {"index": index, "status": "success", "invoice_no": invoice_no}
+    return results, numbered, {product_id: code for product_id, (_, code, _) in products.items()}
+
+
+def _write(db: Session, numbered: list, codes: dict):
+    headers, items, lines = [], [], []
+    balances = defaultdict(float)
+    for invoice_no, inv, inv_ids in numbered:
+        h = inv.header
+        headers.append({
+            "invoice_no": invoice_no, "invoice_date": h.invoiceDate, "trading_account": h.tradingAccount,
+            "customer": h.customer, "area": h.area, "city": h.city, "state": h.state,
+            "payment_mode": h.paymentMode, "due_days": h.dueDays, "notes": inv.notes,
+            "subtotal": inv.totals.get("subtotal", 0), "total_discount": inv.totals.get("totalDiscount", 0),
+            "total_gst": inv.totals.get("totalGST", 0), "grand_total": inv.totals.get("grandTotal", 0),
+        })
+        for r, product_id in zip(inv.rows, inv_ids):
+            items.append({
+                "invoice_no": invoice_no, "pcode": codes.get(product_id), "product_id": product_id,
+                "name": r.name, "batch": r.batch,
+                "exp": r.exp, "qty": r.qty, "free": r.free, "rate": r.rate, "gst": r.gst,
+                "discount": r.discount, "line_total": 0,
+            })
+            lines.append((product_id, r.qty + r.free))
+        balances[(h.customer, h.paymentMode)] += inv.totals.get("grandTotal", 0) or 0
+
+    db.execute(insert(SalesInvoice), headers)
+    db.execute(insert(SalesInvoiceItem), items)
+    take_stock(db, lines)
+    invalidate_checkpoints(db, *{inv.header.invoiceDate for _, inv, _ in numbered})
+    record_sales(db, [(inv.header.customer, no, inv.header.invoiceDate, inv.rows) for no, inv, _ in numbered])
+    # One ledger adjustment per customer, not per invoice
+    for (customer, mode), amount in balances.items():
+        post_invoice(db, customer, mode, amount)
+
+
+def submit_invoices(db: Session, invoices: list) -> dict:
+    """Save every order that can be billed; one result per order, in the order sent."""
+    caps = {}
+    attempt = 0
+    while True:
+        results, numbered, codes = _plan(db, invoices, caps)
+        if not numbered:
+            break
+        try:
+            _write(db, numbered, codes)
+            db.commit()
+            break
+        except (StockConflict, IntegrityError) as e:
+            # Stock or an invoice number moved since the plan was read
+            db.rollback()
+            attempt += 1
+            if attempt >= RETRIES:
+                if not isinstance(e, StockConflict):
+                    raise
+                # A refused product's reported stock only goes down, so this ends
+                caps.update({s["product_id"]: s["available"] for s in e.shortages if s["product_id"] is not None})
+            print(f"Bulk invoice batch re-planned after concurrent change: {e}")
+        except Exception:
+            db.rollback()
+            raise
+
+    saved = sum(1 for r in results if r["status"] == "success")
+    return {"submitted": len(invoices), "saved": saved, "failed": len(invoices) - saved, "results": results}
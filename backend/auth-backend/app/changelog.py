@@ -0,0 +1,140 @@
+from datetime import datetime
+
+from sqlalchemy import event, update, insert, select, delete, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from .models import Product, Customer, Supplier, Company, ChangeLog, ChangeCounter
+from .serializers import fetch_rows, table_fields
+
+# --- 🔄 CHANGE LOG FOR DELTA SYNC ---
+# Every committed write to a master row (and every stock change) appends
+# (seq, table, row_id, op) to change_log. Clients remember the last seq they
+# saw and ask GET /sync?since=<seq> for just what changed after it.
+#
+# ORM writes are picked up by session events; bulk UPDATEs (stock.py) call
+# record() themselves. resolver.py also logs product_aliases, for other
+# workers' resolvers; /sync skips tables it doesn't serve. Seqs are handed out right before COMMIT from a single
+# counter row. Its row lock is held only for that instant, and it makes seq
+# order match commit order, so a client can never skip past a slower
+# transaction's changes. The counter row is created by the first commit that
+# logs anything; on PostgreSQL and SQLite that is one INSERT ... ON CONFLICT
+# DO UPDATE, so two first commits at once can't both try to insert it.
+
+TRACKED = {Product: "products", Customer: "customers", Supplier: "suppliers", Company: "companies"}
+MODELS = {table: model for model, table in TRACKED.items()}
+SYNC_PAGE = 5000
+UPSERT_DIALECTS = {"postgresql": postgresql, "sqlite": sqlite}
+
+
+def record(session: Session, table: str, row_ids, op: str = "upsert"):
+    pending = session.info.setdefault("changes", {})
+    for row_id in row_ids:
+        pending[(table, row_id)] = op
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect(session, flush_context):
+    for obj in session.new:
+        if type(obj) in TRACKED:
+            record(session, TRACKED[type(obj)], [obj.id])
+    for obj in session.dirty:
+        if type(obj) in TRACKED and session.is_modified(obj):
+            record(session, TRACKED[type(obj)], [obj.id])
+    for obj in session.deleted:
+        if type(obj) in TRACKED:
+            record(session, TRACKED[type(obj)], [obj.id], "delete")
+
+
+def _increment(session, n: int):
+    return session.execute(
+        update(ChangeCounter).where(ChangeCounter.id == 1)
+        .values(seq=ChangeCounter.seq + n)
+        .returning(ChangeCounter.seq)
+    ).scalar()
+
+
+def _advance(session, n: int) -> int:
+    """Reserve n seqs; returns the last one."""
+    dialect = UPSERT_DIALECTS.get(session.get_bind().dialect.name)
+    if dialect is not None:
+        stmt = dialect.insert(ChangeCounter).values(id=1, seq=n)
+        return session.execute(
+            stmt.on_conflict_do_update(index_elements=["id"], set_={"seq": ChangeCounter.seq + n})
+            .returning(ChangeCounter.seq)
+        ).scalar()
+    top = _increment(session, n)
+    if top is not None:
+        return top
+    try:
+        with session.begin_nested():
+            session.execute(insert(ChangeCounter).values(id=1, seq=n))
+        return n
+    except IntegrityError:
+        # Another first commit created it in the meantime
+        return _increment(session, n)
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _write(session):
+    session.flush()  # pick up anything still pending
+    pending = session.info.pop("changes", None)
+    if not pending:
+        return
+    top = _advance(session, len(pending))
+    now = datetime.utcnow()
+    session.execute(insert(ChangeLog), [
+        {"seq": top - len(pending) + n, "table_name": table, "row_id": row_id, "op": op, "changed_at": now}
+        for n, ((table, row_id), op) in enumerate(pending.items(), 1)
+    ])
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard(session):
+    session.info.pop("changes", None)
+
+
+def changes_since(db: Session, since: int, limit: int = SYNC_PAGE) -> dict:
+    entries = db.execute(
+        select(ChangeLog.seq, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op)
+        .where(ChangeLog.seq > since)
+        .order_by(ChangeLog.seq)
+        .limit(limit + 1)
+    ).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}  # last op per row wins
+    for _, table, row_id, op in entries:
+        latest[(table, row_id)] = op
+
+    changes = {}
+    for table, model in MODELS.items():
+        ids = [row_id for (t, row_id), op in latest.items() if t == table and op == "upsert"]
+        deletes = {row_id for (t, row_id), op in latest.items() if t == table and op == "delete"}
+        rows = fetch_rows(db, model, table_fields(model), model.id.in_(ids)) if ids else []
+        # Rows deleted outside the ORM are tombstones too
+        deletes |= set(ids) - {r["id"] for r in rows}
+        if rows or deletes:
+            changes[table] = {"upserts": rows, "deletes": sorted(deletes)}
+
+    return {
+        "since": since,
+        "next": entries[-1][0] if entries else since,
+        "more": more,
+        "changes": changes,
+    }
+
+
+def compact_changelog(db: Session) -> int:
+    # Only the newest entry per row matters to a client; drop the rest
+    newest = (
+        select(func.max(ChangeLog.seq))
+        .group_by(ChangeLog.table_name, ChangeLog.row_id)
+        .scalar_subquery()
+    )
+    removed = db.execute(delete(ChangeLog).where(ChangeLog.seq.not_in(newest))).rowcount
+    db.commit()
+    return removed
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import Counter
+
+from fastapi import WebSocket
+
+from .backplane import make_transport
+
+# --- 💬 CHAT CONNECTIONS + PRESENCE ---
+# Each worker keeps its own websockets and a copy of the shared presence
+# registry: worker id -> usernames online on that worker. A user is online if
+# any live worker lists them, so several tabs or workers count once.
+#
+# Presence is coalesced. Connects/disconnects only mark the user dirty; every
+# PRESENCE_FLUSH_SECONDS the worker publishes the net change. A page reload
+# (disconnect + connect) then produces no status updates at all. Workers also
+# send their full list every PRESENCE_HEARTBEAT_SECONDS. Workers silent for
+# three heartbeats are dropped, so a crashed worker's users go offline.
+
+PRESENCE_FLUSH_SECONDS = float(os.getenv("PRESENCE_FLUSH_SECONDS", "1"))
+PRESENCE_HEARTBEAT_SECONDS = float(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "10"))
+
+
+class ConnectionManager:
+    def __init__(self, transport=None):
+        self.worker_id = uuid.uuid4().hex
+        self.transport = transport or make_transport()
+        self.active_connections: dict[str, set[WebSocket]] = {}
+        self._dirty = set()
+        self._announced = set()  # what other workers last heard from us
+        self._workers: dict[str, set[str]] = {}  # the shared registry
+        self._seen: dict[str, float] = {}
+        self._online = Counter()  # username -> number of workers listing it
+        self._task = None
+
+    # --- lifecycle (called from the app lifespan) ---
+    async def start(self):
+        await self.transport.start(self._on_envelope, self._hello)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def _hello(self):
+        # Ask the other workers for their lists and share ours
+        await self.transport.publish({"kind": "hello", "origin": self.worker_id})
+        await self._heartbeat()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.transport.publish({"kind": "bye", "origin": self.worker_id})
+        await self.transport.stop()
+
+    # --- local sockets ---
+    async def connect(self, username: str, websocket: WebSocket):
+        await websocket.accept()
+        self.active_connections.setdefault(username, set()).add(websocket)
+        await self._mark(username)
+
+    async def disconnect(self, username: str, websocket: WebSocket = None):
+        sockets = self.active_connections.get(username, set())
+        if websocket is None:
+            sockets.clear()
+        else:
+            sockets.discard(websocket)
+        if not sockets:
+            self.active_connections.pop(username, None)
+        await self._mark(username)
+
+    async def _deliver(self, message: dict, receiver: str):
+        for websocket in list(self.active_connections.get(receiver, ())):
+            try:
+                await websocket.send_json(message)
+            except Exception:
+                pass
+
+    async def send_personal_message(self, message: dict, receiver: str):
+        local = receiver in self.active_connections
+        if local:
+            await self._deliver(message, receiver)
+        # Also relay if they are (or may be, registry not synced yet) on another worker
+        elsewhere = any(receiver in users for w, users in self._workers.items() if w != self.worker_id)
+        if not local or elsewhere:
+            await self.transport.publish(
+                {"kind": "direct", "origin": self.worker_id, "to": receiver, "message": message}
+            )
+
+    # Broadcast status changes to everyone connected to this worker;
+    # every worker does the same when it sees the registry change.
+    async def broadcast_status(self, username: str, status: str):
+        payload = {
+            "type": "status_update",
+            "username": username,
+            "status": status  # "online" or "offline"
+        }
+        for sockets in list(self.active_connections.values()):
+            for connection in list(sockets):
+                try:
+                    await connection.send_json(payload)
+                except Exception:
+                    pass
+
+    # --- presence ---
+    def online_users(self) -> set:
+        return {name for name, workers in self._online.items() if workers > 0}
+
+    def is_online(self, username: str) -> bool:
+        return self._online[username] > 0
+
+    async def _mark(self, username: str):
+        self._dirty.add(username)
+        if self._task is None:
+            await self._flush()  # not started (e.g. tests): no batching
+
+    async def _flush_loop(self):
+        beat = time.monotonic()
+        while True:
+            await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
+            try:
+                await self._flush()
+                if time.monotonic() - beat >= PRESENCE_HEARTBEAT_SECONDS:
+                    beat = time.monotonic()
+                    await self._heartbeat()
+                    await self._expire()
+            except Exception as e:
+                print(f"Presence flush failed: {e}")
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        online = {u for u in dirty if u in self.active_connections and u not in self._announced}
+        offline = {u for u in dirty if u not in self.active_connections and u in self._announced}
+        if not online and not offline:
+            return
+        self._announced = (self._announced | online) - offline
+        await self._apply(self.worker_id, self._announced)
+        await self.transport.publish({
+            "kind": "presence", "origin": self.worker_id,
+            "online": sorted(online), "offline": sorted(offline),
+        })
+
+    async def _heartbeat(self):
+        await self.transport.publish({"kind": "full", "origin": self.worker_id, "online": sorted(self._announced)})
+
+    async def _expire(self):
+        cutoff = time.monotonic() - 3 * PRESENCE_HEARTBEAT_SECONDS
+        for worker in [w for w, seen in self._seen.items() if seen < cutoff]:
+            del self._seen[worker]
+            await self._apply(worker, set())
+            self._workers.pop(worker, None)
+
+    async def _apply(self, worker: str, users: set):
+        # Replace one worker's list and tell local sockets about global changes
+        before = self._workers.get(worker, set())
+        self._workers[worker] = set(users)
+        changes = []
+        for name in users - before:
+            self._online[name] += 1
+            if self._online[name] == 1:
+                changes.append((name, "online"))
+        for name in before - users:
+            self._online[name] -= 1
+            if self._online[name] <= 0:
+                del self._online[name]
+                changes.append((name, "offline"))
+        for name, status in changes:
+            await self.broadcast_status(name, status)
+
+    async def _on_envelope(self, envelope: dict):
+        origin = envelope.get("origin")
+        if origin == self.worker_id:
+            return
+        kind = envelope.get("kind")
+        if kind == "direct":
+            await self._deliver(envelope["message"], envelope["to"])
+            return
+        if kind == "bye":
+            self._seen.pop(origin, None)
+            await self._apply(origin, set())
+            self._workers.pop(origin, None)
+            return
+        self._seen[origin] = time.monotonic()
+        if kind == "hello":
+            await self._heartbeat()  # let the new worker catch up right away
+        elif kind == "full":
+            await self._apply(origin, set(envelope["online"]))
+        elif kind == "presence":
+            users = self._workers.get(origin, set())
+            await self._apply(origin, (users | set(envelope["online"])) - set(envelope["offline"]))
+
+
+manager = ConnectionManager()
@@ -0,0 +1,88 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# --- 🗜 RESPONSE COMPRESSION ---
+# Compresses single-body responses of at least COMPRESS_MIN_BYTES, using
+# brotli when the client accepts it (and the package is installed), else
+# gzip. Small bodies go out as-is: below ~1 KB compression saves next to
+# nothing and costs CPU. Streamed and already-compressed responses (zip,
+# images) pass through untouched.
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))  # 4-6: good ratio at gzip-like speed
+SKIP_TYPES = ("application/zip", "image/", "video/", "audio/")
+
+
+def _accepted(headers) -> str:
+    accept = ""
+    for key, value in headers:
+        if key == b"accept-encoding":
+            accept = value.decode("latin-1").lower()
+    encodings = {part.split(";")[0].strip() for part in accept.split(",")}
+    if brotli is not None and "br" in encodings:
+        return "br"
+    if "gzip" in encodings:
+        return "gzip"
+    return ""
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = _accepted(scope["headers"])
+        if not encoding:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message  # held until we see the body
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            headers = dict(start["headers"])
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            if (
+                message.get("more_body")
+                or len(body) < self.minimum_size
+                or b"content-encoding" in headers
+                or content_type.startswith(SKIP_TYPES)
+            ):
+                passthrough = True
+                await send(start)
+                return await send(message)
+
+            compressed = compress(body, encoding)
+            out = [(k, v) for k, v in start["headers"] if k not in (b"content-length", b"vary")]
+            vary = headers.get(b"vary", b"")
+            out += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", (vary + b", " if vary else b"") + b"Accept-Encoding"),
+            ]
+            await send({**start, "headers": out})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,21 +1,288 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy import create_engine, event, inspect, text, literal, bindparam, Column, String
+from sqlalchemy.exc import CompileError, DBAPIError, OperationalError
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, with_loader_criteria
+from starlette.requests import HTTPConnection
+from fastapi import HTTPException
+from jose import JWTError, jwt
 from dotenv import load_dotenv
+from .security import SECRET_KEY, ALGORITHM
 import os
+import threading
+import time
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional read replica (its own engine + pool). Unset = everything on the primary.
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+# Tenant for requests that carry no token (the frontend only sends one on a few screens)
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "Medivision")
+# Business endpoints refuse requests without a valid token. A single-distributor
+# install may set TENANT_REQUIRED=0: tokenless requests then act for DEFAULT_TENANT.
+TENANT_REQUIRED = os.getenv("TENANT_REQUIRED", "1") == "1"
+# Login, and chat sockets (browsers can't send headers on them; chat is not per tenant)
+PUBLIC_PATHS = ("/auth/login", "/ws/")
 
 engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+replica_engine = create_engine(DATABASE_REPLICA_URL, pool_pre_ping=True) if DATABASE_REPLICA_URL else None
+ReplicaSession = sessionmaker(bind=replica_engine, autoflush=False, autocommit=False) if replica_engine else None
+
 class Base(DeclarativeBase):
     pass
 
+
+def add_missing_columns(bind, table, name: str = None):
+    """create_all never alters existing tables: add model columns the live table lacks."""
+    name = name or table.name
+    existing = {c["name"] for c in inspect(bind).get_columns(name)}
+    preparer = bind.dialect.identifier_preparer
+    for column in table.columns:
+        if column.name in existing or not column.nullable:
+            continue
+        ddl = f"ALTER TABLE {preparer.quote(name)} ADD COLUMN {preparer.quote(column.name)} " \
+              f"{column.type.compile(bind.dialect)}"
+        backfill = column.default is not None and column.default.is_scalar
+        if backfill:
+            # Existing rows get the default too, as this dialect's SQL literal where it has one
+            try:
+                value = literal(column.default.arg, column.type)
+                ddl += f" DEFAULT {value.compile(dialect=bind.dialect, compile_kwargs={'literal_binds': True})}"
+                backfill = False
+            except CompileError:
+                pass  # e.g. JSON: filled with a bound parameter below
+        with bind.begin() as conn:
+            conn.execute(text(ddl))
+            if backfill:
+                conn.execute(
+                    text(f"UPDATE {preparer.quote(name)} SET {preparer.quote(column.name)} = :value")
+                    .bindparams(bindparam("value", column.default.arg, type_=column.type))
+                )
+        print(f"Added column {name}.{column.name}")
+
+
+def drop_changed_indexes(bind, table):
+    """Drop live indexes whose columns or uniqueness no longer match the model, so they are recreated."""
+    live = {i["name"]: i for i in inspect(bind).get_indexes(table.name)}
+    for index in table.indexes:
+        found = live.get(index.name)
+        if found is None:
+            continue
+        if found["column_names"] == [c.name for c in index.columns] and bool(found["unique"]) == bool(index.unique):
+            continue
+        with bind.begin() as conn:
+            conn.execute(text(f"DROP INDEX {bind.dialect.identifier_preparer.quote(index.name)}"))
+        print(f"Dropped index {index.name} (definition changed)")
+
+# --- 🏢 TENANTS ---
+# Several distributors can share one deployment. Every master and transaction
+# row carries the distributor it belongs to (tenant = User.company of whoever
+# wrote it). The request's session knows its tenant (db.info["tenant"], from
+# the bearer token), and two session hooks make that invisible to the code:
+#   * every ORM SELECT / UPDATE / DELETE on a Tenanted model gets
+#     "AND tenant = :tenant", joins and subqueries included
+#   * every INSERT fills tenant from the session, ORM flushes and bulk
+#     insert(Model) lists alike (column default, via the connection)
+# Core selects on Model.__table__ bypass the ORM hook; history reads go
+# through partitions.routed(), which applies the same filter. Sessions with
+# no tenant (startup migrations, the job scheduler) see every tenant's rows.
+def row_tenant(context) -> str:
+    # Column default: the tenant of the session that holds the connection
+    return context.connection.info.get("tenant") or DEFAULT_TENANT
+
+
+class Tenanted:
+    # Nullable so add_missing_columns can add it; tenancy.backfill_tenants fills old rows
+    tenant = Column(String(128), default=row_tenant)
+
+
+def _scope_to_tenant(state):
+    tenant = state.session.info.get("tenant")
+    if tenant is not None and (state.is_select or state.is_update or state.is_delete):
+        state.statement = state.statement.options(
+            with_loader_criteria(Tenanted, lambda cls: cls.tenant == tenant, include_aliases=True)
+        )
+
+
+def _stamp_connection(session, transaction, connection):
+    # Read by Tenanted.tenant's default while this session holds the connection
+    connection.info["tenant"] = session.info.get("tenant")
+
+
+for _factory in (SessionLocal, ReplicaSession):
+    if _factory is not None:
+        event.listen(_factory, "do_orm_execute", _scope_to_tenant)
+        event.listen(_factory, "after_begin", _stamp_connection)
+
+
+def tenant_of(db) -> str:
+    """The session's tenant; sessions without one act for the default tenant."""
+    return db.info.get("tenant") or DEFAULT_TENANT
+
+
+def _token_company(auth: str):
+    """Company a bearer token belongs to, or None if it doesn't decode to one."""
+    scheme, _, token = auth.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    company = payload.get("company")
+    if company is None and payload.get("sub"):
+        # Tokens issued before the company claim was added
+        with engine.connect() as conn:
+            company = conn.execute(
+                text("SELECT company FROM users WHERE username = :username"),
+                {"username": payload["sub"]},
+            ).scalar()
+    return company or None
+
+
+def _request_tenant(connection: HTTPConnection):
+    public = connection.url.path.startswith(PUBLIC_PATHS)
+    auth = connection.headers.get("authorization")
+    if not auth:
+        if TENANT_REQUIRED and not public:
+            raise HTTPException(status_code=401, detail="Sign in to access this distributor's data")
+        return DEFAULT_TENANT
+    company = _token_company(auth)
+    if company:
+        return company
+    if public:
+        return DEFAULT_TENANT  # e.g. logging in again with a stale token still attached
+    # An expired or forged token must never fall through to another tenant's data
+    raise HTTPException(status_code=401, detail="Session expired. Please login again.")
+
+# --- 🔀 READ/WRITE ROUTING ---
+# Write paths use get_db (primary). Read-only endpoints use get_read_db, which
+# hands out a replica session unless:
+#   * this client committed on the primary in the last READ_YOUR_WRITES_SECONDS
+#     (the replica may not have caught up with its own write yet), or
+#   * the replica failed recently; it is skipped for REPLICA_RETRY_SECONDS.
+# A replica failure is noticed at the engine (handle_error), so it counts even
+# when the endpoint catches the exception, and the failing read is re-run on
+# the primary in the same session.
+# Pins live in this worker's memory, so a client bouncing between workers can
+# still land on a lagging replica for a moment after writing.
+_pins = {}  # client key -> monotonic time the pin expires
+_replica_down_until = 0.0
+_lock = threading.Lock()
+
+
+def _client_key(connection: HTTPConnection):
+    auth = connection.headers.get("authorization")
+    if auth:
+        return auth
+    return connection.client.host if connection.client else None
+
+
+def _pinned(key) -> bool:
+    with _lock:
+        expires = _pins.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del _pins[key]
+            return False
+        return True
+
+
+def recently_wrote(db) -> bool:
+    """True if this session's client committed in the last READ_YOUR_WRITES_SECONDS."""
+    key = db.info.get("client")
+    return key is not None and _pinned(key)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _pin_after_write(session):
+    key = session.info.get("client")
+    if key is None:
+        return
+    now = time.monotonic()
+    with _lock:
+        _pins[key] = now + READ_YOUR_WRITES_SECONDS
+        if len(_pins) > 10000:  # drop expired pins now and then
+            for k in [k for k, exp in _pins.items() if exp < now]:
+                del _pins[k]
+
+
+if ReplicaSession is not None:
+    @event.listens_for(ReplicaSession, "before_flush")
+    def _read_only(session, flush_context, instances):
+        raise RuntimeError("write attempted on a read-replica session; use get_db for this endpoint")
+
+
+def _replica_down() -> bool:
+    return time.monotonic() < _replica_down_until
+
+
+def _mark_replica_down(error):
+    global _replica_down_until
+    if not _replica_down():
+        print(f"Read replica unavailable, using primary for {REPLICA_RETRY_SECONDS:.0f}s: {error}")
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+
+
+if replica_engine is not None:
+    @event.listens_for(replica_engine, "handle_error")
+    def _replica_error(context):
+        # Lost connections and operational failures (not bad SQL) take the replica out of rotation
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            _mark_replica_down(context.original_exception)
+
+    @event.listens_for(ReplicaSession, "do_orm_execute")
+    def _retry_on_primary(state):
+        # Registered after _scope_to_tenant, so the retried statement keeps the tenant filter
+        try:
+            return state.invoke_statement()
+        except DBAPIError:
+            if not _replica_down():
+                raise
+            # The rest of this session's reads go to the primary too
+            state.session.bind = engine
+            return state.invoke_statement()
+
+
+def _replica_session(key, tenant):
+    if ReplicaSession is None or _pinned(key) or _replica_down():
+        return None
+    db = ReplicaSession()
+    db.info["tenant"] = tenant
+    try:
+        db.connection()  # checkout + pre-ping now, so a dead replica falls back here
+    except DBAPIError as e:
+        db.close()
+        _mark_replica_down(e)
+        return None
+    return db
+
+
 # Dependency for FastAPI routes
-def get_db():
+def get_db(connection: HTTPConnection):
+    tenant = _request_tenant(connection)
     db = SessionLocal()
+    db.info["client"] = _client_key(connection)
+    db.info["tenant"] = tenant
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Dependency for read-only routes (search, dashboard, reports, history)
+def get_read_db(connection: HTTPConnection):
+    tenant = _request_tenant(connection)
+    key = _client_key(connection)
+    db = _replica_session(key, tenant)
+    if db is None:
+        db = SessionLocal()
+        db.info["client"] = key
+    db.info["tenant"] = tenant
     try:
         yield db
     finally:
@@ -0,0 +1,181 @@
+from sqlalchemy import select, update, func, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .db import DEFAULT_TENANT
+from .models import Company, Division, Product
+from .changelog import record
+from .versions import bump_version
+
+# --- 🏷 DIVISIONS ---
+# Divisions live in their own table: divisions(company_id -> companies) and
+# products.division_id -> divisions. Division reports and the division filter
+# on search read the (division_id, name) index on products instead of
+# string-matching Product.division or unpacking Company.divisions JSON.
+#
+# The text columns stay, since the frontend reads and writes them; the ids are
+# kept in step on every company / product create. A product's division text
+# is matched to a division of its manufacturer's company first, then to the
+# only division with that name. Names no company lists get a division row
+# with no company, which a company claims once it lists that name; a partial
+# unique index keeps that to one row per name.
+
+
+def _clean(name) -> str:
+    return (name or "").strip()
+
+
+def _create(db: Session, company_id, name: str) -> int:
+    try:
+        with db.begin_nested():
+            division = Division(company_id=company_id, name=name)
+            db.add(division)
+        return division.id
+    except IntegrityError:
+        # Created concurrently
+        return db.execute(
+            select(Division.id).where(Division.company_id == company_id, Division.name == name)
+        ).scalar()
+
+
+def merge_unowned_divisions(engine):
+    # Before the startup index loop: duplicate company-less rows (from before
+    # uq_divisions_unowned_name) are merged into the oldest one
+    if "divisions" not in inspect(engine).get_table_names():
+        return
+    tenanted = "tenant" in {c["name"] for c in inspect(engine).get_columns("divisions")}
+    with engine.begin() as conn:
+        rows = conn.execute(text(
+            f"SELECT id, {'tenant' if tenanted else 'NULL'}, name FROM divisions "
+            f"WHERE company_id IS NULL ORDER BY id"
+        )).all()
+        keep, merged = {}, 0
+        for division_id, tenant, name in rows:
+            key = (tenant or DEFAULT_TENANT, name)  # untagged rows become the default tenant's
+            if key not in keep:
+                keep[key] = division_id
+                continue
+            conn.execute(text("UPDATE products SET division_id = :keep WHERE division_id = :dup"),
+                         {"keep": keep[key], "dup": division_id})
+            conn.execute(text("DELETE FROM divisions WHERE id = :dup"), {"dup": division_id})
+            merged += 1
+    if merged:
+        print(f"Merged {merged} duplicate divisions without a company")
+
+
+def resolve_division(db: Session, name, company_name=None) -> int:
+    """Division id for a product's division text, creating the division if needed."""
+    name = _clean(name)
+    if not name:
+        return None
+    company_id = db.execute(select(Company.id).where(Company.name == company_name)).scalar() if company_name else None
+    candidates = db.execute(select(Division.id, Division.company_id).where(Division.name == name)).all()
+    for division_id, owner in candidates:
+        if company_id is not None and owner == company_id:
+            return division_id
+    if len(candidates) == 1:
+        return candidates[0][0]
+    for division_id, owner in candidates:
+        if owner is None:
+            return division_id
+    return _create(db, company_id, name)
+
+
+def sync_company(db: Session, company_id: int, names):
+    """Make the divisions table match a company's division list (adds only). Caller commits."""
+    names = {_clean(n) for n in names or []} - {""}
+    if not names:
+        return
+    have = {n for (n,) in db.execute(
+        select(Division.name).where(Division.company_id == company_id, Division.name.in_(names))
+    )}
+    for name in names - have:
+        # A division products already used before the company listed it
+        claimed = db.execute(
+            update(Division)
+            .where(Division.company_id.is_(None), Division.name == name)
+            .values(company_id=company_id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            _create(db, company_id, name)
+
+
+def division_stock(db: Session, division_id: int) -> list:
+    return [
+        {"id": product_id, "code": code, "name": name, "stock": stock}
+        for product_id, code, name, stock in db.execute(
+            select(Product.id, Product.code, Product.name, Product.current_stock)
+            .where(Product.division_id == division_id)
+            .order_by(Product.name)
+        )
+    ]
+
+
+def list_divisions(db: Session, company_id: int = None) -> list:
+    counts = (
+        select(Product.division_id, func.count().label("products"),
+               func.coalesce(func.sum(Product.current_stock), 0).label("stock"))
+        .where(Product.division_id.isnot(None))
+        .group_by(Product.division_id)
+        .subquery()
+    )
+    stmt = (
+        select(Division.id, Division.name, Division.company_id, Company.name,
+               func.coalesce(counts.c.products, 0), func.coalesce(counts.c.stock, 0))
+        .outerjoin(Company, Company.id == Division.company_id)
+        .outerjoin(counts, counts.c.division_id == Division.id)
+        .order_by(Company.name, Division.name)
+    )
+    if company_id is not None:
+        stmt = stmt.where(Division.company_id == company_id)
+    return [
+        {"id": division_id, "name": name, "company_id": owner, "company": company,
+         "products": products, "stock": stock}
+        for division_id, name, owner, company, products, stock in db.execute(stmt)
+    ]
+
+
+def backfill_divisions(db: Session):
+    # Startup migration: rows for every company's JSON list, then link products
+    # that have division text but no division_id. Does nothing once in step.
+    for company_id, names in db.execute(select(Company.id, Company.divisions)).all():
+        sync_company(db, company_id, names if isinstance(names, list) else [])
+    unlinked = db.execute(
+        select(Product.division, Product.manufacturer)
+        .where(Product.division_id.is_(None), Product.division.isnot(None), Product.division != "")
+        .distinct()
+    ).all()
+    linked = []
+    for name, manufacturer in unlinked:
+        division_id = resolve_division(db, name, manufacturer)
+        if division_id is None:
+            continue
+        linked += db.scalars(
+            update(Product)
+            .where(Product.division_id.is_(None), Product.division == name,
+                   Product.manufacturer == manufacturer if manufacturer is not None else Product.manufacturer.is_(None))
+            .values(division_id=division_id)
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+    if linked:
+        # Bulk UPDATEs bypass the ORM events: log and version them like a product edit
+        record(db, "products", linked)
+        bump_version(db, "products")
+    db.commit()
+    if unlinked:
+        print(f"Linked products to divisions for {len(unlinked)} division name(s)")
+
+
+def ensure_foreign_key(engine):
+    # add_missing_columns can't add the FK on a live table; PostgreSQL can do it afterwards
+    if engine.dialect.name != "postgresql":
+        return
+    if any(fk["constrained_columns"] == ["division_id"] for fk in inspect(engine).get_foreign_keys("products")):
+        return
+    with engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE products ADD CONSTRAINT fk_products_division "
+            "FOREIGN KEY (division_id) REFERENCES divisions (id) ON DELETE SET NULL"
+        ))
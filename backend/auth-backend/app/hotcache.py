@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+from fastapi import Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal, recently_wrote, tenant_of
+
+# --- ⚡ HOT READ CACHE (single-flight + short TTL) ---
+# Autocomplete and dashboards fire the same request from many counters at
+# once. For the endpoints wrapped with respond():
+#   * identical concurrent requests share one computation: the first one runs
+#     it, the others wait for its result ("coalesced")
+#   * the serialized JSON is kept in a small LRU for HOT_CACHE_TTL_SECONDS
+#   * every entry is tagged with the tables it reads; a commit that wrote one
+#     of them drops those entries. Writes are seen from the session itself
+#     (ORM flushes and bulk insert/update/delete statements), so write
+#     endpoints need no extra calls.
+# Keys and tags are per tenant (db.Tenanted): a write only drops the writing
+# tenant's entries, so one distributor's busy counters don't empty another's
+# cache. Writes from sessions without a tenant (jobs, startup) drop every
+# tenant's entries for those tables.
+# A computation that overlaps an invalidation still answers its waiters but
+# is not stored. The cache is per worker: a write on another worker is
+# picked up when the TTL runs out. A client that just wrote (see db.py pins)
+# bypasses the cache, so it always reads its own write.
+
+TTL_SECONDS = float(os.getenv("HOT_CACHE_TTL_SECONDS", "3"))
+MAX_ENTRIES = int(os.getenv("HOT_CACHE_ENTRIES", "1000"))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+        self.error = None
+
+
+class HotCache:
+    def __init__(self, ttl: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (tenant, key) -> (expires, tables, body)
+        self._flights = {}
+        self._generation = {}  # (tenant or None, table) -> bumped on every committed write
+        self.stats = dict.fromkeys(("hits", "misses", "coalesced", "bypassed", "invalidated", "evicted"), 0)
+
+    def _seen(self, tenant, tables) -> list:
+        return [(self._generation.get((tenant, t), 0), self._generation.get((None, t), 0)) for t in tables]
+
+    def get(self, tenant, key, tables, compute) -> bytes:
+        """JSON body for the tenant's key, from the cache, a running computation, or compute()."""
+        key = (tenant, key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[2]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                seen = self._seen(tenant, tables)
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.body
+
+        try:
+            flight.body = orjson.dumps(compute())
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                fresh = seen == self._seen(tenant, tables)
+                if flight.error is None and fresh:
+                    self._entries[key] = (time.monotonic() + self.ttl, frozenset(tables), flight.body)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.stats["evicted"] += 1
+            flight.done.set()
+        return flight.body
+
+    def invalidate(self, tables, tenant=None):
+        """Drop the tenant's entries that read any of the tables (every tenant's if tenant is None)."""
+        tables = set(tables)
+        with self._lock:
+            for table in tables:
+                self._generation[(tenant, table)] = self._generation.get((tenant, table), 0) + 1
+            stale = [key for key, (_, tags, _) in self._entries.items()
+                     if tags & tables and (tenant is None or key[0] == tenant)]
+            for key in stale:
+                del self._entries[key]
+            self.stats["invalidated"] += len(stale)
+
+    def count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "in_flight": len(self._flights),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                # Share of lookups that didn't run their own query
+                "hit_ratio": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 3) if lookups else None,
+            }
+
+
+hot = HotCache()
+
+
+def respond(db: Session, key, tables, compute) -> Response:
+    if recently_wrote(db):
+        hot.count("bypassed")
+        body = orjson.dumps(compute())
+    else:
+        body = hot.get(tenant_of(db), key, tuple(tables), compute)
+    return Response(body, media_type="application/json")
+
+
+# --- which tables a transaction wrote ---
+def _touch(session, table):
+    session.info.setdefault("written_tables", set()).add(table)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _flushed(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table:
+            _touch(session, table)
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _bulk_write(state):
+    # update(Product)..., insert(SalesInvoice), query(...).delete()
+    if (state.is_insert or state.is_update or state.is_delete) and state.bind_mapper is not None:
+        _touch(state.session, state.bind_mapper.local_table.name)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _committed(session):
+    tables = session.info.pop("written_tables", None)
+    if tables:
+        hot.invalidate(tables, session.info.get("tenant"))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _rolled_back(session):
+    session.info.pop("written_tables", None)
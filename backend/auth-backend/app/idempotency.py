@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, insert, select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from .models import IdempotencyKey
+
+# --- 🔁 IDEMPOTENCY KEYS ---
+# Counters retry POSTs on flaky links. A client sends the same
+# Idempotency-Key header on every retry of one submission; the first request
+# runs and retries get its response back without touching the DB.
+#
+# Keys live in idempotency_keys, unique per (tenant, scope, key), so a retry
+# that lands on another worker or comes in after a restart is caught too.
+# The key row is inserted right before the request's own COMMIT, in the same
+# transaction as its stock and invoice writes: a request that rolls back
+# leaves no key, and of two attempts racing each other only one can commit
+# (the other hits the unique key, rolls back, and replays the winner's
+# response). The response itself is stored just after that commit; a retry
+# arriving in between gets a 409 and tries again.
+#
+# Keys are kept at least IDEMPOTENCY_TTL_SECONDS; the nightly
+# idempotency_cleanup job (tasks.py) deletes older ones.
+
+TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+
+def _saved(db: Session, scope: str, key: str):
+    return db.execute(
+        select(IdempotencyKey.fingerprint, IdempotencyKey.response)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+    ).first()
+
+
+def _replay(saved, fingerprint: str):
+    if saved.fingerprint != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different payload")
+    if saved.response is None:
+        raise HTTPException(status_code=409, detail="Original request is still being processed")
+    return JSONResponse(saved.response, headers={"Idempotent-Replayed": "true"})
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _write(session):
+    # Kept across rollbacks, so a request that retries its own transaction
+    # (bulk_sales) still commits the key with whichever attempt goes through
+    pending = session.info.get("idempotency")
+    if pending:
+        session.execute(insert(IdempotencyKey).values(**pending))
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _written(session):
+    session.info.pop("idempotency", None)
+
+
+def run_once(db: Session, scope: str, key, payload, fn):
+    """Run fn() once per (tenant, scope, Idempotency-Key); no key means no dedup.
+
+    fn writes through db and commits it; the key is committed along with it.
+    """
+    if not key:
+        return fn()
+    fingerprint = hashlib.sha256(
+        json.dumps(jsonable_encoder(payload), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    saved = _saved(db, scope, key)
+    if saved:
+        return _replay(saved, fingerprint)
+
+    db.info["idempotency"] = {"scope": scope, "key": key, "fingerprint": fingerprint}
+    try:
+        body = jsonable_encoder(fn())
+    except Exception:
+        db.rollback()
+        db.info.pop("idempotency", None)
+        saved = _saved(db, scope, key)
+        if saved:
+            # Another attempt with this key committed first
+            return _replay(saved, fingerprint)
+        raise
+
+    if db.info.pop("idempotency", None):
+        # fn had nothing to commit; remember its answer all the same
+        try:
+            db.execute(insert(IdempotencyKey).values(scope=scope, key=key, fingerprint=fingerprint, response=body))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return _replay(_saved(db, scope, key), fingerprint)
+        return body
+    db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+        .values(response=body)
+    )
+    db.commit()
+    return body
+
+
+def purge_idempotency_keys(db: Session) -> int:
+    cutoff = datetime.utcnow() - timedelta(seconds=TTL_SECONDS)
+    removed = db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff)).rowcount
+    db.commit()
+    return removed
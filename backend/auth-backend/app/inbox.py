@@ -0,0 +1,141 @@
+from sqlalchemy import select, update, func, and_, or_, case, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import ChatMessage, ChatConversation
+
+# --- 📥 CHAT INBOX ---
+# chat_conversations holds one row per (owner, partner): the last message and
+# how many of the partner's messages the owner hasn't read. The websocket
+# handler updates both sides' rows in the same commit as the message, and
+# read markers zero the counter. The sidebar is then a single index range on
+# (owner, last_at), no matter how many messages there are.
+
+PREVIEW_CHARS = 200
+
+
+def _preview(text) -> str:
+    return (text or "")[:PREVIEW_CHARS]
+
+
+def _ensure(db: Session, owner: str, partner: str) -> bool:
+    """Create the row from history if it's missing. True if it was created."""
+    if db.get(ChatConversation, (owner, partner)) is not None:
+        return False
+    pair = or_(
+        and_(ChatMessage.sender == owner, ChatMessage.receiver == partner),
+        and_(ChatMessage.sender == partner, ChatMessage.receiver == owner),
+    )
+    last = db.execute(
+        select(ChatMessage.id, ChatMessage.message, ChatMessage.sender, ChatMessage.timestamp)
+        .where(pair).order_by(ChatMessage.id.desc()).limit(1)
+    ).first()
+    unread = db.execute(
+        select(func.count()).where(
+            ChatMessage.sender == partner, ChatMessage.receiver == owner,
+            ChatMessage.is_read.isnot(True),
+        )
+    ).scalar()
+    try:
+        with db.begin_nested():
+            db.add(ChatConversation(
+                owner=owner, partner=partner, unread=unread,
+                last_message_id=last.id if last else None,
+                last_message=_preview(last.message) if last else None,
+                last_sender=last.sender if last else None,
+                last_at=last.timestamp if last else None,
+            ))
+    except IntegrityError:
+        return False  # created concurrently by another message; update it instead
+    return True
+
+
+def record_message(db: Session, msg: ChatMessage):
+    # Caller commits together with the message insert
+    db.flush()  # id + timestamp
+    last = dict(last_message_id=msg.id, last_message=_preview(msg.message),
+                last_sender=msg.sender, last_at=msg.timestamp)
+    for owner, partner, bump in ((msg.sender, msg.receiver, 0), (msg.receiver, msg.sender, 1)):
+        # Backfilled rows already include the flushed message
+        if not _ensure(db, owner, partner):
+            db.execute(
+                update(ChatConversation)
+                .where(ChatConversation.owner == owner, ChatConversation.partner == partner)
+                .values(unread=ChatConversation.unread + bump, **last)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def mark_read(db: Session, owner: str, partner: str):
+    # Read marker: everything the partner sent so far is read
+    db.execute(
+        update(ChatMessage)
+        .where(ChatMessage.sender == partner, ChatMessage.receiver == owner, ChatMessage.is_read.isnot(True))
+        .values(is_read=True)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        update(ChatConversation)
+        .where(ChatConversation.owner == owner, ChatConversation.partner == partner)
+        .values(unread=0)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def inbox(db: Session, owner: str) -> dict:
+    rows = db.execute(
+        select(ChatConversation.partner, ChatConversation.last_message, ChatConversation.last_sender,
+               ChatConversation.last_at, ChatConversation.unread)
+        .where(ChatConversation.owner == owner)
+        .order_by(ChatConversation.last_at.desc())
+    ).all()
+    conversations = [
+        {"partner": partner, "last_message": message, "last_sender": sender,
+         "last_at": last_at.isoformat() if last_at else None, "unread": unread}
+        for partner, message, sender, last_at, unread in rows
+    ]
+    return {"conversations": conversations, "total_unread": sum(c["unread"] for c in conversations)}
+
+
+def rebuild_inbox(db: Session) -> int:
+    """Recompute every conversation row from chat_messages with grouped queries."""
+    # Each message counts for both participants
+    sides = [
+        select(ChatMessage.sender.label("owner"), ChatMessage.receiver.label("partner"),
+               ChatMessage.id.label("id"), literal(0).label("unread")),
+        select(ChatMessage.receiver.label("owner"), ChatMessage.sender.label("partner"), ChatMessage.id.label("id"),
+               case((ChatMessage.is_read.is_(True), 0), else_=1).label("unread")),
+    ]
+    both = sides[0].union_all(sides[1]).subquery()
+    grouped = db.execute(
+        select(both.c.owner, both.c.partner, func.max(both.c.id), func.sum(both.c.unread))
+        .group_by(both.c.owner, both.c.partner)
+    ).all()
+    last = {
+        m.id: m for m in db.execute(
+            select(ChatMessage.id, ChatMessage.message, ChatMessage.sender, ChatMessage.timestamp)
+            .where(ChatMessage.id.in_([g[2] for g in grouped]))
+        )
+    } if grouped else {}
+
+    db.query(ChatConversation).delete()
+    db.add_all([
+        ChatConversation(
+            owner=owner, partner=partner, unread=int(unread or 0), last_message_id=last_id,
+            last_message=_preview(last[last_id].message), last_sender=last[last_id].sender,
+            last_at=last[last_id].timestamp,
+        )
+        for owner, partner, last_id, unread in grouped
+        if owner and partner
+    ])
+    db.commit()
+    return len(grouped)
+
+
+def backfill_if_empty(db: Session):
+    # First start after upgrading: build the inbox from existing messages
+    if db.query(ChatConversation).first() is None and db.query(ChatMessage).first() is not None:
+        try:
+            rebuild_inbox(db)
+        except IntegrityError:
+            db.rollback()  # another worker got there first
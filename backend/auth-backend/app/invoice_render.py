@@ -0,0 +1,346 @@
+import glob
+import hashlib
+import html
+import io
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+
+from .models import SalesInvoice, SalesInvoiceItem
+
+# --- 🖨 INVOICE RENDERING ---
+# Turns a sales invoice into print-ready HTML or PDF on the server.
+# Layout is the expensive part, so it is cached on disk per invoice, keyed by
+# tenant and a hash of the invoice contents: {tenant}_{invoice_no}-{hash}.pages
+# (PDF page streams) / .html (body fragment). Any edit changes the hash;
+# update and delete also drop the invoice's files (that tenant's only). Cached pages are cheap to stitch into
+# one PDF, so batch prints only lay out the misses, spread over a process pool.
+
+CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "cache/invoices")
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(os.cpu_count() or 2)))
+POOL_THRESHOLD = 16  # below this many misses, a pool costs more than it saves
+FORMATS = ("pdf", "html")
+HASH_LENGTH = 16
+
+_pool = None
+
+
+# ---------- snapshots ----------
+
+def load_invoices(db: Session, invoice_nos) -> dict:
+    """invoice_no -> the same header/rows/totals/notes shape as GET /sales-invoice/{no}."""
+    invoice_nos = list(dict.fromkeys(invoice_nos))
+    headers = db.query(SalesInvoice).filter(SalesInvoice.invoice_no.in_(invoice_nos)).all()
+    items = {}
+    for item in (
+        db.query(SalesInvoiceItem)
+        .filter(SalesInvoiceItem.invoice_no.in_(invoice_nos))
+        .order_by(SalesInvoiceItem.id)
+    ):
+        items.setdefault(item.invoice_no, []).append(item)
+
+    snapshots = {}
+    for inv in headers:
+        snapshots[inv.invoice_no] = jsonable_encoder({
+            "header": {
+                "invoiceNo": inv.invoice_no, "invoiceDate": inv.invoice_date,
+                "tradingAccount": inv.trading_account, "customer": inv.customer,
+                "area": inv.area, "city": inv.city, "state": inv.state,
+                "paymentMode": inv.payment_mode, "dueDays": inv.due_days,
+            },
+            "rows": [
+                {"pcode": i.pcode, "name": i.name, "batch": i.batch, "exp": i.exp, "qty": i.qty,
+                 "free": i.free or 0, "rate": i.rate, "gst": i.gst, "discount": i.discount}
+                for i in items.get(inv.invoice_no, [])
+            ],
+            "totals": {
+                "subtotal": inv.subtotal, "totalDiscount": inv.total_discount,
+                "totalGST": inv.total_gst, "grandTotal": inv.grand_total,
+            },
+            "notes": inv.notes,
+        })
+    # Keep the caller's order
+    return {no: snapshots[no] for no in invoice_nos if no in snapshots}
+
+
+def content_hash(snapshot: dict) -> str:
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode("utf-8")).hexdigest()[:HASH_LENGTH]
+
+
+def _line_amount(row: dict) -> float:
+    # Same maths as the billing screen: discount %, then GST % on the taxable value
+    taxable = (row["qty"] or 0) * (row["rate"] or 0) * (1 - (row["discount"] or 0) / 100)
+    return taxable * (1 + (row["gst"] or 0) / 100)
+
+
+def _money(value) -> str:
+    return f"{(value or 0):,.2f}"
+
+
+# ---------- HTML ----------
+
+def render_html(snapshot: dict) -> str:
+    h, t = snapshot["header"], snapshot["totals"]
+    e = lambda v: html.escape("" if v is None else str(v))
+    rows = "".join(
+        f"<tr><td>{n}</td><td>{e(r['name'])}</td><td>{e(r['batch'])}</td><td>{e(r['exp'])}</td>"
+        f"<td class='num'>{e(r['qty'])}</td><td class='num'>{e(r['free'])}</td><td class='num'>{_money(r['rate'])}</td>"
+        f"<td class='num'>{e(r['gst'])}</td><td class='num'>{e(r['discount'])}</td>"
+        f"<td class='num'>{_money(_line_amount(r))}</td></tr>"
+        for n, r in enumerate(snapshot["rows"], 1)
+    )
+    gst = t["totalGST"] or 0
+    return (
+        f"<section class='invoice'>"
+        f"<h1>{e(h['tradingAccount'])}</h1><h2>TAX INVOICE</h2>"
+        f"<table class='meta'><tr><td>Invoice No: <b>{e(h['invoiceNo'])}</b></td>"
+        f"<td>Date: <b>{e(h['invoiceDate'])}</b></td></tr>"
+        f"<tr><td>Customer: <b>{e(h['customer'])}</b><br>{e(h['area'])} {e(h['city'])} {e(h['state'])}</td>"
+        f"<td>Payment: {e(h['paymentMode'])} ({e(h['dueDays'])} days)</td></tr></table>"
+        f"<table class='items'><thead><tr><th>#</th><th>Product</th><th>Batch</th><th>Exp</th><th>Qty</th>"
+        f"<th>Free</th><th>Rate</th><th>GST%</th><th>Disc%</th><th>Amount</th></tr></thead><tbody>{rows}</tbody></table>"
+        f"<table class='totals'>"
+        f"<tr><td>Subtotal</td><td class='num'>{_money(t['subtotal'])}</td></tr>"
+        f"<tr><td>Discount</td><td class='num'>{_money(t['totalDiscount'])}</td></tr>"
+        f"<tr><td>CGST</td><td class='num'>{_money(gst / 2)}</td></tr>"
+        f"<tr><td>SGST</td><td class='num'>{_money(gst / 2)}</td></tr>"
+        f"<tr><th>Grand Total</th><th class='num'>{_money(t['grandTotal'])}</th></tr></table>"
+        f"<p class='notes'>{e(snapshot['notes'])}</p></section>"
+    )
+
+
+HTML_PAGE = """<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title><style>
+body {{ font-family: Helvetica, Arial, sans-serif; font-size: 11px; }}
+.invoice {{ page-break-after: always; }} .invoice:last-child {{ page-break-after: auto; }}
+table {{ width: 100%; border-collapse: collapse; }} .items th, .items td {{ border: 1px solid #999; padding: 3px; }}
+.num {{ text-align: right; }} .totals {{ width: 40%; margin-left: 60%; }} h1, h2 {{ margin: 2px 0; text-align: center; }}
+@page {{ size: A4; margin: 12mm; }}
+</style></head><body>{body}</body></html>"""
+
+
+def html_document(fragments, title: str = "Invoices") -> bytes:
+    return HTML_PAGE.format(title=html.escape(title), body="".join(fragments)).encode("utf-8")
+
+
+# ---------- PDF ----------
+# A deliberately small writer: A4 pages, the three standard Type1 fonts,
+# text and rules only. Enough for an invoice, no extra dependency.
+
+PAGE_W, PAGE_H = 595, 842
+ROW_H = 14
+BOTTOM = 150
+
+
+def _pdf_text(x, y, text, size=9, font="F1", right=False):
+    text = "" if text is None else str(text)
+    if right:
+        # Courier is 0.6em wide per glyph, which makes right-aligning trivial
+        font, x = "F3", x - len(text) * size * 0.6
+    raw = text.encode("cp1252", "replace").decode("latin-1")
+    raw = raw.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return f"BT /{font} {size} Tf {x:.1f} {y:.1f} Td ({raw}) Tj ET\n"
+
+
+def _pdf_rule(x1, y1, x2, y2):
+    return f"{x1:.1f} {y1:.1f} m {x2:.1f} {y2:.1f} l S\n"
+
+
+COLUMNS = (  # label, x, right-aligned
+    ("#", 40, False), ("Product", 60, False), ("Batch", 235, False), ("Exp", 295, False),
+    ("Qty", 375, True), ("Free", 405, True), ("Rate", 450, True), ("GST%", 487, True), ("Disc%", 520, True),
+    ("Amount", 560, True),
+)
+
+
+def render_pages(snapshot: dict) -> list:
+    """Lay out one invoice as a list of PDF page content streams."""
+    h, t = snapshot["header"], snapshot["totals"]
+    pages, ops, y = [], [], 0
+
+    def new_page(continued=False):
+        nonlocal ops, y
+        if ops:
+            pages.append("".join(ops))
+        ops = [
+            _pdf_text(40, 800, h["tradingAccount"], 14, "F2"),
+            _pdf_text(40, 784, "TAX INVOICE" + (" (continued)" if continued else ""), 10, "F2"),
+            _pdf_text(380, 800, f"Invoice No: {h['invoiceNo']}", 10, "F2"),
+            _pdf_text(380, 786, f"Date: {h['invoiceDate']}", 10),
+            _pdf_text(40, 764, f"Customer: {h['customer']}", 10, "F2"),
+            _pdf_text(40, 750, " ".join(str(v) for v in (h["area"], h["city"], h["state"]) if v), 9),
+            _pdf_text(380, 764, f"Payment: {h['paymentMode']} ({h['dueDays'] or 0} days)", 9),
+            _pdf_rule(40, 740, 560, 740),
+        ]
+        ops += [_pdf_text(x, 728, label, 9, "F2", right) for label, x, right in COLUMNS]
+        ops.append(_pdf_rule(40, 722, 560, 722))
+        y = 708
+
+    new_page()
+    for n, r in enumerate(snapshot["rows"], 1):
+        if y < BOTTOM:
+            new_page(continued=True)
+        values = (n, (r["name"] or "")[:30], r["batch"], r["exp"], r["qty"], r["free"], _money(r["rate"]),
+                  r["gst"], r["discount"], _money(_line_amount(r)))
+        ops += [_pdf_text(x, y, v, 9, "F1", right) for (_, x, right), v in zip(COLUMNS, values)]
+        y -= ROW_H
+
+    gst = t["totalGST"] or 0
+    y -= 4
+    ops.append(_pdf_rule(40, y + ROW_H - 4, 560, y + ROW_H - 4))
+    for label, value, bold in (
+        ("Subtotal", t["subtotal"], False), ("Discount", t["totalDiscount"], False),
+        ("CGST", gst / 2, False), ("SGST", gst / 2, False), ("Grand Total", t["grandTotal"], True),
+    ):
+        ops.append(_pdf_text(400, y, label, 10, "F2" if bold else "F1"))
+        ops.append(_pdf_text(560, y, _money(value), 10, right=True))
+        y -= ROW_H
+    if snapshot.get("notes"):
+        ops.append(_pdf_text(40, y - 6, f"Notes: {snapshot['notes']}", 9))
+    pages.append("".join(ops))
+    return pages
+
+
+def build_pdf(pages) -> bytes:
+    fonts = ("Helvetica", "Helvetica-Bold", "Courier")
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in below
+        *(f"<< /Type /Font /Subtype /Type1 /BaseFont /{f} /Encoding /WinAnsiEncoding >>" for f in fonts),
+    ]
+    resources = "<< /Font << /F1 3 0 R /F2 4 0 R /F3 5 0 R >> >>"
+    kids = []
+    for stream in pages:
+        data = stream.encode("latin-1")
+        objects.append(f"<< /Length {len(data)} >>\nstream\n{stream}endstream")
+        content_ref = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_W} {PAGE_H}] "
+            f"/Resources {resources} /Contents {content_ref} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+# ---------- cache ----------
+
+def _safe(invoice_no: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(invoice_no))
+
+
+def filename(invoice_no: str, fmt: str) -> str:
+    """Download name for one invoice; safe inside a quoted Content-Disposition or a ZIP."""
+    return f"invoice-{_safe(invoice_no)}.{_safe(fmt)}"
+
+
+def _prefix(tenant: str, invoice_no: str) -> str:
+    # Invoice numbers repeat across tenants; a fixed-length tenant key can't run into the number
+    return f"{hashlib.sha256(str(tenant).encode('utf-8')).hexdigest()[:12]}_{_safe(invoice_no)}"
+
+
+def _cache_path(tenant: str, invoice_no: str, digest: str, fmt: str) -> str:
+    return os.path.join(CACHE_DIR, f"{_prefix(tenant, invoice_no)}-{digest}.{'pages' if fmt == 'pdf' else 'html'}")
+
+
+def _read(path: str, fmt: str):
+    try:
+        with open(path, "r", encoding="latin-1" if fmt == "pdf" else "utf-8") as f:
+            return json.load(f) if fmt == "pdf" else f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write(path: str, fmt: str, rendered):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="latin-1" if fmt == "pdf" else "utf-8") as f:
+        if fmt == "pdf":
+            json.dump(rendered, f)
+        else:
+            f.write(rendered)
+    os.replace(tmp, path)  # atomic, so a concurrent reader never sees half a file
+
+
+def invalidate(tenant: str, invoice_no: str):
+    # Exactly one hash after the number, so invoice "7" leaves "7-1"'s files alone
+    pattern = f"{glob.escape(_prefix(tenant, invoice_no))}-{'?' * HASH_LENGTH}.*"
+    for path in glob.glob(os.path.join(CACHE_DIR, pattern)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _render_one(args):
+    fmt, snapshot = args
+    return render_pages(snapshot) if fmt == "pdf" else render_html(snapshot)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES)
+    return _pool
+
+
+def shutdown():
+    # Called when the app stops, so the render processes don't outlive it
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def render_many(snapshots: dict, fmt: str, tenant: str) -> dict:
+    """invoice_no -> rendered pages/html, from cache where the contents haven't changed."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    rendered, misses = {}, []
+    for no, snapshot in snapshots.items():
+        path = _cache_path(tenant, no, content_hash(snapshot), fmt)
+        cached = _read(path, fmt)
+        if cached is None:
+            misses.append((no, path, snapshot))
+        else:
+            rendered[no] = cached
+
+    jobs = [(fmt, snapshot) for _, _, snapshot in misses]
+    if len(misses) >= POOL_THRESHOLD and RENDER_PROCESSES > 1:
+        results = _get_pool().map(_render_one, jobs, chunksize=8)
+    else:
+        results = map(_render_one, jobs)
+    for (no, path, _), result in zip(misses, results):
+        _write(path, fmt, result)
+        rendered[no] = result
+    return {no: rendered[no] for no in snapshots}
+
+
+def bundle(rendered: dict, fmt: str, as_zip: bool = False):
+    """(bytes, media_type, filename) for one combined document or a ZIP of single ones."""
+    if as_zip:
+        out = io.BytesIO()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+            for no, doc in rendered.items():
+                body = build_pdf(doc) if fmt == "pdf" else html_document([doc], f"Invoice {no}")
+                zf.writestr(filename(no, fmt), body)
+        return out.getvalue(), "application/zip", "invoices.zip"
+    if fmt == "pdf":
+        return build_pdf([page for pages in rendered.values() for page in pages]), "application/pdf", "invoices.pdf"
+    return html_document(rendered.values()), "text/html; charset=utf-8", "invoices.html"
@@ -0,0 +1,121 @@
+import math
+from datetime import date
+
+from sqlalchemy import select, func, or_, text
+from sqlalchemy.orm import Session
+
+from .db import tenant_of
+from .models import SalesInvoice, SalesInvoiceItem
+from .partitions import routed, archive_tables
+from .serializers import SALES_INVOICE_FIELDS
+
+# --- 🔎 SALES INVOICE SEARCH ---
+# Header filters (customer / area / city / payment mode / dates) each have a
+# composite index ending in invoice_date. Product and batch filters become
+# `invoice_no IN (items matching ...)`, answered from the
+# (name, batch, invoice_no) index without touching item rows. The page and the
+# totals for the whole filter are two queries over the same WHERE clause.
+# Archived years are searched only when the date range reaches them.
+# A product filter also matches the item's product code (pcode, copied from
+# the product master when the invoice is saved).
+
+MAX_PAGE_SIZE = 200
+
+
+def _criteria(invoices, items, customer=None, area=None, city=None, date_from: date = None,
+              date_to: date = None, payment_mode=None, product=None, batch=None):
+    where = []
+    if customer:
+        where.append(invoices.c.customer == customer)
+    if area:
+        where.append(invoices.c.area == area)
+    if city:
+        where.append(invoices.c.city == city)
+    if payment_mode:
+        where.append(invoices.c.payment_mode == payment_mode)
+    if date_from:
+        where.append(invoices.c.invoice_date >= date_from)
+    if date_to:
+        where.append(invoices.c.invoice_date <= date_to)
+    if product or batch:
+        matching = select(items.c.invoice_no)
+        if product:
+            matching = matching.where(or_(items.c.name == product, items.c.pcode == product))
+        if batch:
+            matching = matching.where(items.c.batch == batch)
+        where.append(invoices.c.invoice_no.in_(matching))
+    return where
+
+
+def search_invoices(db: Session, page: int = 1, page_size: int = 50, **filters) -> dict:
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    page = max(1, page)
+    start, end = filters.get("date_from"), filters.get("date_to")
+    invoices = routed(db, SalesInvoice, start, end)
+    items = routed(db, SalesInvoiceItem, start, end)
+    where = _criteria(invoices, items, **filters)
+
+    count, subtotal, discount, gst, grand_total = db.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(invoices.c.subtotal), 0),
+            func.coalesce(func.sum(invoices.c.total_discount), 0),
+            func.coalesce(func.sum(invoices.c.total_gst), 0),
+            func.coalesce(func.sum(invoices.c.grand_total), 0),
+        ).where(*where)
+    ).one()
+
+    rows = []
+    if count and (page - 1) * page_size < count:
+        rows = db.execute(
+            select(*(invoices.c[f] for f in SALES_INVOICE_FIELDS))
+            .where(*where)
+            .order_by(invoices.c.invoice_date.desc(), invoices.c.id.desc())
+            .offset((page - 1) * page_size)
+            .limit(page_size)
+        ).all()
+
+    return {
+        "page": page,
+        "page_size": page_size,
+        "pages": math.ceil(count / page_size),
+        "totals": {
+            "count": count,
+            "subtotal": round(float(subtotal), 2),
+            "discount": round(float(discount), 2),
+            "gst": round(float(gst), 2),
+            "grand_total": round(float(grand_total), 2),
+        },
+        "invoices": [dict(zip(SALES_INVOICE_FIELDS, r)) for r in rows],
+    }
+
+
+def backfill_item_codes(db: Session):
+    # Items saved before single invoices recorded pcode (hot table and archives).
+    # Startup runs this for every tenant in every worker, so it first probes
+    # the (tenant, pcode, invoice_no) index for a row it could fill, and only
+    # then pays for the UPDATEs. Archives only receive rows moved out of the
+    # hot table, so they are filled in the same pass and skipped with it.
+    tenant = tenant_of(db)
+    engine = db.get_bind()
+    preparer = engine.dialect.identifier_preparer
+    fillable = (
+        "{table}.tenant = :tenant AND {table}.pcode IS NULL AND EXISTS (SELECT 1 FROM products p "
+        "WHERE p.name = {table}.name AND p.tenant = {table}.tenant AND p.code IS NOT NULL)"
+    )
+    hot = preparer.quote(SalesInvoiceItem.__tablename__)
+    if db.execute(text(f"SELECT 1 FROM {hot} WHERE {fillable.format(table=hot)} LIMIT 1"),
+                  {"tenant": tenant}).first() is None:
+        return
+    targets = [SalesInvoiceItem.__tablename__]
+    targets += [name for model, name in archive_tables(engine) if model is SalesInvoiceItem]
+    for name in targets:
+        table = preparer.quote(name)
+        filled = db.execute(text(
+            f"UPDATE {table} SET pcode = (SELECT min(p.code) FROM products p "
+            f"WHERE p.name = {table}.name AND p.tenant = {table}.tenant) "
+            f"WHERE {fillable.format(table=table)}"
+        ), {"tenant": tenant}).rowcount
+        db.commit()
+        if filled:
+            print(f"Filled product codes on {filled} {name} rows for {tenant}")
@@ -0,0 +1,262 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import IntegrityError
+
+from .db import SessionLocal
+from .models import Job
+from .tenancy import tenants, tenant_session
+
+# --- ⏱ BACKGROUND JOBS ---
+# Heavy work (scans, rollups, month-end reports) runs on a small thread pool
+# off the request path. Every run is a row in `jobs`, so status and results
+# survive restarts and can be polled from any worker.
+#
+# Cron runs are claimed by inserting (name, scheduled_for, tenant) under a
+# unique constraint: with several uvicorn workers ticking the same schedule,
+# only the one whose INSERT wins runs the job. Every run acts for one tenant
+# (the requester's, or each tenant in turn for cron), so a job only ever sees
+# that distributor's rows.
+#
+# Runs live in a worker's memory, so one that dies mid-run leaves its rows
+# queued/running. On start, rows untouched for JOB_TIMEOUT_MINUTES are marked
+# failed (the timeout keeps live runs on other workers safe).
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1") == "1"
+JOB_TIMEOUT_MINUTES = int(os.getenv("JOB_TIMEOUT_MINUTES", "120"))
+TICK_SECONDS = 20
+
+REGISTRY = {}  # name -> (fn(db, **params), cron or None)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def job(name: str, cron: str = None):
+    """Register fn(db, **params) as a job, optionally on a cron schedule."""
+    def register(fn):
+        if cron:
+            _parse_cron(cron)  # fail at import time, not at 2 a.m.
+        REGISTRY[name] = (fn, cron)
+        return fn
+    return register
+
+
+# --- cron: "minute hour day-of-month month day-of-week" (0 = Sunday) ---
+_CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def _parse_field(spec: str, lo: int, hi: int) -> set:
+    values = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/")
+            step = int(step)
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-"))
+        else:
+            start = end = int(part)
+        if start < lo or end > hi:
+            raise ValueError(f"cron field {spec!r} out of range {lo}-{hi}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def _parse_cron(expr: str):
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+    return [_parse_field(f, lo, hi) for f, (lo, hi) in zip(fields, _CRON_RANGES)]
+
+
+def cron_matches(expr: str, when: datetime) -> bool:
+    minute, hour, dom, month, dow = _parse_cron(expr)
+    return (
+        when.minute in minute and when.hour in hour and when.day in dom
+        and when.month in month and (when.weekday() + 1) % 7 in dow
+    )
+
+
+def _as_dict(job_row: Job) -> dict:
+    return {
+        "id": job_row.id,
+        "name": job_row.name,
+        "params": job_row.params,
+        "status": job_row.status,
+        "scheduled_for": job_row.scheduled_for,
+        "created_at": job_row.created_at,
+        "started_at": job_row.started_at,
+        "finished_at": job_row.finished_at,
+        "result": job_row.result,
+        "error": job_row.error,
+    }
+
+
+class Scheduler:
+    def __init__(self, workers: int = JOB_WORKERS, queue_limit: int = JOB_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- lifecycle (called from the app lifespan) ---
+    def start(self):
+        if self._thread or not JOBS_ENABLED:
+            return
+        self.fail_abandoned()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="job-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def fail_abandoned(self, now: datetime = None) -> int:
+        """Mark runs whose worker went away (queued/running past the timeout) as failed."""
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(minutes=JOB_TIMEOUT_MINUTES)
+        db = SessionLocal()
+        try:
+            failed = db.query(Job).filter(
+                ((Job.status == "running") & (Job.started_at < cutoff))
+                | ((Job.status == "queued") & (Job.created_at < cutoff))
+            ).update({
+                "status": "failed", "finished_at": now,
+                "error": f"abandoned: no progress for {JOB_TIMEOUT_MINUTES} minutes (worker restarted?)",
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        if failed:
+            print(f"Marked {failed} abandoned jobs as failed")
+        return failed
+
+    # --- on-demand ---
+    def enqueue(self, name: str, params: dict = None, tenant: str = None) -> dict:
+        if name not in REGISTRY:
+            raise KeyError(name)
+        db = SessionLocal()
+        try:
+            row = Job(name=name, params=params or {}, status="queued", tenant=tenant)
+            db.add(row)
+            db.commit()
+            self._submit(row.id)
+            return _as_dict(row)
+        finally:
+            db.close()
+
+    def _submit(self, job_id: int):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                self._finish(job_id, "failed", error="job queue is full")
+                raise QueueFull()
+            self._pending += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            self._pool.submit(self._run, job_id)
+
+    def _run(self, job_id: int):
+        db = SessionLocal()
+        try:
+            row = db.get(Job, job_id)
+            fn, _ = REGISTRY[row.name]
+            row.status, row.started_at = "running", datetime.utcnow()
+            db.commit()
+            name, params = row.name, row.params or {}
+            work = tenant_session(row.tenant)
+            try:
+                result = jsonable_encoder(fn(work, **params))
+            except Exception as e:
+                work.rollback()
+                print(f"Job {name} #{job_id} failed: {e}")
+                self._finish(job_id, "failed", error=str(e))
+            else:
+                self._finish(job_id, "done", result=result)
+            finally:
+                work.close()
+        finally:
+            db.close()
+            with self._lock:
+                self._pending -= 1
+
+    def _finish(self, job_id: int, status: str, result=None, error: str = None):
+        db = SessionLocal()
+        try:
+            row = db.get(Job, job_id)
+            row.status, row.result, row.error = status, result, error
+            row.finished_at = datetime.utcnow()
+            db.commit()
+        finally:
+            db.close()
+
+    # --- cron ---
+    def _loop(self):
+        last = datetime.now().replace(second=0, microsecond=0)
+        while not self._stop.wait(TICK_SECONDS):
+            now = datetime.now().replace(second=0, microsecond=0)
+            minute = last + timedelta(minutes=1)
+            while minute <= now:
+                for name, (_, cron) in REGISTRY.items():
+                    if cron and cron_matches(cron, minute):
+                        self._claim(name, minute)
+                minute += timedelta(minutes=1)
+            last = now
+
+    def _claim(self, name: str, slot: datetime):
+        db = SessionLocal()
+        try:
+            claimed = []
+            for tenant in tenants(db):
+                row = Job(name=name, params={}, status="queued", scheduled_for=slot, tenant=tenant)
+                try:
+                    with db.begin_nested():
+                        db.add(row)
+                except IntegrityError:
+                    continue  # another worker already owns this tenant's run
+                claimed.append(row)
+            db.commit()
+            job_ids = [(row.id, row.tenant) for row in claimed]
+        finally:
+            db.close()
+        for job_id, tenant in job_ids:
+            try:
+                self._submit(job_id)
+            except QueueFull:
+                print(f"Job {name} for {slot} ({tenant}) dropped: queue full")
+
+
+scheduler = Scheduler()
+
+
+def get_job(db, job_id: int):
+    row = db.get(Job, job_id)
+    return _as_dict(row) if row else None
+
+
+def list_jobs(db, name: str = None, limit: int = 50):
+    query = db.query(Job)
+    if name:
+        query = query.filter(Job.name == name)
+    return [_as_dict(r) for r in query.order_by(Job.id.desc()).limit(limit)]
+
+
+def registered_jobs():
+    return [{"name": name, "cron": cron} for name, (_, cron) in sorted(REGISTRY.items())]
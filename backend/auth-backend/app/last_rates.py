@@ -0,0 +1,169 @@
+from sqlalchemy import select, insert, update, delete, tuple_, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .db import tenant_of
+from .models import SalesInvoice, SalesInvoiceItem, CustomerProductRate
+from .partitions import routed
+
+# --- 🏷 LAST RATE PER CUSTOMER + PRODUCT ---
+# customer_product_rates keeps, for every (customer, product) ever billed,
+# the rate, discount, batch and date of the latest sale. Invoice create /
+# bulk create update it in the same commit; editing or deleting an invoice
+# re-derives the rows that pointed at it from the remaining history. Product
+# search then reads the rows for the products on screen with one PK lookup,
+# instead of joining sales items to their headers on invoice_no.
+#
+# "Latest" is by invoice date; on the same date the invoice saved last wins.
+# PostgreSQL and SQLite write a batch as one INSERT ... ON CONFLICT DO UPDATE
+# that only replaces a row when the sale is not older, so two counters billing
+# the same customer at once can't undo each other's later sale.
+
+UPSERT_DIALECTS = {"postgresql": postgresql, "sqlite": sqlite}
+
+
+def _entry(invoice_no, invoice_date, row) -> dict:
+    return {"invoice_no": invoice_no, "invoice_date": invoice_date,
+            "rate": row.rate, "discount": row.discount, "batch": row.batch}
+
+
+def _newer(day, than) -> bool:
+    return day is None or than is None or day >= than
+
+
+def _stored_dates(db: Session, pairs) -> dict:
+    return dict(
+        ((customer, name), day) for customer, name, day in db.execute(
+            select(CustomerProductRate.customer, CustomerProductRate.product_name, CustomerProductRate.invoice_date)
+            .where(tuple_(CustomerProductRate.customer, CustomerProductRate.product_name).in_(list(pairs)))
+        )
+    )
+
+
+def record_sales(db: Session, invoices):
+    """invoices: (customer, invoice_no, invoice_date, rows); caller commits."""
+    latest = {}
+    for customer, invoice_no, invoice_date, rows in invoices:
+        if not customer:
+            continue
+        for r in rows:
+            seen = latest.get((customer, r.name))
+            if r.name and (seen is None or _newer(invoice_date, seen["invoice_date"])):
+                latest[(customer, r.name)] = _entry(invoice_no, invoice_date, r)
+    if not latest:
+        return
+
+    tenant = tenant_of(db)  # part of the key the bulk UPDATE matches on
+    dialect = UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if dialect is not None:
+        stmt = dialect.insert(CustomerProductRate)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tenant", "customer", "product_name"],
+            set_={c: stmt.excluded[c] for c in ("rate", "discount", "batch", "invoice_date", "invoice_no")},
+            # Same rule as _newer: a back-dated invoice doesn't replace a later sale
+            where=or_(stmt.excluded.invoice_date.is_(None), CustomerProductRate.invoice_date.is_(None),
+                      stmt.excluded.invoice_date >= CustomerProductRate.invoice_date),
+        )
+        db.execute(stmt, [{"tenant": tenant, "customer": customer, "product_name": name, **entry}
+                          for (customer, name), entry in latest.items()])
+        return
+
+    stored = _stored_dates(db, latest)
+    new, changed = [], []
+    for (customer, name), entry in latest.items():
+        row = {"tenant": tenant, "customer": customer, "product_name": name, **entry}
+        if (customer, name) not in stored:
+            new.append(row)
+        else:
+            # A back-dated invoice doesn't replace a later sale
+            if _newer(entry["invoice_date"], stored[(customer, name)]):
+                changed.append(row)
+    while new:
+        try:
+            with db.begin_nested():
+                db.execute(insert(CustomerProductRate), new)
+            break
+        except IntegrityError:
+            # Some were inserted concurrently by another counter: theirs stays if it is the
+            # later sale; the savepoint undid the whole INSERT, so the rest go in again
+            raced = _stored_dates(db, [(row["customer"], row["product_name"]) for row in new])
+            changed += [
+                row for row in new
+                if (row["customer"], row["product_name"]) in raced
+                and _newer(row["invoice_date"], raced[(row["customer"], row["product_name"])])
+            ]
+            new = [row for row in new if (row["customer"], row["product_name"]) not in raced]
+    if changed:
+        db.execute(update(CustomerProductRate), changed)
+
+
+def _history(db: Session, pairs=None):
+    """Latest sale per (customer, product) from the sales history, archive included."""
+    invoices = routed(db, SalesInvoice)
+    items = routed(db, SalesInvoiceItem)
+    stmt = (
+        select(invoices.c.customer, items.c.name, invoices.c.invoice_no, invoices.c.invoice_date,
+               items.c.rate, items.c.discount, items.c.batch)
+        .join(invoices, invoices.c.invoice_no == items.c.invoice_no)
+        .order_by(invoices.c.invoice_date, invoices.c.id, items.c.id)
+    )
+    if pairs is not None:
+        stmt = stmt.where(tuple_(invoices.c.customer, items.c.name).in_(list(pairs)))
+    latest = {}
+    for customer, name, invoice_no, invoice_date, rate, discount, batch in db.execute(stmt).yield_per(5000):
+        if customer and name:
+            latest[(customer, name)] = {"invoice_no": invoice_no, "invoice_date": invoice_date,
+                                        "rate": rate, "discount": discount, "batch": batch}
+    return latest
+
+
+def forget_invoice(db: Session, invoice_no: str):
+    """Re-derive rows that came from an invoice being edited or deleted (after its items are gone)."""
+    pairs = db.execute(
+        select(CustomerProductRate.customer, CustomerProductRate.product_name)
+        .where(CustomerProductRate.invoice_no == invoice_no)
+    ).all()
+    if not pairs:
+        return
+    pairs = [tuple(p) for p in pairs]
+    db.execute(delete(CustomerProductRate).where(CustomerProductRate.invoice_no == invoice_no))
+    db.flush()
+    rows = [{"customer": c, "product_name": n, **entry} for (c, n), entry in _history(db, pairs).items()]
+    if rows:
+        db.execute(insert(CustomerProductRate), rows)
+
+
+def last_rates(db: Session, customer: str, names) -> dict:
+    """product name -> last sale to this customer, for the names given."""
+    names = [n for n in names if n]
+    if not customer or not names:
+        return {}
+    return {
+        name: {"rate": rate, "discount": discount, "batch": batch,
+               "date": day.isoformat() if day else None, "invoice_no": invoice_no}
+        for name, rate, discount, batch, day, invoice_no in db.execute(
+            select(CustomerProductRate.product_name, CustomerProductRate.rate, CustomerProductRate.discount,
+                   CustomerProductRate.batch, CustomerProductRate.invoice_date, CustomerProductRate.invoice_no)
+            .where(CustomerProductRate.customer == customer, CustomerProductRate.product_name.in_(names))
+        )
+    }
+
+
+def rebuild_last_rates(db: Session) -> int:
+    latest = _history(db)
+    db.execute(delete(CustomerProductRate))
+    rows = [{"customer": c, "product_name": n, **entry} for (c, n), entry in latest.items()]
+    if rows:
+        db.execute(insert(CustomerProductRate), rows)
+    db.commit()
+    return len(rows)
+
+
+def backfill_last_rates(db: Session):
+    # First start after upgrading: build the index from existing invoices
+    if db.query(CustomerProductRate).first() is None and db.query(SalesInvoice).first() is not None:
+        try:
+            rebuild_last_rates(db)
+        except IntegrityError:
+            db.rollback()  # another worker got there first
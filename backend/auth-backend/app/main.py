@@ -1,23 +1,53 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from datetime import date, datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, select
 from dotenv import load_dotenv
 import os
 from typing import List, Optional
+from contextlib import asynccontextmanager
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 # Local imports
 from . import models, schemas
-from .db import Base, engine, get_db
-from .models import User, Product, Customer, Company, Supplier,InvoiceProduct
+from .db import Base, engine, SessionLocal, get_db, get_read_db, add_missing_columns, drop_changed_indexes, tenant_of
+from .models import User, Product, Customer, Company, Supplier,InvoiceProduct, Division
 from .schemas import (
     LoginRequest, TokenResponse, ProductSchema, CustomerSchema, 
-    CompanyCreate, SupplierSchema, InvoiceCreate,InvoiceProductCreate,SalesInvoiceCreate
+    CompanyCreate, SupplierSchema, InvoiceCreate,InvoiceProductCreate,SalesInvoiceCreate,
+    SalesInvoiceBulk, ReceiptCreate, InvoicePrintBatch
 )
 from .security import verify_password, create_access_token
 from .utils import current_financial_year
+from .serializers import (
+    fetch_rows, pick_fields, PRODUCT_FIELDS, CUSTOMER_FIELDS, COMPANY_FIELDS,
+    SUPPLIER_FIELDS, SALES_INVOICE_FIELDS, USER_FIELDS, STOCK_SEARCH_FIELDS, PRODUCT_COLUMNS
+)
+from .compression import CompressionMiddleware
+from .versions import bump_version, table_etag, etag_matches
+from .valuation import valuation_report, save_checkpoint, invalidate_checkpoints
+from .receivables import post_invoice, adjust, get_balance, aging_report, rebuild_balances
+from .partitions import routed, sync_archive_columns
+from .tenancy import rekey_tables, backfill_tenants, tenants, tenant_session
+from .idempotency import run_once
+from .stock import add_stock, take_stock, StockConflict, sales_product_ids, saved_product_ids
+from .reorder import suggest_reorders
+from .jobs import scheduler, get_job, list_jobs, registered_jobs, QueueFull
+from . import tasks  # registers the built-in jobs
+from . import invoice_render
+from .changelog import changes_since
+from .chat import manager
+from .inbox import record_message, mark_read, inbox, rebuild_inbox, backfill_if_empty
+from .invoice_search import search_invoices, backfill_item_codes
+from .reconcile import reconcile
+from .resolver import resolvers
+from .hotcache import hot, respond
+from .divisions import resolve_division, sync_company, list_divisions, division_stock, backfill_divisions, ensure_foreign_key, merge_unowned_divisions
+from .analytics import sales_report, preload as preload_analytics
+from .last_rates import record_sales, forget_invoice, last_rates, rebuild_last_rates, backfill_last_rates
+from .bulk_sales import submit_invoices, MAX_INVOICES as BULK_INVOICE_LIMIT
 from .security import SECRET_KEY, ALGORITHM, create_access_token, verify_password
 from .security import hash_password
 from fastapi.staticfiles import StaticFiles
@@ -26,40 +56,40 @@ from fastapi import WebSocket, WebSocketDisconnect
 load_dotenv()
 
 # Initialize Database
+rekey_tables(engine)  # keys that now lead with the tenant
 Base.metadata.create_all(bind=engine)
-
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
-
-    async def connect(self, username: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[username] = websocket
-
-    def disconnect(self, username: str):
-        if username in self.active_connections:
-            del self.active_connections[username]
-
-    async def send_personal_message(self, message: dict, receiver: str):
-        if receiver in self.active_connections:
-            await self.active_connections[receiver].send_json(message)
-
-    # NEW: Broadcast status changes to EVERYONE
-    async def broadcast_status(self, username: str, status: str):
-        payload = {
-            "type": "status_update",
-            "username": username,
-            "status": status  # "online" or "offline"
-        }
-        for connection in self.active_connections.values():
-            try:
-                await connection.send_json(payload)
-            except:
-                pass
-
-manager = ConnectionManager()
-
-app = FastAPI(title="Medivision Ayurvedic API")
+merge_unowned_divisions(engine)  # before its new unique index is created
+# create_all skips new columns and indexes on tables that already exist
+# (columns first: a new index may cover a new column)
+for table in Base.metadata.sorted_tables:
+    add_missing_columns(engine, table)
+    drop_changed_indexes(engine, table)
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+sync_archive_columns(engine)
+backfill_tenants(engine)
+ensure_foreign_key(engine)
+with SessionLocal() as _db:
+    backfill_if_empty(_db)
+    _tenants = tenants(_db)
+for _tenant in _tenants:
+    with tenant_session(_tenant) as _db:
+        backfill_last_rates(_db)
+        backfill_divisions(_db)
+        backfill_item_codes(_db)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cron jobs + worker pool live as long as the app does
+    scheduler.start()
+    await manager.start()  # chat backplane + presence sync between workers
+    preload_analytics()  # sales columns load in the background
+    yield
+    await manager.stop()
+    scheduler.stop()
+    invoice_render.shutdown()
+
+app = FastAPI(title="Medivision Ayurvedic API", lifespan=lifespan)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 if not os.path.exists("static/profiles"):
     os.makedirs("static/profiles", exist_ok=True)
@@ -72,7 +102,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotent-Replayed"],
 )
+# gzip/brotli for bodies over COMPRESS_MIN_BYTES (slow branch-office links)
+app.add_middleware(CompressionMiddleware)
 
 @app.get("/health")
 def health():
@@ -95,7 +128,8 @@ def login(payload: LoginRequest, db: Session = Depends(get_db)):
     #     raise HTTPException(status_code=403, detail="User is inactive")
 
     # 3. Generate token and return response
-    token = create_access_token({"sub": user.username, "role": user.role})
+    # company = the tenant whose data this login sees (db.Tenanted)
+    token = create_access_token({"sub": user.username, "role": user.role, "company": user.company})
     return TokenResponse(
         access_token=token,
         username=user.username,
@@ -109,14 +143,36 @@ def login(payload: LoginRequest, db: Session = Depends(get_db)):
 def create_product(product: ProductSchema, db: Session = Depends(get_db)):
     # Create DB instance from schema
     new_product = Product(**product.dict())
+    if product.division_id is not None:
+        division = db.get(Division, product.division_id)
+        if division is None:
+            raise HTTPException(status_code=400, detail="Unknown division_id")
+        new_product.division = product.division or division.name
+    else:
+        new_product.division_id = resolve_division(db, product.division, product.manufacturer)
     db.add(new_product)
+    bump_version(db, "products")
     db.commit()
     db.refresh(new_product)
+    resolvers(db).add_product(new_product)
     return {"message": "✅ Product Added Successfully!", "id": new_product.id}
 
 @app.get("/products/", response_model=List[ProductSchema])
-def get_products(db: Session = Depends(get_db)):
+def get_products(request: Request, response: Response, fast: bool = False, fields: Optional[str] = None,
+                 db: Session = Depends(get_read_db)):
     # Returns list for frontend to calculate next PRD-xxx code
+    picked = pick_fields(fields, PRODUCT_COLUMNS, PRODUCT_FIELDS) if fast or fields else None
+    if picked and "current_stock" in picked:
+        # Stock moves on every sale without bumping the products version, so no ETag for it
+        return ORJSONResponse(fetch_rows(db, Product, picked))
+    etag = table_etag(db, "products")
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if picked:
+        # ?fast=true -> column tuples + orjson, skips per-row validation
+        # ?fields=a,b -> only those columns are selected and sent
+        return ORJSONResponse(fetch_rows(db, Product, picked), headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return db.query(Product).all()
 
 
@@ -126,13 +182,21 @@ def get_products(db: Session = Depends(get_db)):
 def create_customer(customer: CustomerSchema, db: Session = Depends(get_db)):
     db_customer = Customer(**customer.dict())
     db.add(db_customer)
+    bump_version(db, "customers")
     db.commit()
     db.refresh(db_customer)
     return db_customer
 
 @app.get("/customers/")
-def get_customers(db: Session = Depends(get_db)):
+def get_customers(request: Request, response: Response, fast: bool = False, fields: Optional[str] = None,
+                  db: Session = Depends(get_read_db)):
     # Returns list for frontend to calculate next MED-xxx code
+    etag = table_etag(db, "customers")
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if fast or fields:
+        return ORJSONResponse(fetch_rows(db, Customer, pick_fields(fields, CUSTOMER_FIELDS)), headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return db.query(Customer).all()
 
 # --- 🏢 COMPANY ENDPOINTS (Supports Multiple Divisions) ---
@@ -141,13 +205,23 @@ def create_company(company: CompanyCreate, db: Session = Depends(get_db)):
     # divisions is a List[str] in schema, stored as JSON in Model
     db_company = Company(**company.dict())
     db.add(db_company)
+    db.flush()
+    sync_company(db, db_company.id, company.divisions)
+    bump_version(db, "companies")
     db.commit()
     db.refresh(db_company)
     return db_company
 
 @app.get("/companies/")
-def get_companies(db: Session = Depends(get_db)):
+def get_companies(request: Request, response: Response, fast: bool = False, fields: Optional[str] = None,
+                  db: Session = Depends(get_read_db)):
     # Returns list for frontend to calculate next COMP-xxx code
+    etag = table_etag(db, "companies")
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if fast or fields:
+        return ORJSONResponse(fetch_rows(db, Company, pick_fields(fields, COMPANY_FIELDS)), headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return db.query(Company).all()
 
 # --- 📦 SUPPLIER ENDPOINTS ---
@@ -155,13 +229,21 @@ def get_companies(db: Session = Depends(get_db)):
 def create_supplier(supplier: SupplierSchema, db: Session = Depends(get_db)):
     db_supplier = Supplier(**supplier.dict())
     db.add(db_supplier)
+    bump_version(db, "suppliers")
     db.commit()
     db.refresh(db_supplier)
     return db_supplier
 
 @app.get("/suppliers/")
-def get_suppliers(db: Session = Depends(get_db)):
+def get_suppliers(request: Request, response: Response, fast: bool = False, fields: Optional[str] = None,
+                  db: Session = Depends(get_read_db)):
     # Returns list for frontend to calculate next SUP-xxx code
+    etag = table_etag(db, "suppliers")
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if fast or fields:
+        return ORJSONResponse(fetch_rows(db, Supplier, pick_fields(fields, SUPPLIER_FIELDS)), headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return db.query(Supplier).all()
 
 
@@ -173,10 +255,27 @@ def get_next_entry_no(db: Session = Depends(get_db)):
     return {"next_entry_no": (last_entry or 0) + 1}
 
 @app.post("/purchase-entry/")
-def save_purchase_entry(data: dict, db: Session = Depends(get_db)):
+def save_purchase_entry(
+    data: dict,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(default=None)
+):
+    # Retries carrying the same Idempotency-Key get the first response back
+    return run_once(db, "purchase-entry", idempotency_key, data, lambda: _save_purchase_entry(data, db))
+
+def _unmatched(data: dict, resolved: list) -> list:
+    # Saved as typed, but no stock moved: send them back with likely products
+    return [
+        {"line": i, "product_name": data["products"][i].get("product_name"), "suggestions": r["suggestions"]}
+        for i, r in enumerate(resolved) if r["product_id"] is None
+    ]
+
+def _save_purchase_entry(data: dict, db: Session):
     try:
+        # Match every line to the product master in one pass (names, codes, supplier aliases)
+        resolved = resolvers(db).resolve_lines(db, data.get("supplier_name"), data["products"])
         # Loop through each product item in the purchase invoice
-        for p in data["products"]:
+        for p, match in zip(data["products"], resolved):
             # 1. Store the transaction detail in 'invoice_products'
             new_row = InvoiceProduct(
                 entry_no=data["entry_no"],
@@ -185,7 +284,8 @@ def save_purchase_entry(data: dict, db: Session = Depends(get_db)):
                 supplier_name=data["supplier_name"],
                 invoice_no=data["invoice_no"],
                 invoice_date=data["invoice_date"],
-                product_name=p["product_name"],
+                product_name=match["product_name"],
+                product_id=match["product_id"],
                 quantity=p["quantity"],
                 batch_no=p["batch_no"],
                 exp_date=p.get("exp_date"),
@@ -197,28 +297,23 @@ def save_purchase_entry(data: dict, db: Session = Depends(get_db)):
             )
             db.add(new_row)
 
-            # 2. UPDATE THE STOCK in 'products' table
-            # Find the product in the master table by name
-            product_master = db.query(Product).filter(Product.name == p["product_name"]).first()
-            
-            if product_master:
-                # Increment current_stock by (Quantity + Free units)
-                # Ensure the quantity is treated as an integer
-                qty_to_add = int(p["quantity"]) + int(p.get("free", 0))
-                product_master.current_stock += qty_to_add
-            else:
-                # Log if product doesn't exist in the master table
-                print(f"Product {p['product_name']} not found in Product Master")
+        # 2. UPDATE THE STOCK in 'products' table: one UPDATE for the whole entry
+        # Increment current_stock by (Quantity + Free units)
+        add_stock(db, [
+            (match["product_id"], int(p["quantity"]) + int(p.get("free", 0)))
+            for p, match in zip(data["products"], resolved) if match["product_id"] is not None
+        ])
 
+        invalidate_checkpoints(db, data.get("entry_date"), data.get("invoice_date"))
         # Save all changes (Invoice rows AND stock updates) at once
         db.commit()
-        return {"message": "Purchase saved and stock updated"}
+        return {"message": "Purchase saved and stock updated", "unmatched": _unmatched(data, resolved)}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/purchase-entry/{entry_no}")
-def get_purchase_entry(entry_no: int, db: Session = Depends(get_db)):
+def get_purchase_entry(entry_no: int, db: Session = Depends(get_read_db)):
     rows = (
         db.query(InvoiceProduct)
         .filter(InvoiceProduct.entry_no == entry_no)
@@ -255,16 +350,35 @@ def get_purchase_entry(entry_no: int, db: Session = Depends(get_db)):
             for r in rows
         ],
     }
+# --- 🧭 PRODUCT MATCHING FOR PURCHASE LINES ---
+@app.post("/purchase-entry/resolve")
+def resolve_purchase_lines(data: dict, db: Session = Depends(get_db)):
+    # Preview before saving: which master product each supplier line maps to
+    results = resolvers(db).resolve_lines(db, data.get("supplier_name"), data.get("products", []))
+    db.commit()  # aliases learned from picked product_ids
+    return {"lines": results}
+
+@app.post("/purchase-entry/aliases")
+def add_purchase_alias(data: dict, db: Session = Depends(get_db)):
+    # {"supplier_name": "...", "alias": "what the bill says", "product_id": 12}; no supplier = any supplier
+    if not db.get(Product, data.get("product_id")):
+        raise HTTPException(status_code=404, detail="Product not found")
+    resolver = resolvers(db)
+    resolver.refresh(db)
+    resolver.learn(db, data.get("supplier_name") or "", data.get("alias"), data["product_id"])
+    db.commit()
+    return {"message": "Alias saved"}
+
 # --- 📝 UPDATE PURCHASE ENTRY ---
 @app.put("/purchase-entry/{entry_no}")
 def update_purchase_entry(entry_no: int, data: dict, db: Session = Depends(get_db)):
     try:
-        # 1. Reverse Stock for old items
+        # 1. Reverse Stock for old items (applied together with the new ones below)
         old_items = db.query(models.InvoiceProduct).filter_by(entry_no=entry_no).all()
-        for item in old_items:
-            product = db.query(models.Product).filter_by(name=item.product_name).first()
-            if product:
-                product.current_stock -= (item.quantity + item.free)
+        stock_lines = [
+            (product_id, -(item.quantity + (item.free or 0)))
+            for item, product_id in zip(old_items, saved_product_ids(db, old_items, "product_name"))
+        ]
 
         # 2. Clear old records
         db.query(models.InvoiceProduct).filter_by(entry_no=entry_no).delete()
@@ -283,7 +397,11 @@ def update_purchase_entry(entry_no: int, data: dict, db: Session = Depends(get_d
         }
 
         # 4. Add NEW items with Header Info + Product Info
-        for p in data["products"]:
+        resolved = resolvers(db).resolve_lines(db, header_info["supplier_name"], data["products"])
+        for p, match in zip(data["products"], resolved):
+            p = {k: v for k, v in p.items() if k != "product_id"}
+            p["product_name"] = match["product_name"]
+            p["product_id"] = match["product_id"]
             # Merge header_info and product details into one record
             # **header_info spreads the supplier details into the new db_item
             db_item = models.InvoiceProduct(
@@ -292,14 +410,21 @@ def update_purchase_entry(entry_no: int, data: dict, db: Session = Depends(get_d
                 **p
             ) 
             db.add(db_item)
+            if match["product_id"] is not None:
+                stock_lines.append((match["product_id"], int(p["quantity"]) + int(p.get("free", 0))))
 
-            # Update master stock
-            product = db.query(models.Product).filter_by(name=p["product_name"]).first()
-            if product:
-                product.current_stock += (int(p["quantity"]) + int(p.get("free", 0)))
+        # Update master stock with the net change per product
+        add_stock(db, stock_lines)
 
+        invalidate_checkpoints(
+            db, header_info["entry_date"], header_info["invoice_date"],
+            *(d for item in old_items for d in (item.entry_date, item.invoice_date))
+        )
         db.commit()
-        return {"message": "Success: Invoice updated with supplier details preserved"}
+        return {
+            "message": "Success: Invoice updated with supplier details preserved",
+            "unmatched": _unmatched(data, resolved),
+        }
         
     except Exception as e:
         db.rollback()
@@ -318,22 +443,18 @@ def delete_purchase_entry(entry_no: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Purchase entry not found")
 
     try:
-        # 2. Loop through records to reverse the stock
-        for item in records:
-            product = db.query(models.Product).filter(
-                models.Product.name == item.product_name
-            ).first()
-            
-            if product:
-                # DECREASE stock because the purchase is being deleted
-                total_to_remove = int(item.quantity) + int(item.free or 0)
-                product.current_stock -= total_to_remove
+        # 2. Reverse the stock: DECREASE because the purchase is being deleted
+        add_stock(db, [
+            (product_id, -(int(item.quantity) + int(item.free or 0)))
+            for item, product_id in zip(records, saved_product_ids(db, records, "product_name"))
+        ])
 
         # 3. Delete the records from the invoice table
         db.query(models.InvoiceProduct).filter(
             models.InvoiceProduct.entry_no == entry_no
         ).delete()
 
+        invalidate_checkpoints(db, *(d for item in records for d in (item.entry_date, item.invoice_date)))
         db.commit()
         return {"message": f"Purchase entry {entry_no} deleted and stock adjusted"}
     
@@ -358,8 +479,65 @@ def get_customer_next_invoice_no(db: Session = Depends(get_db)):
         print(f"DATABASE CRASH: {e}") 
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- 🔎 SALES INVOICE SEARCH (paged, with totals for the whole filter) ---
+@app.get("/sales-invoice/search")
+def search_sales_invoices(
+    customer: Optional[str] = None,
+    area: Optional[str] = None,
+    city: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    payment_mode: Optional[str] = None,
+    product: Optional[str] = Query(default=None, description="Product name or code"),
+    batch: Optional[str] = None,
+    page: int = Query(default=1, ge=1),
+    page_size: int = Query(default=50, ge=1, le=200),
+    db: Session = Depends(get_read_db)
+):
+    return ORJSONResponse(search_invoices(
+        db, page, page_size, customer=customer, area=area, city=city, date_from=date_from,
+        date_to=date_to, payment_mode=payment_mode, product=product, batch=batch,
+    ))
+
+# --- 🖨 SERVER-SIDE INVOICE PRINTING ---
+@app.post("/sales-invoice/print-batch")
+def print_invoice_batch(req: InvoicePrintBatch, db: Session = Depends(get_read_db)):
+    # e.g. reprint a whole day: {"invoice_date": "2025-06-01", "bundle": "zip"}
+    invoice_nos = list(req.invoice_nos)
+    if req.invoice_date:
+        invoice_nos += [no for (no,) in db.query(models.SalesInvoice.invoice_no).filter(
+            models.SalesInvoice.invoice_date == req.invoice_date
+        ).order_by(models.SalesInvoice.id)]
+    snapshots = invoice_render.load_invoices(db, invoice_nos)
+    if not snapshots:
+        raise HTTPException(status_code=404, detail="No invoices found")
+    try:
+        rendered = invoice_render.render_many(snapshots, req.format, tenant_of(db))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    body, media_type, filename = invoice_render.bundle(rendered, req.format, as_zip=req.bundle == "zip")
+    return Response(body, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/sales-invoice/{invoice_no}/print")
+def print_invoice(invoice_no: str, request: Request, format: str = "pdf", db: Session = Depends(get_read_db)):
+    snapshots = invoice_render.load_invoices(db, [invoice_no])
+    if not snapshots:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    etag = f'"{invoice_render.content_hash(snapshots[invoice_no])}-{format}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    try:
+        rendered = invoice_render.render_many(snapshots, format, tenant_of(db))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    body, media_type, _ = invoice_render.bundle(rendered, format)
+    return Response(body, media_type=media_type, headers={
+        "ETag": etag, "Content-Disposition": f'inline; filename="{invoice_render.filename(invoice_no, format)}"'
+    })
+
 @app.get("/sales-invoice/{invoice_no}")
-def get_invoice(invoice_no: str, db: Session = Depends(get_db)):
+def get_invoice(invoice_no: str, db: Session = Depends(get_read_db)):
     # 1. Fetch the Header
     invoice = db.query(models.SalesInvoice).filter(models.SalesInvoice.invoice_no == invoice_no).first()
     
@@ -385,10 +563,12 @@ def get_invoice(invoice_no: str, db: Session = Depends(get_db)):
         "rows": [
             {
                 "pcode": item.pcode,
+                "productId": item.product_id,
                 "name": item.name,
                 "batch": item.batch,
                 "exp": item.exp,
                 "qty": item.qty,
+                "free": item.free or 0,
                 "rate": item.rate,
                 "gst": item.gst,
                 "discount": item.discount,
@@ -405,7 +585,7 @@ def get_invoice(invoice_no: str, db: Session = Depends(get_db)):
     }
 
 @app.get("/customers/search")
-def search_customers(q: str = Query(default="", min_length=1), db: Session = Depends(get_db)):
+def search_customers(q: str = Query(default="", min_length=1), db: Session = Depends(get_read_db)):
     customers = db.query(Customer).filter(Customer.name.ilike(f"%{q}%")).all()
     return [
         {
@@ -418,19 +598,36 @@ def search_customers(q: str = Query(default="", min_length=1), db: Session = Dep
     ]
 
 @app.get("/products/search")
-def search_c_products(q: str = Query(...), db: Session = Depends(get_db)):
+def search_c_products(q: str = Query(...), customer: Optional[str] = None, db: Session = Depends(get_read_db)):
+    # Same keystrokes from many counters share one query (see hotcache.py)
+    return respond(db, ("product-search", q, customer), ("products", "invoice_products", "customer_product_rates"),
+                   lambda: _search_c_products(q, customer, db))
+
+def _search_c_products(q: str, customer: Optional[str], db: Session):
     # 1. Find the product in the master table
     products = db.query(Product).filter(Product.name.ilike(f"%{q}%")).all()
-    
+    names = [p.name for p in products]
+
+    # 2. The LATEST purchase entry of every match in one query, for Batch, Expiry and Rate
+    latest_ids = (
+        select(func.max(InvoiceProduct.id))
+        .where(InvoiceProduct.product_name.in_(names))
+        .group_by(InvoiceProduct.product_name)
+    )
+    latest = {
+        row.product_name: row for row in db.execute(
+            select(InvoiceProduct.product_name, InvoiceProduct.batch_no, InvoiceProduct.exp_date,
+                   InvoiceProduct.rate).where(InvoiceProduct.id.in_(latest_ids))
+        )
+    } if names else {}
+    # 3. What this customer was last billed for each of them (maintained index, one PK lookup)
+    last_sale = last_rates(db, customer, names)
+
     results = []
     for p in products:
-        # 2. Look for the LATEST purchase entry for this specific product 
-        # to get Batch, Expiry, and Rate
-        latest_stock = db.query(InvoiceProduct).filter(
-            InvoiceProduct.product_name == p.name
-        ).order_by(InvoiceProduct.id.desc()).first()
-        
+        latest_stock = latest.get(p.name)
         results.append({
+            "id": p.id,
             "pcode": p.code,
             "name": p.name,
             "packing": p.packing or "",
@@ -440,11 +637,25 @@ def search_c_products(q: str = Query(...), db: Session = Depends(get_db)):
             "batch": latest_stock.batch_no if latest_stock else "NO BATCH",
             "exp": latest_stock.exp_date.isoformat() if latest_stock and latest_stock.exp_date else "",
             "rate": latest_stock.rate if latest_stock else p.maxMRP,
+            "last_sale": last_sale.get(p.name),
         })
     return results
 
+@app.post("/api/last-rates/rebuild")
+def rebuild_customer_rates(db: Session = Depends(get_db)):
+    # Recompute the customer/product last-rate index from the sales history
+    return {"pairs": rebuild_last_rates(db)}
+
 @app.post("/sales-invoice")
-def create_sales_invoice(data: SalesInvoiceCreate, db: Session = Depends(get_db)):
+def create_sales_invoice(
+    data: SalesInvoiceCreate,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(default=None)
+):
+    # Retries carrying the same Idempotency-Key get the first response back
+    return run_once(db, "sales-invoice", idempotency_key, data, lambda: _create_sales_invoice(data, db))
+
+def _create_sales_invoice(data: SalesInvoiceCreate, db: Session):
     try:
         # 1. Save Header Info
         # Make sure these keys match your models.SalesInvoice columns exactly!
@@ -466,14 +677,19 @@ def create_sales_invoice(data: SalesInvoiceCreate, db: Session = Depends(get_db)
         db.add(new_invoice)
 
         # 2. Process Rows & Update Stock
-        for r in data.rows:
+        row_ids = sales_product_ids(db, data.rows)
+        codes = dict(db.execute(select(models.Product.id, models.Product.code).where(models.Product.id.in_(set(row_ids)))).all())
+        for r, product_id in zip(data.rows, row_ids):
             # Save Item Record (Check these column names too!)
             new_item = models.SalesInvoiceItem(
                 invoice_no=data.header.invoiceNo,
+                pcode=codes.get(product_id),  # product search matches it (invoice_search.py)
+                product_id=product_id,
                 name=r.name, # Ensure your model uses 'name' or 'product_name'
                 batch=r.batch,
                 exp=r.exp,   # Ensure your model uses 'exp' or 'expiry'
                 qty=r.qty,
+                free=r.free,
                 rate=r.rate,
                 gst=r.gst,
                 discount=r.discount,
@@ -481,50 +697,109 @@ def create_sales_invoice(data: SalesInvoiceCreate, db: Session = Depends(get_db)
             )
             db.add(new_item)
 
-            # --- Stock Update ---
-            product = db.query(models.Product).filter(models.Product.name == r.name).first()
-            if product:
-                product.current_stock -= (r.qty + r.free)
+        # --- Stock Update: one guarded UPDATE for every row, never below zero ---
+        take_stock(
+            db,
+            [(product_id, r.qty + r.free) for r, product_id in zip(data.rows, row_ids) if product_id is not None],
+            unmatched=[(r.name, r.qty + r.free) for r, product_id in zip(data.rows, row_ids) if product_id is None],
+        )
 
+        invalidate_checkpoints(db, data.header.invoiceDate)
+        record_sales(db, [(data.header.customer, data.header.invoiceNo, data.header.invoiceDate, data.rows)])
+        post_invoice(db, new_invoice.customer, new_invoice.payment_mode, new_invoice.grand_total)
         db.commit()
         return {"status": "success"}
 
+    except StockConflict as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Not enough stock to bill this invoice", "shortages": e.shortages}
+        )
     except Exception as e:
         db.rollback()
         # This will print the exact error to your terminal to help you debug
         print(f"Database Error: {e}") 
         raise HTTPException(status_code=500, detail=f"Transaction failed: {str(e)}")
 
+# --- 📥 BULK SALES INVOICES (offline field orders) ---
+@app.post("/sales-invoice/bulk")
+def create_sales_invoices_bulk(
+    data: SalesInvoiceBulk,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(default=None)
+):
+    # Orders that can't be billed fail individually; the rest are saved together
+    if len(data.invoices) > BULK_INVOICE_LIMIT:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_INVOICE_LIMIT} invoices per request")
+    return run_once(db, "sales-invoice-bulk", idempotency_key, data, lambda: _create_sales_invoices_bulk(data, db))
+
+def _create_sales_invoices_bulk(data: SalesInvoiceBulk, db: Session):
+    try:
+        return submit_invoices(db, data.invoices)
+    except Exception as e:
+        print(f"Database Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Transaction failed: {str(e)}")
+
 # 1. DELETE ENDPOINT
 @app.delete("/sales-invoice/{invoice_no}")
 def delete_invoice(invoice_no: str, db: Session = Depends(get_db)):
+    _delete_invoice(invoice_no, db)
+    db.commit()
+    return {"status": "deleted"}
+
+def _delete_invoice(invoice_no: str, db: Session):
+    # Leaves the commit to the caller so an update can undo the delete
+    invoice_render.invalidate(tenant_of(db), invoice_no)
     # 1. Get items to restore stock
     items = db.query(models.SalesInvoiceItem).filter(models.SalesInvoiceItem.invoice_no == invoice_no).all()
-    
-    for item in items:
-        # FIX: Change item.product_name to item.name
-        product = db.query(models.Product).filter(models.Product.name == item.name).first()
-        if product:
-            # Restore stock: add back the quantity and free items previously sold
-            product.current_stock += (item.qty + getattr(item, 'free', 0))
+    # Restore stock: add back the quantity and free items previously sold
+    add_stock(db, [
+        (product_id, (item.qty or 0) + (item.free or 0))
+        for item, product_id in zip(items, saved_product_ids(db, items, "name"))
+    ])
     
     # 2. Delete the records
+    invoice = db.query(
+        models.SalesInvoice.invoice_date, models.SalesInvoice.customer,
+        models.SalesInvoice.payment_mode, models.SalesInvoice.grand_total
+    ).filter(models.SalesInvoice.invoice_no == invoice_no).first()
     db.query(models.SalesInvoiceItem).filter(models.SalesInvoiceItem.invoice_no == invoice_no).delete()
     db.query(models.SalesInvoice).filter(models.SalesInvoice.invoice_no == invoice_no).delete()
-    
-    db.commit()
-    return {"status": "deleted"}
+    forget_invoice(db, invoice_no)
+    if invoice:
+        invalidate_checkpoints(db, invoice.invoice_date)
+        post_invoice(db, invoice.customer, invoice.payment_mode, -(invoice.grand_total or 0))
 
 # 2. UPDATE ENDPOINT (PUT)
 @app.put("/sales-invoice/{invoice_no}")
 def update_invoice(invoice_no: str, data: SalesInvoiceCreate, db: Session = Depends(get_db)):
-    # Simplest way: Delete old items (restore stock) and re-run the create logic
-    delete_invoice(invoice_no, db)
-    return create_sales_invoice(data, db)
+    # Simplest way: Delete old items (restore stock) and re-run the create logic.
+    # Both halves share one transaction, so a stock conflict keeps the old invoice.
+    _delete_invoice(invoice_no, db)
+    return _create_sales_invoice(data, db)
+
+# --- 🧮 STOCK RECONCILIATION (stored vs purchase/sales history) ---
+@app.get("/api/stock/reconciliation")
+def get_stock_reconciliation(batches: bool = False, full: bool = False, db: Session = Depends(get_read_db)):
+    # full=true ignores checkpoints and re-aggregates the whole history; read-only
+    return ORJSONResponse(reconcile(db, batches=batches, use_checkpoints=not full))
+
+@app.post("/api/stock/reconciliation/apply")
+def apply_stock_reconciliation(full: bool = False, db: Session = Depends(get_db)):
+    # Sets current_stock to the expected figure for every drifted product
+    return ORJSONResponse(reconcile(db, apply=True, use_checkpoints=not full, save=True))
+
+# --- 🔄 DELTA SYNC (masters + stock) ---
+@app.get("/sync")
+def sync_changes(since: int = Query(default=0, ge=0), limit: int = Query(default=5000, ge=1, le=20000),
+                 db: Session = Depends(get_read_db)):
+    # Keep calling with since=<next> while "more" is true
+    return ORJSONResponse(changes_since(db, since, limit))
 
 # --- 📦 SUPPLIER SEARCH (Live Search) ---
 @app.get("/suppliers/search")
-def search_suppliers(q: str = Query(default="", min_length=1), db: Session = Depends(get_db)):
+def search_suppliers(q: str = Query(default="", min_length=1), db: Session = Depends(get_read_db)):
     # Using .ilike for case-insensitive search
     suppliers = db.query(models.Supplier).filter(
         models.Supplier.supplier_name.ilike(f"%{q}%")
@@ -542,7 +817,7 @@ def search_suppliers(q: str = Query(default="", min_length=1), db: Session = Dep
     ]
 # --- 🌿 PRODUCT SEARCH (Multi-Column Recommendations) ---
 @app.get("/products/search")
-def search_products(q: str = Query(default="", min_length=1), db: Session = Depends(get_db)):
+def search_products(q: str = Query(default="", min_length=1), db: Session = Depends(get_read_db)):
     products = db.query(Product).filter(Product.name.ilike(f"%{q}%")).all()
     return [
         {
@@ -558,43 +833,139 @@ def search_products(q: str = Query(default="", min_length=1), db: Session = Depe
 
 # --- 🌿 PRODUCT STOCK SEARCH ---
 @app.get("/api/stock/search")
-def search_stock(q: str = Query(default="", min_length=1), db: Session = Depends(get_db)):
-    # Search products by name or code
-    products = db.query(models.Product).filter(
-        (models.Product.name.ilike(f"%{q}%")) | (models.Product.code.ilike(f"%{q}%"))
-    ).all()
-    
-    return [
-        {
-            "id": p.id,
-            "pcode": p.code,
-            "name": p.name,
-            "packing": p.packing,
-            "division": p.division,
-            "mrp": p.maxMRP,
-            "stock": p.current_stock # This is the critical field from the Invoice update
-        } for p in products
-    ]
+def search_stock(q: str = Query(default="", min_length=1), fields: Optional[str] = None,
+                 division: Optional[str] = None, db: Session = Depends(get_read_db)):
+    # Search products by name or code; id, pcode, name, packing, division, mrp, stock
+    # ("stock" is current_stock, the critical field from the Invoice update)
+    # ?division= takes a division id or name and narrows through the division index
+    columns = pick_fields(fields, STOCK_SEARCH_FIELDS)
+    criteria = [(models.Product.name.ilike(f"%{q}%")) | (models.Product.code.ilike(f"%{q}%"))]
+    if division:
+        criteria.append(models.Product.division_id == int(division) if division.isdigit() else
+                        models.Product.division_id.in_(select(Division.id).where(Division.name == division)))
+    return respond(db, ("stock-search", q, fields, division), ("products", "divisions"),
+                   lambda: fetch_rows(db, models.Product, columns, *criteria))
+
+# --- 🏷 DIVISIONS ---
+@app.get("/api/divisions")
+def get_divisions(company_id: Optional[int] = None, db: Session = Depends(get_read_db)):
+    # Every division with its company, product count and units in stock
+    return ORJSONResponse(list_divisions(db, company_id))
+
+@app.get("/api/divisions/{division_id}/stock")
+def get_division_stock(division_id: int, db: Session = Depends(get_read_db)):
+    if db.get(Division, division_id) is None:
+        raise HTTPException(status_code=404, detail="Division not found")
+    return ORJSONResponse(division_stock(db, division_id))
+
+# --- 📊 STOCK VALUATION (FIFO, at purchase cost) ---
+@app.get("/api/reports/stock-valuation")
+def get_stock_valuation(
+    as_of: Optional[date] = None,
+    group_by: str = Query(default="batch"),
+    db: Session = Depends(get_read_db)
+):
+    # group_by: product | batch | division | manufacturer
+    try:
+        return valuation_report(db, as_of or date.today(), group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/reports/stock-valuation/checkpoint")
+def create_valuation_checkpoint(as_of: date = Query(...), db: Session = Depends(get_db)):
+    # Run at month-end / FY-end so later reports only replay newer transactions
+    lots = save_checkpoint(db, as_of)
+    return {"message": f"Checkpoint saved for {as_of}", "open_lots": lots}
+
+# --- 💰 RECEIVABLES ---
+@app.get("/api/receivables/aging")
+def get_receivables_aging(db: Session = Depends(get_read_db)):
+    # 0-30 / 30-60 / 60-90 / 90+ days past due, read from maintained balances
+    return aging_report(db)
+
+@app.get("/api/receivables/{customer}")
+def get_customer_outstanding(customer: str, db: Session = Depends(get_read_db)):
+    return get_balance(db, customer)
+
+@app.post("/api/receivables/receipts")
+def create_receipt(receipt: ReceiptCreate, db: Session = Depends(get_db)):
+    db_receipt = models.Receipt(**receipt.dict())
+    db.add(db_receipt)
+    adjust(db, receipt.customer, -receipt.amount)
+    db.commit()
+    return {"message": "Receipt saved", "id": db_receipt.id, **get_balance(db, receipt.customer)}
+
+@app.delete("/api/receivables/receipts/{receipt_id}")
+def delete_receipt(receipt_id: int, db: Session = Depends(get_db)):
+    db_receipt = db.query(models.Receipt).filter(models.Receipt.id == receipt_id).first()
+    if not db_receipt:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    customer, amount = db_receipt.customer, db_receipt.amount
+    db.delete(db_receipt)
+    adjust(db, customer, amount)
+    db.commit()
+    return {"message": "Receipt deleted", **get_balance(db, customer)}
+
+@app.post("/api/receivables/rebuild")
+def rebuild_receivables(db: Session = Depends(get_db)):
+    # Full recompute, e.g. after importing old invoices directly into the DB
+    return {"customers": rebuild_balances(db)}
+
+# --- 🛒 REORDER SUGGESTIONS (from 30/90-day sales velocity) ---
+@app.get("/api/reorder/suggestions")
+def get_reorder_suggestions(
+    lead_days: int = Query(default=7, ge=0),
+    cover_days: int = Query(default=30, ge=1),
+    db: Session = Depends(get_read_db)
+):
+    # Grouped by each product's last supplier, ready to turn into purchase orders
+    return suggest_reorders(db, lead_days, cover_days)
+
+# --- ⏱ BACKGROUND JOBS ---
+@app.get("/api/jobs/registry")
+def get_job_registry():
+    return registered_jobs()
+
+@app.post("/api/jobs/{name}")
+def enqueue_job(name: str, params: Optional[dict] = None, db: Session = Depends(get_db)):
+    # Returns immediately; poll GET /api/jobs/{id} for the result. Runs for the caller's tenant.
+    try:
+        return scheduler.enqueue(name, params, tenant_of(db))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{name}'")
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full, try again later")
+
+@app.get("/api/jobs/{job_id}")
+def get_job_status(job_id: int, db: Session = Depends(get_db)):
+    job = get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs")
+def get_jobs(name: Optional[str] = None, limit: int = 50, db: Session = Depends(get_db)):
+    return list_jobs(db, name, limit)
 
 #dashboard endpoint
 @app.get("/api/dashboard-stats")
 def get_dashboard_stats(
     from_date: date = Query(...), 
     to_date: date = Query(...), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
+    # Every open dashboard asks for the same range; they share one computation
+    return respond(db, ("dashboard-stats", from_date, to_date), ("sales_invoices", "products", "invoice_products"),
+                   lambda: _dashboard_stats(from_date, to_date, db))
+
+def _dashboard_stats(from_date: date, to_date: date, db: Session):
     try:
-        # 1. Total Sales
-        total_sales = db.query(func.sum(models.SalesInvoice.grand_total)).filter(
-            models.SalesInvoice.invoice_date >= from_date,
-            models.SalesInvoice.invoice_date <= to_date
-        ).scalar() or 0
-
-        # 2. Orders Count
-        orders_count = db.query(models.SalesInvoice).filter(
-            models.SalesInvoice.invoice_date >= from_date,
-            models.SalesInvoice.invoice_date <= to_date
-        ).count()
+        # 1. Total Sales + 2. Orders Count (reaches into archived years only if the range does)
+        sales = routed(db, models.SalesInvoice, from_date, to_date).c
+        total_sales, orders_count = db.execute(
+            select(func.coalesce(func.sum(sales.grand_total), 0), func.count())
+            .where(sales.invoice_date >= from_date, sales.invoice_date <= to_date)
+        ).one()
 
         # 3. Low Stock
         low_stock_count = db.query(models.Product).filter(
@@ -623,6 +994,37 @@ def get_dashboard_stats(
         print(f"Dashboard Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
+# --- ⚡ HOT READ CACHE STATS ---
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    # hits / misses / coalesced (waited on an identical in-flight request) for this worker
+    return hot.snapshot()
+
+# --- 📈 SALES ANALYTICS (in-memory columns, see analytics.py) ---
+@app.get("/api/analytics/sales")
+def get_sales_analytics(
+    group_by: str = "",
+    metric: str = "amount",
+    top: Optional[int] = Query(default=None, ge=1),
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    customer: Optional[str] = None,
+    product: Optional[str] = None,
+    area: Optional[str] = None,
+    city: Optional[str] = None,
+    division: Optional[str] = None,
+    payment_mode: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    # e.g. ?group_by=product&top=10, ?group_by=month,division, ?group_by=customer&city=Pune,Nashik
+    try:
+        return ORJSONResponse(sales_report(
+            db, group_by, metric, top, date_from=from_date, date_to=to_date, customer=customer,
+            product=product, area=area, city=city, division=division, payment_mode=payment_mode,
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/users/me")
 def get_current_user_profile(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     try:
@@ -657,8 +1059,13 @@ def get_all_users(token: str = Depends(oauth2_scheme), db: Session = Depends(get
         
         # 2. We removed the "Admin only" check. Now any valid token can pass.
         
-        # 3. Return all users
-        return db.query(models.User).all()
+        # 3. Return all users (projected, so password_hash never leaves the DB)
+        users = fetch_rows(db, models.User, USER_FIELDS)
+        # is_active = online right now, from the presence registry
+        online = manager.online_users()
+        for u in users:
+            u["is_active"] = u["username"] in online
+        return ORJSONResponse(users)
         
     except JWTError:
         # If the token is fake or expired, they still get a 401
@@ -730,6 +1137,29 @@ def register_user(payload: dict, db: Session = Depends(get_db), token: str = Dep
     db.commit()
     return {"message": f"User {new_user.username} created successfully"}
 
+@app.get("/api/chat/presence")
+def get_chat_presence(token: str = Depends(oauth2_scheme)):
+    jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    return {"online": sorted(manager.online_users())}
+
+# --- 📥 INBOX (last message + unread count per conversation) ---
+@app.get("/api/chat/inbox")
+def get_chat_inbox(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    return inbox(db, payload.get("sub"))
+
+@app.post("/api/chat/read/{other_user}")
+def mark_chat_read(other_user: str, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    mark_read(db, payload.get("sub"), other_user)
+    db.commit()
+    return {"message": "Marked as read"}
+
+@app.post("/api/chat/inbox/rebuild")
+def rebuild_chat_inbox(db: Session = Depends(get_db)):
+    # Full recompute from chat_messages
+    return {"conversations": rebuild_inbox(db)}
+
 @app.get("/api/chat/history/{other_user}")
 def get_chat_history(other_user: str, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -741,11 +1171,8 @@ def get_chat_history(other_user: str, token: str = Depends(oauth2_scheme), db: S
         ((models.ChatMessage.sender == other_user) & (models.ChatMessage.receiver == current_user))
     ).order_by(models.ChatMessage.timestamp.asc()).all()
     
-    # Mark messages as read
-    db.query(models.ChatMessage).filter(
-        models.ChatMessage.sender == other_user, 
-        models.ChatMessage.receiver == current_user
-    ).update({"is_read": True})
+    # Mark messages as read (and zero the inbox counter)
+    mark_read(db, current_user, other_user)
     db.commit()
     
     # FIX: Convert SQLAlchemy objects to a list of dictionaries
@@ -762,14 +1189,8 @@ def get_chat_history(other_user: str, token: str = Depends(oauth2_scheme), db: S
 
 @app.websocket("/ws/chat/{username}")
 async def websocket_endpoint(websocket: WebSocket, username: str, db: Session = Depends(get_db)):
+    # Presence lives in the chat manager's registry (shared across workers), not in users.is_active
     await manager.connect(username, websocket)
-    
-    # Update status to active
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user:
-        user.is_active = True
-        db.commit()
-    await manager.broadcast_status(username, "online")
         
     try:
         while True:
@@ -782,6 +1203,7 @@ async def websocket_endpoint(websocket: WebSocket, username: str, db: Session =
                 message=data["message"]
             )
             db.add(new_msg)
+            record_message(db, new_msg)  # inbox rows for both sides, same commit
             db.commit()
             db.refresh(new_msg) # Get the ID and timestamp generated by DB
 
@@ -797,15 +1219,19 @@ async def websocket_endpoint(websocket: WebSocket, username: str, db: Session =
             await manager.send_personal_message(payload, data["receiver"])
             
     except WebSocketDisconnect:
-        manager.disconnect(username)
-        user = db.query(models.User).filter(models.User.username == username).first()
-        if user:
-            user.is_active = False
-            db.commit()
-        await manager.broadcast_status(username, "offline")
+        pass
+    finally:
+        # Also on a bad payload or DB error, or the user stays "online" with a dead socket
+        await manager.disconnect(username, websocket)
 
 
 @app.get("/api/recent-orders")
-def get_recent_orders(limit: int = 5, db: Session = Depends(get_db)):
+def get_recent_orders(limit: int = 5, fast: bool = False, fields: Optional[str] = None,
+                      db: Session = Depends(get_read_db)):
     # Returns the latest sales invoices to the dashboard
+    if fast or fields:
+        return ORJSONResponse(fetch_rows(
+            db, models.SalesInvoice, pick_fields(fields, SALES_INVOICE_FIELDS),
+            order_by=models.SalesInvoice.invoice_date.desc(), limit=limit
+        ))
     return db.query(models.SalesInvoice).order_by(models.SalesInvoice.invoice_date.desc()).limit(limit).all()
\ No newline at end of file
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, JSON, Date,Text,DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, JSON, Date,Text,DateTime, Index, UniqueConstraint, text
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from .db import Base
+from .db import Base, Tenanted, row_tenant
 from datetime import datetime
 
 class User(Base):
@@ -23,15 +23,20 @@ class ChatMessage(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     is_read = Column(Boolean, default=False)
 
-class Product(Base):
+    __table_args__ = (
+        Index("ix_chat_messages_pair", "sender", "receiver", "timestamp"),
+    )
+
+class Product(Tenanted, Base):
     __tablename__ = "products"
     id = Column(Integer, primary_key=True, index=True)
-    code = Column(String, unique=True, index=True)
+    code = Column(String, index=True)
     name = Column(String, index=True)
     current_stock = Column(Integer, default=0)
     packing = Column(String, nullable=True)
     manufacturer = Column(String, nullable=True)
     division = Column(String, nullable=True) # Matches frontend change
+    division_id = Column(Integer, ForeignKey("divisions.id", ondelete="SET NULL"), nullable=True)  # see divisions.py
     category = Column(String, nullable=True)
     genericGroup = Column(String, nullable=True)
     therapeuticGroup = Column(String, nullable=True)
@@ -46,10 +51,18 @@ class Product(Base):
     rowColor = Column(String, default="#2d6a4f") # Tulsi Green
     flashMessage = Column(String, nullable=True)
 
-class Customer(Base):
+    __table_args__ = (
+        # Codes are unique per distributor (tenant, see db.Tenanted)
+        Index("ux_products_tenant_code", "tenant", "code", unique=True),
+        Index("ix_products_tenant_name", "tenant", "name"),
+        # Division stock lists / division filter on search: one index range, already in name order
+        Index("ix_products_division_name", "tenant", "division_id", "name"),
+    )
+
+class Customer(Tenanted, Base):
     __tablename__ = "customers"
     id = Column(Integer, primary_key=True, index=True)
-    code = Column(String, unique=True, index=True)
+    code = Column(String, index=True)
     name = Column(String, index=True)
     owner_name = Column(String, nullable=True)
     address = Column(String, nullable=True)
@@ -68,10 +81,15 @@ class Customer(Base):
     tcs = Column(Boolean, default=False)
     tds = Column(Boolean, default=False)
 
-class Company(Base):
+    __table_args__ = (
+        Index("ux_customers_tenant_code", "tenant", "code", unique=True),
+        Index("ix_customers_tenant_name", "tenant", "name"),
+    )
+
+class Company(Tenanted, Base):
     __tablename__ = "companies"
     id = Column(Integer, primary_key=True, index=True)
-    regd_code = Column(String, unique=True, index=True)
+    regd_code = Column(String, index=True)
     name = Column(String, index=True)
     divisions = Column(JSON, default=[]) # Imported JSON fixes the error
     contact_person = Column(String, nullable=True)
@@ -82,10 +100,30 @@ class Company(Base):
     einv = Column(Boolean, default=False)
     pi_round = Column(Boolean, default=False)
 
-class Supplier(Base):
+    __table_args__ = (
+        Index("ux_companies_tenant_regd_code", "tenant", "regd_code", unique=True),
+        Index("ix_companies_tenant_name", "tenant", "name"),
+    )
+
+class Division(Tenanted, Base):
+    # One row per company division; Company.divisions (JSON) is kept for the API
+    __tablename__ = "divisions"
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=True)  # NULL: company unknown
+    name = Column(String, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "name", name="uq_divisions_company_name"),
+        # The constraint above treats NULL company_ids as distinct; one unowned row per name
+        Index("uq_divisions_unowned_name", "tenant", "name", unique=True,
+              sqlite_where=text("company_id IS NULL"), postgresql_where=text("company_id IS NULL")),
+        Index("ix_divisions_name", "tenant", "name"),
+    )
+
+class Supplier(Tenanted, Base):
     __tablename__ = "suppliers"
     id = Column(Integer, primary_key=True, index=True)
-    code = Column(String, unique=True, index=True)
+    code = Column(String, index=True)
     supplier_name = Column(String, index=True)
     owner_name = Column(String)
     address = Column(String, nullable=True)
@@ -99,10 +137,15 @@ class Supplier(Base):
     opening_balance = Column(String, nullable=True)
     tds = Column(Boolean, default=False)
 
-class SalesInvoice(Base):
+    __table_args__ = (
+        Index("ux_suppliers_tenant_code", "tenant", "code", unique=True),
+        Index("ix_suppliers_tenant_name", "tenant", "supplier_name"),
+    )
+
+class SalesInvoice(Tenanted, Base):
     __tablename__ = "sales_invoices"
     id = Column(Integer, primary_key=True)
-    invoice_no = Column(String, unique=True, index=True)
+    invoice_no = Column(String, index=True)
     state = Column(String)
     invoice_date = Column(Date)
     customer = Column(String) # If this is 'customer', use customer=...
@@ -118,21 +161,45 @@ class SalesInvoice(Base):
     total_gst = Column(Float)
     grand_total = Column(Float)
 
-class SalesInvoiceItem(Base):
+    __table_args__ = (
+        # Invoice numbers run per distributor
+        Index("ux_sales_invoices_tenant_invoice_no", "tenant", "invoice_no", unique=True),
+        # Receivables aging walks a party's credit invoices newest-first
+        Index("ix_sales_invoices_customer_date", "tenant", "customer", "invoice_date"),
+        # Invoice search: each header filter narrows by date within its own index
+        Index("ix_sales_invoices_date", "tenant", "invoice_date", "id"),
+        Index("ix_sales_invoices_area_date", "tenant", "area", "invoice_date"),
+        Index("ix_sales_invoices_city_date", "tenant", "city", "invoice_date"),
+        Index("ix_sales_invoices_mode_date", "tenant", "payment_mode", "invoice_date"),
+    )
+
+class SalesInvoiceItem(Tenanted, Base):
     __tablename__ = "sales_invoice_items"
     id = Column(Integer, primary_key=True)
     invoice_no = Column(String, index=True)
     pcode = Column(String)
+    product_id = Column(Integer, nullable=True)  # stock moved against this product; NULL on older rows
     name = Column(String)
     batch = Column(String)
     exp = Column(Date)
     qty = Column(Integer)
+    free = Column(Integer, default=0)  # free units leave stock too
     rate = Column(Float)
     gst = Column(Float)
     discount = Column(Float)
     line_total = Column(Float)
 
-class InvoiceProduct(Base):
+    __table_args__ = (
+        Index("ix_sales_invoice_items_tenant_invoice", "tenant", "invoice_no"),
+        # "invoices containing product X [batch Y]" without reading item rows
+        Index("ix_sales_invoice_items_name_batch", "tenant", "name", "batch", "invoice_no"),
+        Index("ix_sales_invoice_items_pcode", "tenant", "pcode", "invoice_no"),
+        Index("ix_sales_invoice_items_batch", "tenant", "batch", "invoice_no"),
+        # Analytics refresh counts one tenant's lines up to its watermark
+        Index("ix_sales_invoice_items_tenant_id", "tenant", "id"),
+    )
+
+class InvoiceProduct(Tenanted, Base):
     __tablename__ = "invoice_products"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -152,6 +219,7 @@ class InvoiceProduct(Base):
 
     # ---------- PRODUCT / STOCK ----------
     product_name = Column(String)
+    product_id = Column(Integer, nullable=True)  # stock moved against this product; NULL on older rows
     batch_no = Column(String)
     exp_date = Column(Date)
 
@@ -162,3 +230,172 @@ class InvoiceProduct(Base):
     gst_percent = Column(Float)
     amount = Column(Float)
 
+    __table_args__ = (
+        Index("ix_invoice_products_tenant_entry", "tenant", "entry_no"),
+        # Latest purchase per product (batch/expiry/rate in product search): max(id) from the index
+        Index("ix_invoice_products_name_id", "tenant", "product_name", "id"),
+    )
+
+
+class TableVersion(Tenanted, Base):
+    # One row per (tenant, master table), bumped by every write endpoint (see versions.py)
+    __tablename__ = "table_versions"
+    tenant = Column(String(128), primary_key=True, default=row_tenant)
+    table_name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class IdempotencyKey(Tenanted, Base):
+    # Idempotency-Key of a committed POST and its response (see idempotency.py)
+    __tablename__ = "idempotency_keys"
+    tenant = Column(String(128), primary_key=True, default=row_tenant)
+    scope = Column(String(64), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    response = Column(JSON, nullable=True)  # stored right after the commit it belongs to
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class ValuationCheckpoint(Tenanted, Base):
+    # Open FIFO cost layers saved at a period end (see valuation.py)
+    __tablename__ = "valuation_checkpoints"
+    id = Column(Integer, primary_key=True)
+    as_of = Column(Date, index=True)
+    product_name = Column(String)
+    batch = Column(String, nullable=True)
+    lot_date = Column(Date, nullable=True)
+    qty = Column(Integer)
+    unit_cost = Column(Float)
+
+    __table_args__ = (
+        Index("ix_valuation_checkpoints_tenant_as_of", "tenant", "as_of"),
+    )
+
+class CustomerBalance(Tenanted, Base):
+    # Maintained receivables per party (see receivables.py)
+    __tablename__ = "customer_balances"
+    tenant = Column(String(128), primary_key=True, default=row_tenant)
+    customer = Column(String, primary_key=True)
+    balance = Column(Float, default=0)
+    due_0_30 = Column(Float, default=0)
+    due_30_60 = Column(Float, default=0)
+    due_60_90 = Column(Float, default=0)
+    due_90_plus = Column(Float, default=0)
+    aged_on = Column(Date, nullable=True)
+
+class Receipt(Tenanted, Base):
+    __tablename__ = "receipts"
+    id = Column(Integer, primary_key=True, index=True)
+    customer = Column(String, index=True)
+    receipt_date = Column(Date)
+    amount = Column(Float)
+    mode = Column(String, nullable=True)
+    reference = Column(String, nullable=True)
+    notes = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_receipts_tenant_customer", "tenant", "customer"),
+    )
+
+class ArchivedYear(Base):
+    # Closed financial years moved out of the hot tables (see partitions.py)
+    __tablename__ = "archived_years"
+    fy = Column(String(9), primary_key=True)  # "2023-2024"
+    start_date = Column(Date)
+    end_date = Column(Date)
+    sales_invoices = Column(Integer, default=0)
+    sales_invoice_items = Column(Integer, default=0)
+    invoice_products = Column(Integer, default=0)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(Tenanted, Base):
+    # Background job runs, on-demand and scheduled (see jobs.py)
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(64), index=True)
+    params = Column(JSON, default={})
+    status = Column(String(16), default="queued")  # queued | running | done | failed
+    # Set for cron runs: the unique (name, slot) row is how one worker claims a run
+    scheduled_for = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        # Cron runs are claimed once per tenant
+        UniqueConstraint("name", "scheduled_for", "tenant", name="uq_jobs_name_slot"),
+    )
+
+class ChangeLog(Tenanted, Base):
+    # Append-only change feed for delta sync (see changelog.py)
+    __tablename__ = "change_log"
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+    table_name = Column(String(32))
+    row_id = Column(Integer)
+    op = Column(String(8))  # upsert | delete
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_change_log_row", "table_name", "row_id"),
+        Index("ix_change_log_tenant_seq", "tenant", "seq"),
+    )
+
+class ChangeCounter(Base):
+    # Single row; its lock orders change_log seqs by commit order
+    __tablename__ = "change_counter"
+    id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)
+
+class ChatConversation(Base):
+    # One row per (owner, partner): the inbox sidebar, maintained on every message (see inbox.py)
+    __tablename__ = "chat_conversations"
+    owner = Column(String(64), primary_key=True)
+    partner = Column(String(64), primary_key=True)
+    last_message_id = Column(Integer)
+    last_message = Column(String(200))  # preview only; full text stays in chat_messages
+    last_sender = Column(String(64))
+    last_at = Column(DateTime)
+    unread = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_chat_conversations_owner_last", "owner", "last_at"),
+    )
+
+class StockCheckpoint(Tenanted, Base):
+    # Purchased minus sold per (product, batch) up to as_of (see reconcile.py)
+    __tablename__ = "stock_checkpoints"
+    tenant = Column(String(128), primary_key=True, default=row_tenant)
+    as_of = Column(Date, primary_key=True)
+    product_name = Column(String, primary_key=True)
+    batch = Column(String, primary_key=True, default="")
+    qty = Column(Integer, nullable=False, default=0)
+
+class ProductAlias(Tenanted, Base):
+    # What a supplier calls one of our products, learned from purchase entry (see resolver.py)
+    __tablename__ = "product_aliases"
+    id = Column(Integer, primary_key=True)
+    supplier_name = Column(String, nullable=False, default="")  # normalized; "" = any supplier
+    alias = Column(String, nullable=False)  # normalized
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("tenant", "supplier_name", "alias", name="uq_product_aliases_supplier_alias"),
+    )
+
+class CustomerProductRate(Tenanted, Base):
+    # Rate/discount/batch last billed to a customer for a product (see last_rates.py)
+    __tablename__ = "customer_product_rates"
+    tenant = Column(String(128), primary_key=True, default=row_tenant)
+    customer = Column(String, primary_key=True)
+    product_name = Column(String, primary_key=True)
+    rate = Column(Float)
+    discount = Column(Float)
+    batch = Column(String)
+    invoice_date = Column(Date)
+    invoice_no = Column(String)
+
+    __table_args__ = (
+        # Editing/deleting an invoice re-derives the rows that pointed at it
+        Index("ix_customer_product_rates_invoice", "tenant", "invoice_no"),
+    )
@@ -0,0 +1,205 @@
+from datetime import date, datetime
+
+from sqlalchemy import Table, Column, Date, MetaData, select, insert, delete, func, union_all, text, inspect, tuple_
+from sqlalchemy.orm import Session
+
+from .db import add_missing_columns
+from .models import SalesInvoice, SalesInvoiceItem, InvoiceProduct, ArchivedYear
+from .utils import financial_year_bounds, current_financial_year
+
+# --- 🗄 FINANCIAL-YEAR ARCHIVE ---
+# The hot tables only hold open financial years. Closing a year moves its rows
+# into history tables that carry one extra column, fy_date (the date that
+# decides the row's year):
+#   * PostgreSQL: <table>_history, range-partitioned by fy_date with one
+#     partition per FY (<table>_fy2023_24), so the planner prunes by date.
+#   * Anything else (SQLite): a standalone <table>_fy2023_24 per FY.
+# routed() gives date-bounded reads one selectable over hot + archived rows,
+# limited to the session's tenant (see db.Tenanted).
+
+MODELS = (SalesInvoice, SalesInvoiceItem, InvoiceProduct)
+archive_metadata = MetaData()
+
+
+def _fy_date(model):
+    if model is SalesInvoice:
+        return SalesInvoice.invoice_date
+    if model is InvoiceProduct:
+        return func.coalesce(InvoiceProduct.entry_date, InvoiceProduct.invoice_date)
+    # Items have no date of their own; they follow their invoice
+    return (
+        select(SalesInvoice.invoice_date)
+        .where(SalesInvoice.tenant == SalesInvoiceItem.tenant, SalesInvoice.invoice_no == SalesInvoiceItem.invoice_no)
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def _in_year(model, start: date, end: date):
+    if model is SalesInvoiceItem:
+        invoice_nos = select(SalesInvoice.tenant, SalesInvoice.invoice_no).where(
+            SalesInvoice.invoice_date >= start, SalesInvoice.invoice_date <= end
+        )
+        return tuple_(SalesInvoiceItem.tenant, SalesInvoiceItem.invoice_no).in_(invoice_nos)
+    day = _fy_date(model)
+    return (day >= start) & (day <= end)
+
+
+def _suffix(fy: str) -> str:
+    first, second = fy.split("-")
+    return f"fy{first}_{second[-2:]}"
+
+
+def _is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _archive_table(model, name: str) -> Table:
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+    columns = [Column(c.name, c.type) for c in model.__table__.columns]
+    return Table(name, archive_metadata, *columns, Column("fy_date", Date, index=True))
+
+
+def _history_name(model) -> str:
+    return f"{model.__tablename__}_history"
+
+
+def _ensure_archive(db: Session, model, fy: str) -> Table:
+    start, end = financial_year_bounds(fy)
+    partition = f"{model.__tablename__}_{_suffix(fy)}"
+    if not _is_postgres(db):
+        table = _archive_table(model, partition)
+        table.create(bind=db.connection(), checkfirst=True)
+        return table
+
+    parent = _history_name(model)
+    db.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {parent} "
+        f"(LIKE {model.__tablename__} INCLUDING DEFAULTS, fy_date date NOT NULL) "
+        f"PARTITION BY RANGE (fy_date)"
+    ))
+    db.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {parent} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{date(end.year, 4, 1).isoformat()}')"
+    ))
+    # Indexes on the parent cascade to every partition
+    db.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{parent}_fy_date ON {parent} (fy_date)"))
+    return _archive_table(model, parent)
+
+
+def _sources(db: Session, model, start=None, end=None):
+    years = db.query(ArchivedYear.fy)
+    if start is not None:
+        years = years.filter(ArchivedYear.end_date >= start)
+    if end is not None:
+        years = years.filter(ArchivedYear.start_date <= end)
+    years = [fy for (fy,) in years.order_by(ArchivedYear.start_date)]
+    if not years:
+        return []
+    if _is_postgres(db):
+        return [_archive_table(model, _history_name(model))]
+    return [_archive_table(model, f"{model.__tablename__}_{_suffix(fy)}") for fy in years]
+
+
+def _archived_parts(db: Session, model, start=None, end=None) -> list:
+    hot = model.__table__
+    tenant = db.info.get("tenant")
+    parts = []
+    for table in _sources(db, model, start, end):
+        stmt = select(*(table.c[c.name] for c in hot.columns))
+        if tenant is not None:
+            stmt = stmt.where(table.c.tenant == tenant)
+        if start is not None:
+            stmt = stmt.where(table.c.fy_date >= start)
+        if end is not None:
+            stmt = stmt.where(table.c.fy_date <= end)
+        parts.append(stmt)
+    return parts
+
+
+def routed(db: Session, model, start: date = None, end: date = None):
+    """Hot table plus the archived years overlapping [start, end].
+
+    Returns the plain table when nothing archived overlaps and the session
+    has no tenant, so current-year reads are untouched. Callers still apply
+    their own date filter on .c.
+    """
+    hot = model.__table__
+    tenant = db.info.get("tenant")
+    parts = _archived_parts(db, model, start, end)
+    if not parts and tenant is None:
+        return hot
+    current = select(*hot.c) if tenant is None else select(*hot.c).where(hot.c.tenant == tenant)
+    if not parts:
+        return current.subquery(hot.name)
+    return union_all(current, *parts).subquery(hot.name)
+
+
+def archived(db: Session, model, start: date = None, end: date = None):
+    """Only the archived rows (same columns as the hot table), or None if no year is archived."""
+    parts = _archived_parts(db, model, start, end)
+    if not parts:
+        return None
+    return union_all(*parts).subquery(f"{model.__tablename__}_archived")
+
+
+def archive_year(db: Session, fy: str) -> dict:
+    """Move a closed financial year out of the hot tables, in one transaction.
+
+    Run it from a session without a tenant: a financial year closes for every tenant at once.
+    """
+    start, end = financial_year_bounds(fy)
+    current_start, _ = financial_year_bounds(current_financial_year())
+    if end >= current_start:
+        raise ValueError(f"{fy} is not closed yet")
+
+    moved = {}
+    # Items first: they find their year through the invoice header
+    for model in (SalesInvoiceItem, SalesInvoice, InvoiceProduct):
+        table = _ensure_archive(db, model, fy)
+        names = [c.name for c in model.__table__.columns]
+        where = _in_year(model, start, end)
+        day = _fy_date(model)
+        source = select(*(model.__table__.c[n] for n in names), day).where(where)
+        moved[model.__tablename__] = db.execute(
+            insert(table).from_select(names + ["fy_date"], source)
+        ).rowcount
+        db.execute(delete(model.__table__).where(where))
+
+    record = db.get(ArchivedYear, fy) or ArchivedYear(fy=fy, start_date=start, end_date=end)
+    record.sales_invoices = (record.sales_invoices or 0) + moved["sales_invoices"]
+    record.sales_invoice_items = (record.sales_invoice_items or 0) + moved["sales_invoice_items"]
+    record.invoice_products = (record.invoice_products or 0) + moved["invoice_products"]
+    record.archived_at = datetime.utcnow()
+    db.add(record)
+    db.commit()
+    return moved
+
+
+def archive_tables(engine) -> list:
+    """(model, table name) of every archive table in the database."""
+    names = inspect(engine).get_table_names()
+    postgres = engine.dialect.name == "postgresql"
+    return [
+        (model, name) for model in MODELS for name in names
+        if (name == _history_name(model) if postgres else name.startswith(f"{model.__tablename__}_fy"))
+    ]
+
+
+def sync_archive_columns(engine):
+    # Columns added to a hot table must exist in its archives too, since
+    # routed() selects the hot table's column list from both
+    # (on PostgreSQL the partitions follow their parent)
+    for model, name in archive_tables(engine):
+        add_missing_columns(engine, model.__table__, name)
+
+
+def compact(engine):
+    # VACUUM can't run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "postgresql":
+            tables = ", ".join(m.__tablename__ for m in MODELS)
+            conn.execute(text(f"VACUUM ANALYZE {tables}"))
+        elif engine.dialect.name == "sqlite":
+            conn.execute(text("VACUUM"))
@@ -0,0 +1,204 @@
+import re
+from datetime import date, timedelta
+
+from sqlalchemy import select, func, update
+from sqlalchemy.orm import Session
+
+from .db import tenant_of
+from .models import Customer, CustomerBalance, Receipt, SalesInvoice
+from .partitions import routed
+
+# --- 💰 RECEIVABLES LEDGER ---
+# customer_balances holds one row per (tenant, party): the running balance plus its
+# aging split. Writes move the balance with a single UPDATE and re-age only
+# that party; reads (billing lookups, the aging report) never re-sum invoices
+# and never write: the daily receivables_aging job moves every party's dues
+# into the next buckets, and a lookup ages a stale row in memory only.
+#
+# Receipts settle the oldest dues first, so whatever is still owed sits in the
+# newest credit invoices. Aging walks a party's invoices newest-first and
+# stops as soon as the balance is covered. Anything left over is the opening
+# balance, which is older than every invoice.
+
+CREDIT_MODE = "Credit"  # "Retail" bills are paid at the counter
+BUCKETS = (("due_0_30", 30), ("due_30_60", 60), ("due_60_90", 90), ("due_90_plus", None))
+EPSILON = 0.005
+
+
+def parse_amount(text) -> float:
+    # Customer.opening_balance is free text ("1,200.50", "Rs 300", "")
+    if text is None:
+        return 0.0
+    cleaned = re.sub(r"[^0-9.\-]", "", str(text))
+    try:
+        return float(cleaned) if cleaned else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _opening(db: Session, customer: str) -> float:
+    return parse_amount(
+        db.query(Customer.opening_balance).filter(Customer.name == customer).limit(1).scalar()
+    )
+
+
+def _balance_from_history(db: Session, customer: str) -> float:
+    invoices = routed(db, SalesInvoice).c
+    invoiced = db.execute(
+        select(func.coalesce(func.sum(invoices.grand_total), 0))
+        .where(invoices.customer == customer, invoices.payment_mode == CREDIT_MODE)
+    ).scalar()
+    received = db.query(func.coalesce(func.sum(Receipt.amount), 0)).filter(
+        Receipt.customer == customer
+    ).scalar()
+    return _opening(db, customer) + float(invoiced) - float(received)
+
+
+def _bucket(overdue_days: int) -> str:
+    for name, limit in BUCKETS:
+        if limit is None or overdue_days <= limit:
+            return name
+
+
+def _buckets(db: Session, customer: str, balance: float, today: date) -> dict:
+    buckets = dict.fromkeys((name for name, _ in BUCKETS), 0.0)
+    remaining = balance or 0.0
+    if remaining > EPSILON:
+        result = db.execute(
+            select(SalesInvoice.invoice_date, SalesInvoice.due_days, SalesInvoice.grand_total)
+            .where(SalesInvoice.customer == customer, SalesInvoice.payment_mode == CREDIT_MODE)
+            .order_by(SalesInvoice.invoice_date.desc(), SalesInvoice.id.desc())
+        ).yield_per(100)
+        try:
+            for invoice_date, due_days, total in result:
+                taken = min(total or 0.0, remaining)
+                due_date = invoice_date + timedelta(days=due_days or 0)
+                buckets[_bucket((today - due_date).days)] += taken
+                remaining -= taken
+                if remaining <= EPSILON:
+                    break
+        finally:
+            result.close()
+        if remaining > EPSILON:
+            buckets["due_90_plus"] += remaining
+    return {name: round(amount, 2) for name, amount in buckets.items()}
+
+
+def _age(db: Session, row: CustomerBalance, today: date):
+    for name, amount in _buckets(db, row.customer, row.balance, today).items():
+        setattr(row, name, amount)
+    row.aged_on = today
+
+
+def _row(db: Session, customer: str):
+    """Balance row for the party, backfilled from history the first time."""
+    tenant = tenant_of(db)
+    row = db.get(CustomerBalance, (tenant, customer))
+    created = row is None
+    if created:
+        row = CustomerBalance(tenant=tenant, customer=customer, balance=_balance_from_history(db, customer))
+        db.add(row)
+    return row, created
+
+
+def adjust(db: Session, customer: str, delta: float, today: date = None):
+    # Caller commits together with the invoice/receipt write
+    if not customer:
+        return
+    db.flush()
+    row, created = _row(db, customer)
+    if not created:
+        # Backfilled rows already include the flushed change
+        db.execute(
+            update(CustomerBalance)
+            .where(CustomerBalance.customer == customer)
+            .values(balance=CustomerBalance.balance + delta)
+        )
+        db.refresh(row)
+    _age(db, row, today or date.today())
+
+
+def post_invoice(db: Session, customer: str, payment_mode: str, amount: float):
+    # Pass a negative amount to reverse an invoice
+    if payment_mode == CREDIT_MODE and amount:
+        adjust(db, customer, amount)
+
+
+def _as_dict(row: CustomerBalance) -> dict:
+    return {
+        "customer": row.customer,
+        "balance": round(row.balance or 0.0, 2),
+        **{name: getattr(row, name) or 0.0 for name, _ in BUCKETS},
+        "aged_on": row.aged_on,
+    }
+
+
+def get_balance(db: Session, customer: str, today: date = None) -> dict:
+    # Read-only: a party with no row yet is summed from history, a stale row aged in memory
+    today = today or date.today()
+    row = db.get(CustomerBalance, (tenant_of(db), customer))
+    if row is not None and row.aged_on == today:
+        return _as_dict(row)
+    balance = row.balance if row is not None else _balance_from_history(db, customer)
+    return {
+        "customer": customer,
+        "balance": round(balance or 0.0, 2),
+        **_buckets(db, customer, balance, today),
+        "aged_on": today,
+    }
+
+
+def refresh_aging(db: Session, today: date = None) -> int:
+    # Dues only move between buckets once a day; re-age the stale rows (daily job)
+    today = today or date.today()
+    stale = db.query(CustomerBalance).filter(
+        (CustomerBalance.aged_on.is_(None)) | (CustomerBalance.aged_on < today)
+    ).all()
+    for row in stale:
+        _age(db, row, today)
+    db.commit()
+    return len(stale)
+
+
+def aging_report(db: Session) -> dict:
+    # As of each row's aged_on (the daily job); rebuild and writes keep it current
+    rows = [
+        _as_dict(r) for r in db.query(CustomerBalance)
+        .filter(func.abs(CustomerBalance.balance) > EPSILON)
+        .order_by(CustomerBalance.balance.desc())
+    ]
+    totals = {name: round(sum(r[name] for r in rows), 2) for name, _ in BUCKETS}
+    return {
+        "rows": rows,
+        "total_outstanding": round(sum(r["balance"] for r in rows), 2),
+        **totals,
+    }
+
+
+def rebuild_balances(db: Session, today: date = None) -> int:
+    """Recompute every party's balance from scratch with grouped sums."""
+    balances = {}
+    for name, opening in db.execute(select(Customer.name, Customer.opening_balance)):
+        if name and name not in balances:
+            balances[name] = parse_amount(opening)
+    invoices = routed(db, SalesInvoice).c
+    for name, total in db.execute(
+        select(invoices.customer, func.sum(invoices.grand_total))
+        .where(invoices.payment_mode == CREDIT_MODE)
+        .group_by(invoices.customer)
+    ):
+        if name:
+            balances[name] = balances.get(name, 0.0) + (total or 0.0)
+    for name, total in db.execute(
+        select(Receipt.customer, func.sum(Receipt.amount)).group_by(Receipt.customer)
+    ):
+        if name:
+            balances[name] = balances.get(name, 0.0) - (total or 0.0)
+
+    db.query(CustomerBalance).delete()
+    db.bulk_insert_mappings(CustomerBalance, [
+        {"customer": name, "balance": balance, "aged_on": None} for name, balance in balances.items()
+    ])
+    db.commit()
+    refresh_aging(db, today)
+    return len(balances)
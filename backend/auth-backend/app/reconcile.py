@@ -0,0 +1,156 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import select, func, case, or_, delete, insert
+from sqlalchemy.orm import Session
+
+from .models import Product, InvoiceProduct, SalesInvoice, SalesInvoiceItem, StockCheckpoint
+from .partitions import routed
+from .stock import add_stock
+
+# --- 🧮 STOCK RECONCILIATION ---
+# Expected stock = (purchased + free in) - (sold + free out) per product and
+# batch. It comes from two GROUP BY queries over the history, not a row walk.
+# products.current_stock is compared with it, and drift can be corrected in
+# one bulk UPDATE.
+#
+# Checkpoints keep later runs small. A saving run (the apply endpoint, the
+# nightly job; never the GET report) stores the per-batch balance up to
+# yesterday, and later runs only aggregate rows dated after that. Any
+# back-dated purchase/sale write clears checkpoints on or after its date
+# (valuation.invalidate_checkpoints), same as the FIFO valuation checkpoints.
+# Rows with no date at all are always re-aggregated.
+
+
+def _latest_checkpoint(db: Session):
+    return db.query(func.max(StockCheckpoint.as_of)).scalar()
+
+
+def _movements(db: Session, after: date, cutoff: date):
+    """(name, batch, up_to_cutoff) -> net units, for rows dated after `after`."""
+    start = after + timedelta(days=1) if after else None
+    totals = defaultdict(int)
+
+    purchases = routed(db, InvoiceProduct, start).c
+    day = func.coalesce(purchases.entry_date, purchases.invoice_date)
+    settled = case((day <= cutoff, 1), else_=0)
+    stmt = select(
+        purchases.product_name, purchases.batch_no, settled,
+        func.sum(func.coalesce(purchases.quantity, 0) + func.coalesce(purchases.free, 0)),
+    ).group_by(purchases.product_name, purchases.batch_no, settled)
+    if after:
+        stmt = stmt.where(or_(day > after, day.is_(None)))
+    for name, batch, up_to_cutoff, units in db.execute(stmt):
+        totals[(name, batch or "", bool(up_to_cutoff))] += int(units or 0)
+
+    invoices = routed(db, SalesInvoice, start)
+    items = routed(db, SalesInvoiceItem, start)
+    day = invoices.c.invoice_date
+    settled = case((day <= cutoff, 1), else_=0)
+    stmt = (
+        select(
+            items.c.name, items.c.batch, settled,
+            func.sum(func.coalesce(items.c.qty, 0) + func.coalesce(items.c.free, 0)),
+        )
+        .select_from(items)
+        .outerjoin(invoices, invoices.c.invoice_no == items.c.invoice_no)
+        .group_by(items.c.name, items.c.batch, settled)
+    )
+    if after:
+        stmt = stmt.where(or_(day > after, day.is_(None)))
+    for name, batch, up_to_cutoff, units in db.execute(stmt):
+        totals[(name, batch or "", bool(up_to_cutoff))] -= int(units or 0)
+    return totals
+
+
+def expected_stock(db: Session, use_checkpoints: bool = True, save: bool = False, today: date = None):
+    """(name, batch) -> expected units. Optionally saves a checkpoint at yesterday."""
+    today = today or date.today()
+    cutoff = today - timedelta(days=1)
+    base_day = _latest_checkpoint(db) if use_checkpoints else None
+    if base_day and base_day > cutoff:
+        base_day = None  # e.g. checkpoint from a clock that ran ahead; start over
+
+    balances = defaultdict(int)
+    if base_day:
+        for name, batch, qty in db.execute(
+            select(StockCheckpoint.product_name, StockCheckpoint.batch, StockCheckpoint.qty)
+            .where(StockCheckpoint.as_of == base_day)
+        ):
+            balances[(name, batch)] = qty
+
+    settled = defaultdict(int, balances)
+    for (name, batch, up_to_cutoff), units in _movements(db, base_day, cutoff).items():
+        balances[(name, batch)] += units
+        if up_to_cutoff:
+            settled[(name, batch)] += units
+
+    if save and cutoff != base_day:
+        db.execute(delete(StockCheckpoint).where(StockCheckpoint.as_of == cutoff))
+        rows = [
+            {"as_of": cutoff, "product_name": name, "batch": batch, "qty": qty}
+            for (name, batch), qty in settled.items() if qty and name is not None
+        ]
+        if rows:
+            db.execute(insert(StockCheckpoint), rows)
+        # Only the newest checkpoint is ever read
+        db.execute(delete(StockCheckpoint).where(StockCheckpoint.as_of < cutoff))
+        db.commit()
+    return balances
+
+
+def reconcile(db: Session, apply: bool = False, batches: bool = False, use_checkpoints: bool = True,
+              save: bool = False) -> dict:
+    balances = expected_stock(db, use_checkpoints, save=save and use_checkpoints)
+
+    per_product = defaultdict(int)
+    per_batch = defaultdict(dict)
+    for (name, batch), qty in balances.items():
+        per_product[name] += qty
+        if qty:
+            per_batch[name][batch] = qty
+
+    # Movements are booked by name, so a repeated name is checked against its products' combined
+    # stock and corrected on the oldest of them (as stock.product_ids picks)
+    stored = {
+        name: (product_id, current) for name, product_id, current in db.execute(
+            select(Product.name, func.min(Product.id), func.sum(Product.current_stock)).group_by(Product.name)
+        )
+    }
+    drift = []
+    for name, (product_id, current) in stored.items():
+        expected = per_product.get(name, 0)
+        if (current or 0) != expected:
+            row = {"product": name, "product_id": product_id, "stored": current or 0, "expected": expected,
+                   "difference": (current or 0) - expected}
+            if batches:
+                row["batches"] = per_batch.get(name, {})
+            drift.append(row)
+    drift.sort(key=lambda r: -abs(r["difference"]))
+
+    # Movements booked against names the product master doesn't have
+    unmatched = sorted(
+        ({"product": name, "expected": qty} for name, qty in per_product.items() if name not in stored and qty),
+        key=lambda r: str(r["product"]),
+    )
+    # More sold than ever bought of a batch: usually a mistyped batch number
+    negative_batches = [
+        {"product": name, "batch": batch, "expected": qty}
+        for name, lots in per_batch.items() for batch, qty in lots.items() if qty < 0
+    ]
+
+    corrected = 0
+    if apply and drift:
+        # Apply as deltas so sales made since the report aren't overwritten
+        add_stock(db, [(r["product_id"], -r["difference"]) for r in drift])
+        db.commit()
+        corrected = len(drift)
+
+    return {
+        "products_checked": len(stored),
+        "drifted": len(drift),
+        "corrected": corrected,
+        "drift": drift,
+        "unmatched_names": unmatched,
+        "negative_batches": negative_batches,
+    }
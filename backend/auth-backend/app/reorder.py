@@ -0,0 +1,113 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .models import Product, InvoiceProduct, SalesInvoice, SalesInvoiceItem
+from .partitions import routed
+
+# --- 🛒 REORDER SUGGESTIONS ---
+# Sales are summed per (product, day) in SQL, then laid out as a
+# products x days NumPy matrix. Velocities for every SKU come out of a couple
+# of array reductions; no ORM objects are built for the history.
+
+WINDOWS = (30, 90)
+RECENT_WEIGHT = 0.6  # blend of 30-day vs 90-day velocity
+
+
+def _daily_matrix(db: Session, names: dict, today: date, days: int) -> np.ndarray:
+    start = today - timedelta(days=days - 1)
+    invoices = routed(db, SalesInvoice, start, today)
+    items = routed(db, SalesInvoiceItem, start, today)
+    rows = db.execute(
+        # Free units leave the shelf too, so they count towards velocity
+        select(items.c.name, invoices.c.invoice_date,
+               func.sum(func.coalesce(items.c.qty, 0) + func.coalesce(items.c.free, 0)))
+        .select_from(items)
+        .join(invoices, invoices.c.invoice_no == items.c.invoice_no)
+        .where(invoices.c.invoice_date >= start, invoices.c.invoice_date <= today)
+        .group_by(items.c.name, invoices.c.invoice_date)
+    ).all()
+
+    matrix = np.zeros((len(names), days), dtype=np.float64)
+    if not rows:
+        return matrix
+    sold_names, sold_days, qty = zip(*rows)
+    unique_names, inverse = np.unique(np.array(sold_names, dtype=object).astype(str), return_inverse=True)
+    lookup = np.array([names.get(n, -1) for n in unique_names], dtype=np.int64)
+    product_idx = lookup[inverse]
+    day_idx = (np.array(sold_days, dtype="datetime64[D]") - np.datetime64(start, "D")).astype(np.int64)
+    qty = np.array(qty, dtype=np.float64)
+
+    known = product_idx >= 0  # sales of names missing from the master are ignored
+    np.add.at(matrix, (product_idx[known], day_idx[known]), qty[known])
+    return matrix
+
+
+def _last_suppliers(db: Session) -> dict:
+    # Archived years too: a product last bought before the FY archive still has a supplier
+    purchases = routed(db, InvoiceProduct)
+    history = routed(db, InvoiceProduct)
+    latest = (
+        select(history.c.product_name, func.max(history.c.id).label("id"))
+        .group_by(history.c.product_name)
+        .subquery("latest")
+    )
+    return {
+        name: (supplier, rate)
+        for name, supplier, rate in db.execute(
+            select(purchases.c.product_name, purchases.c.supplier_name, purchases.c.rate)
+            .join(latest, latest.c.id == purchases.c.id)
+        )
+    }
+
+
+def suggest_reorders(db: Session, lead_days: int = 7, cover_days: int = 30, today: date = None) -> dict:
+    today = today or date.today()
+    products = db.execute(
+        select(Product.code, Product.name, Product.current_stock, Product.maxQty).order_by(Product.id)
+    ).all()
+    if not products:
+        return {"suppliers": [], "lines": 0}
+    codes, names, stock, max_qty = zip(*products)
+    index = {name: i for i, name in enumerate(names)}
+
+    matrix = _daily_matrix(db, index, today, max(WINDOWS))
+    v30 = matrix[:, -WINDOWS[0]:].sum(axis=1) / WINDOWS[0]
+    v90 = matrix.sum(axis=1) / WINDOWS[1]
+    velocity = RECENT_WEIGHT * v30 + (1 - RECENT_WEIGHT) * v90
+
+    stock = np.array([s or 0 for s in stock], dtype=np.float64)
+    target = np.ceil(velocity * (lead_days + cover_days))
+    # maxQty caps how much of a SKU we want on the shelf
+    cap = np.array([m if m else np.inf for m in max_qty], dtype=np.float64)
+    suggested = np.clip(np.minimum(target, cap) - stock, 0, None).astype(np.int64)
+
+    suppliers = _last_suppliers(db)
+    grouped = defaultdict(list)
+    for i in np.flatnonzero(suggested):
+        supplier, rate = suppliers.get(names[i], (None, None))
+        grouped[supplier or "Unassigned"].append({
+            "pcode": codes[i],
+            "name": names[i],
+            "stock": int(stock[i]),
+            "velocity_30d": round(float(v30[i]), 3),
+            "velocity_90d": round(float(v90[i]), 3),
+            "days_of_cover": round(float(stock[i] / velocity[i]), 1) if velocity[i] else None,
+            "suggested_qty": int(suggested[i]),
+            "last_rate": rate,
+            "est_value": round(int(suggested[i]) * (rate or 0), 2),
+        })
+
+    return {
+        "as_of": today,
+        "lead_days": lead_days,
+        "cover_days": cover_days,
+        "lines": sum(len(v) for v in grouped.values()),
+        "suppliers": [
+            {"supplier": name, "lines": lines, "total_value": round(sum(l["est_value"] for l in lines), 2)}
+            for name, lines in sorted(grouped.items())
+        ],
+    }
@@ -0,0 +1,198 @@
+import difflib
+import re
+import threading
+
+from fastapi import HTTPException
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .changelog import record
+from .models import Product, ProductAlias, ChangeLog
+from .tenancy import PerTenant
+
+# --- 🧭 PURCHASE LINE -> PRODUCT RESOLVER ---
+# Supplier bills rarely spell products exactly like our master. Lines are
+# matched in memory, in this order:
+#   explicit product_id > supplier alias > code > normalized name
+# Normalizing drops case, spaces and punctuation ("TULSI Drops 30 ml" ==
+# "tulsi drops 30ML"). When the user picks a product for an unmatched line
+# (product_id on the line), the supplier's spelling is saved as an alias.
+#
+# The maps load once per worker. Each resolve first reads change_log entries
+# for products and aliases newer than what the maps have seen (one PK range
+# read), so products added or renamed and aliases learned or re-pointed on
+# any worker are picked up. A learned alias reaches the maps that way too,
+# only once its transaction commits. Each tenant has its own maps.
+
+SUGGESTIONS = 3
+SUGGEST_CUTOFF = 0.6
+
+
+def normalize(text) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(text or "").lower())
+
+
+class ProductResolver:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._seq = 0
+        self.products = {}  # id -> (code, name)
+        self.by_name = {}
+        self.by_code = {}
+        self.aliases = {}  # (supplier, alias) -> product id
+
+    # --- cache maintenance ---
+    def _put(self, product_id: int, code, name):
+        old = self.products.get(product_id)
+        if old:
+            self._drop(product_id)
+        self.products[product_id] = (code, name)
+        if name:
+            self.by_name.setdefault(normalize(name), product_id)
+        if code:
+            self.by_code.setdefault(normalize(code), product_id)
+
+    def _drop(self, product_id: int):
+        code, name = self.products.pop(product_id, (None, None))
+        for index, key in ((self.by_name, normalize(name)), (self.by_code, normalize(code))):
+            if index.get(key) == product_id:
+                del index[key]
+
+    def add_product(self, product: Product):
+        # Called right after create_product commits
+        with self._lock:
+            if self._loaded:
+                self._put(product.id, product.code, product.name)
+
+    def refresh(self, db: Session):
+        with self._lock:
+            if not self._loaded:
+                self._seq = db.query(func.max(ChangeLog.seq)).scalar() or 0
+                for product_id, code, name in db.execute(select(Product.id, Product.code, Product.name)):
+                    self._put(product_id, code, name)
+                self._load_aliases(db)
+                self._loaded = True
+                return
+
+            changed = db.execute(
+                select(ChangeLog.seq, ChangeLog.table_name, ChangeLog.row_id)
+                .where(ChangeLog.seq > self._seq, ChangeLog.table_name.in_(("products", "product_aliases")))
+            ).all()
+            if not changed:
+                return
+            self._seq = max(seq for seq, _, _ in changed)
+            ids = {row_id for _, table, row_id in changed if table == "products"}
+            if ids:
+                rows = {
+                    product_id: (code, name) for product_id, code, name in db.execute(
+                        select(Product.id, Product.code, Product.name).where(Product.id.in_(ids))
+                    )
+                }
+                for product_id in ids:
+                    if product_id in rows:
+                        self._put(product_id, *rows[product_id])
+                    else:
+                        self._drop(product_id)
+            alias_ids = {row_id for _, table, row_id in changed if table == "product_aliases"}
+            if alias_ids:
+                self._load_aliases(db, ProductAlias.id.in_(alias_ids))
+
+    def _load_aliases(self, db: Session, *where):
+        for supplier, alias, product_id in db.execute(
+            select(ProductAlias.supplier_name, ProductAlias.alias, ProductAlias.product_id).where(*where)
+        ):
+            self.aliases[(supplier, alias)] = product_id
+
+    # --- matching (callers hold self._lock; refresh changes the maps under it) ---
+    def _match(self, supplier: str, text):
+        key = normalize(text)
+        if not key:
+            return None, None
+        for found, how in (
+            (self.aliases.get((supplier, key)), "alias"),
+            (self.aliases.get(("", key)), "alias"),
+            (self.by_code.get(key), "code"),
+            (self.by_name.get(key), "name"),
+        ):
+            if found in self.products:
+                return found, how
+        return None, None
+
+    def suggest(self, text, limit: int = SUGGESTIONS):
+        with self._lock:
+            return self._suggest(text, limit)
+
+    def _suggest(self, text, limit: int = SUGGESTIONS):
+        key = normalize(text)
+        names = {normalize(name): product_id for product_id, (_, name) in self.products.items() if name}
+        matches = difflib.get_close_matches(key, list(names), n=limit, cutoff=SUGGEST_CUTOFF)
+        return [
+            {"id": names[m], "code": self.products[names[m]][0], "name": self.products[names[m]][1],
+             "score": round(difflib.SequenceMatcher(None, key, m).ratio(), 2)}
+            for m in matches
+        ]
+
+    def resolve_lines(self, db: Session, supplier_name: str, lines: list) -> list:
+        """One result per line: {"product_id", "product_name" (master), "matched_by"} or suggestions."""
+        self.refresh(db)
+        supplier = normalize(supplier_name)
+        picks = []
+        for line in lines:
+            picked = line.get("product_id")
+            if picked is not None:
+                try:
+                    picked = int(picked)
+                except (TypeError, ValueError):
+                    raise HTTPException(status_code=400,
+                                        detail=f"Invalid product_id for '{line.get('product_name')}': {picked!r}")
+            picks.append(picked)
+
+        results, learned = [], []
+        with self._lock:
+            for line, picked in zip(lines, picks):
+                given = line.get("product_name")
+                if picked is not None and picked in self.products:
+                    product_id, how = picked, "picked"
+                else:
+                    product_id, how = self._match(supplier, given)
+                if product_id is None:
+                    results.append({"product_id": None, "product_name": given, "matched_by": None,
+                                    "suggestions": self._suggest(given)})
+                    continue
+                if how == "picked":
+                    learned.append((given, product_id))
+                results.append({"product_id": product_id, "product_name": self.products[product_id][1],
+                                "matched_by": how})
+        # Database writes outside the lock
+        for given, product_id in learned:
+            self.learn(db, supplier_name, given, product_id)
+        return results
+
+    def learn(self, db: Session, supplier_name: str, text, product_id: int):
+        # Caller commits (the alias is saved with the purchase entry); the maps
+        # pick it up from change_log on the next refresh, so a rollback leaves them alone
+        supplier, alias = normalize(supplier_name), normalize(text)
+        with self._lock:
+            known = self._match(supplier, text)[0] == product_id
+        if not alias or known:
+            return
+        existing = select(ProductAlias.id).filter_by(supplier_name=supplier, alias=alias)
+        alias_id = db.execute(existing).scalar()
+        if alias_id is None:
+            row = ProductAlias(supplier_name=supplier, alias=alias, product_id=product_id)
+            try:
+                with db.begin_nested():
+                    db.add(row)
+            except IntegrityError:
+                # Another worker saved the same spelling first
+                alias_id = db.execute(existing).scalar()
+            else:
+                record(db, "product_aliases", [row.id])
+                return
+        # Re-pointing keeps the id, so the change log (not the id) tells other workers
+        db.query(ProductAlias).filter_by(id=alias_id).update({"product_id": product_id})
+        record(db, "product_aliases", [alias_id])
+
+resolvers = PerTenant(ProductResolver)  # resolvers(db) -> the session tenant's resolver
@@ -23,6 +23,7 @@ class ProductSchema(BaseModel):
     packing: Optional[str] = None
     manufacturer: Optional[str] = None
     division: Optional[str] = None
+    division_id: Optional[int] = None  # set from `division` when not given
     category: Optional[str] = None
     genericGroup: Optional[str] = None
     therapeuticGroup: Optional[str] = None
@@ -159,6 +160,7 @@ class InvoiceCreate(BaseModel):
     
 class SalesRow(BaseModel):
     name: str
+    productId: Optional[int] = None  # picked in product search; matched by name when absent
     batch: str
     exp: date
     qty: int
@@ -185,9 +187,29 @@ class SalesInvoiceCreate(BaseModel):
     notes: Optional[str] = ""
 
 
+class SalesInvoiceBulk(BaseModel):
+    # Offline orders synced in one go; blank invoiceNo = allocate one
+    invoices: List[SalesInvoiceCreate]
+
+
 class SalesTotals(BaseModel):
     subtotal: float
     totalDiscount: float
     totalGST: float
     grandTotal: float
 
+
+class ReceiptCreate(BaseModel):
+    customer: str
+    amount: float
+    receipt_date: date
+    mode: Optional[str] = "Cash"
+    reference: Optional[str] = None
+    notes: Optional[str] = None
+
+class InvoicePrintBatch(BaseModel):
+    # Either an explicit list or every invoice of one day
+    invoice_nos: List[str] = []
+    invoice_date: Optional[date] = None
+    format: str = "pdf"       # pdf | html
+    bundle: str = "combined"  # combined | zip
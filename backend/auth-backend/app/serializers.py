@@ -0,0 +1,60 @@
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import User, Product, Customer, Company, Supplier, SalesInvoice
+from .schemas import ProductSchema
+
+# --- ⚡ FAST PATH FOR BULK READS ---
+# Rows are selected as plain tuples (no ORM identity map, no Pydantic) and
+# dumped straight to JSON with orjson. Only use this on trusted read paths:
+# whatever the columns hold goes out as-is.
+
+def table_fields(model, exclude=()):
+    return tuple(c.key for c in model.__table__.columns if c.key not in exclude)
+
+# Same keys the slow path produces, so the frontend can't tell the difference
+PRODUCT_FIELDS = tuple(ProductSchema.model_fields)
+PRODUCT_COLUMNS = table_fields(Product)  # what ?fields= may ask for (adds id)
+CUSTOMER_FIELDS = table_fields(Customer)
+COMPANY_FIELDS = table_fields(Company)
+SUPPLIER_FIELDS = table_fields(Supplier)
+SALES_INVOICE_FIELDS = table_fields(SalesInvoice)
+# Never ship password hashes to the client
+USER_FIELDS = table_fields(User, exclude=("password_hash",))
+# /api/stock/search keys -> Product columns
+STOCK_SEARCH_FIELDS = {
+    "id": "id", "pcode": "code", "name": "name", "packing": "packing",
+    "division": "division", "mrp": "maxMRP", "stock": "current_stock",
+}
+
+
+def pick_fields(requested: Optional[str], allowed, default=None):
+    """?fields=a,b,c -> those of `allowed` in request order; `default` (or all) when not given."""
+    if not requested:
+        return default or allowed
+    names = list(dict.fromkeys(f.strip() for f in requested.split(",") if f.strip()))
+    unknown = [f for f in names if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail={
+            "message": f"Unknown field(s): {', '.join(unknown)}", "allowed": list(allowed),
+        })
+    if isinstance(allowed, dict):
+        return {f: allowed[f] for f in names}
+    return tuple(names)
+
+
+def fetch_rows(db: Session, model, fields, *criteria, order_by=None, limit=None):
+    # fields: column names, or {output key: column name} to rename on the way out
+    columns = fields.values() if isinstance(fields, dict) else fields
+    stmt = select(*(getattr(model, f) for f in columns))
+    if criteria:
+        stmt = stmt.where(*criteria)
+    if order_by is not None:
+        stmt = stmt.order_by(order_by)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return [dict(zip(fields, row)) for row in db.execute(stmt)]
+
@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+from sqlalchemy import update, select, case, func
+from sqlalchemy.orm import Session
+
+from .models import Product
+from .changelog import record
+
+# --- 📦 ATOMIC STOCK MUTATIONS ---
+# Stock is never read into Python and written back. Each invoice/entry sends
+# one UPDATE that applies every product's delta in the database:
+#
+#   UPDATE products SET current_stock = current_stock + CASE id WHEN ... END
+#   WHERE id IN (...) [AND current_stock + CASE ... END >= 0]
+#   RETURNING id
+#
+# so two counters selling the same SKU can't lose each other's update, and
+# the guarded form refuses to take stock below zero. Lines are keyed by
+# product id (names can repeat in the master); callers that only have a name,
+# e.g. rows saved before items kept their product_id, map it with
+# product_ids().
+
+
+class StockConflict(Exception):
+    def __init__(self, shortages: list):
+        self.shortages = shortages
+        super().__init__(", ".join(str(s["product"]) for s in shortages))
+
+
+def product_ids(db: Session, names) -> dict:
+    """name -> product id; the oldest product when a name repeats."""
+    names = {n for n in names if n}
+    if not names:
+        return {}
+    return dict(db.execute(
+        select(Product.name, func.min(Product.id)).where(Product.name.in_(names)).group_by(Product.name)
+    ).all())
+
+
+def _deltas(lines) -> dict:
+    totals = defaultdict(int)
+    for product_id, qty in lines:
+        if product_id is not None:
+            totals[product_id] += int(qty or 0)
+    return {product_id: qty for product_id, qty in totals.items() if qty}
+
+
+def _apply(db: Session, deltas: dict, guard: bool) -> set:
+    if not deltas:
+        return set()
+    delta = case(deltas, value=Product.id, else_=0)
+    new_stock = func.coalesce(Product.current_stock, 0) + delta
+    stmt = (
+        update(Product)
+        .where(Product.id.in_(list(deltas)))
+        .values(current_stock=new_stock)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    if guard:
+        stmt = stmt.where(new_stock >= 0)
+    updated = {row_id for (row_id,) in db.execute(stmt)}
+    # Bulk UPDATEs bypass the ORM events, so feed the sync log directly
+    record(db, "products", updated)
+    return updated
+
+
+def add_stock(db: Session, lines) -> set:
+    """Apply (product_id, qty) deltas, positive or negative. Returns the ids found in the master."""
+    return _apply(db, _deltas(lines), guard=False)
+
+
+def take_stock(db: Session, lines, unmatched=()):
+    """Remove (product_id, qty) quantities without taking any product below zero.
+
+    Raises StockConflict listing every line that can't be covered, together
+    with the unmatched (name, qty) lines no product was found for. The caller
+    must roll back so the lines that did go through are undone too.
+    """
+    wanted = {product_id: -qty for product_id, qty in _deltas(lines).items()}
+    updated = _apply(db, wanted, guard=True)
+    missing = [product_id for product_id in wanted if product_id not in updated]
+    unmatched = [(name, qty) for name, qty in unmatched if qty]
+    if not missing and not unmatched:
+        return
+    found = {
+        product_id: (name, stock) for product_id, name, stock in db.execute(
+            select(Product.id, Product.name, Product.current_stock).where(Product.id.in_(missing))
+        )
+    } if missing else {}
+    raise StockConflict([
+        {
+            "product": found[product_id][0] if product_id in found else product_id,
+            "product_id": product_id,
+            "requested": -wanted[product_id],
+            "available": found[product_id][1] if product_id in found else None,
+            "reason": "insufficient stock" if product_id in found else "not in product master",
+        }
+        for product_id in missing
+    ] + [
+        {"product": name, "product_id": None, "requested": qty, "available": None, "reason": "not in product master"}
+        for name, qty in unmatched
+    ])
+
+
+def sales_product_ids(db: Session, rows) -> list:
+    """Product id per sales row: the one picked in product search, else its name's. None if neither exists."""
+    picked = {r.productId for r in rows if r.productId is not None}
+    known = set(db.scalars(select(Product.id).where(Product.id.in_(picked)))) if picked else set()
+    by_name = product_ids(db, {r.name for r in rows if r.productId not in known})
+    return [r.productId if r.productId in known else by_name.get(r.name) for r in rows]
+
+
+def saved_product_ids(db: Session, items, name_attr: str) -> list:
+    """Product id per saved invoice/entry row, for reversing it.
+
+    Rows saved before items kept their product_id fall back to their name's.
+    """
+    by_name = product_ids(db, {getattr(i, name_attr) for i in items if i.product_id is None})
+    return [i.product_id if i.product_id is not None else by_name.get(getattr(i, name_attr)) for i in items]
@@ -0,0 +1,124 @@
+from datetime import date, timedelta
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .jobs import job
+from .models import InvoiceProduct, SalesInvoice, SalesInvoiceItem
+from .partitions import routed
+from .receivables import refresh_aging
+from .valuation import replay, save_checkpoint
+from .changelog import compact_changelog
+from .idempotency import purge_idempotency_keys
+from .reconcile import reconcile
+
+# --- 🌙 SCHEDULED / ON-DEMAND JOBS ---
+# Each job takes a session plus JSON params and returns a JSON-able result,
+# which is stored on its `jobs` row for the frontend to poll.
+
+
+def _previous_month(month: str = None):
+    if month:
+        year, mon = (int(x) for x in month.split("-"))
+        first = date(year, mon, 1)
+    else:
+        first = (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first, last
+
+
+@job("expiry_scan", cron="30 1 * * *")
+def expiry_scan(db: Session, days: int = 90):
+    # Batches still on the shelf (FIFO layers) that expire within `days`
+    today = date.today()
+    layers, _ = replay(db, today)
+    # Archived years too: the oldest layers are the likeliest to expire
+    purchases = routed(db, InvoiceProduct).c
+    expiry = {
+        (name, batch): exp
+        for name, batch, exp in db.execute(
+            select(purchases.product_name, purchases.batch_no, func.min(purchases.exp_date))
+            .group_by(purchases.product_name, purchases.batch_no)
+        )
+    }
+    limit = today + timedelta(days=days)
+    batches = []
+    for name, lots in layers.items():
+        for batch, qty, unit_cost, _ in lots:
+            exp = expiry.get((name, batch))
+            if exp and exp <= limit:
+                batches.append({
+                    "product": name, "batch": batch, "exp": exp, "qty": qty,
+                    "value": round(qty * unit_cost, 2), "days_left": (exp - today).days,
+                })
+    batches.sort(key=lambda b: b["exp"])
+    return {"as_of": today, "days": days, "count": len(batches), "batches": batches}
+
+
+@job("stock_reconciliation", cron="30 2 * * *")
+def stock_reconciliation(db: Session, apply: bool = False):
+    # Stored current_stock vs what purchase/sales history implies (report only unless apply)
+    return reconcile(db, apply=apply, save=True)  # checkpoint for tomorrow's runs
+
+
+@job("receivables_aging", cron="5 0 * * *")
+def receivables_aging(db: Session):
+    # Just after midnight, when dues move into the next bucket; GET handlers never re-age
+    return {"customers_reaged": refresh_aging(db)}
+
+
+@job("gst_summary", cron="0 3 1 * *")
+def gst_summary(db: Session, month: str = None):
+    # Output (sales) vs input (purchase) GST per rate, CGST/SGST split evenly
+    first, last = _previous_month(month)
+    invoices = routed(db, SalesInvoice, first, last)
+    items = routed(db, SalesInvoiceItem, first, last)
+    taxable = items.c.qty * items.c.rate * (1 - func.coalesce(items.c.discount, 0) / 100)
+    sales = db.execute(
+        select(items.c.gst, func.sum(taxable))
+        .select_from(items)
+        .join(invoices, invoices.c.invoice_no == items.c.invoice_no)
+        .where(invoices.c.invoice_date >= first, invoices.c.invoice_date <= last)
+        .group_by(items.c.gst)
+    ).all()
+
+    purchases_src = routed(db, InvoiceProduct, first, last).c
+    day = func.coalesce(purchases_src.entry_date, purchases_src.invoice_date)
+    purchases = db.execute(
+        select(purchases_src.gst_percent, func.sum(purchases_src.quantity * purchases_src.rate))
+        .where(day >= first, day <= last)
+        .group_by(purchases_src.gst_percent)
+    ).all()
+
+    def rows(grouped):
+        out = []
+        for rate, amount in grouped:
+            tax = (amount or 0) * (rate or 0) / 100
+            out.append({"gst_rate": rate or 0, "taxable": round(amount or 0, 2),
+                        "cgst": round(tax / 2, 2), "sgst": round(tax / 2, 2), "total_tax": round(tax, 2)})
+        return sorted(out, key=lambda r: r["gst_rate"])
+
+    output_tax, input_tax = rows(sales), rows(purchases)
+    return {
+        "month": first.strftime("%Y-%m"),
+        "output": output_tax,
+        "input": input_tax,
+        "net_payable": round(sum(r["total_tax"] for r in output_tax) - sum(r["total_tax"] for r in input_tax), 2),
+    }
+
+
+@job("valuation_checkpoint", cron="15 3 1 * *")
+def valuation_checkpoint(db: Session, as_of: str = None):
+    # Month-end FIFO layers so later valuations replay only the new month
+    day = date.fromisoformat(as_of) if as_of else _previous_month()[1]
+    return {"as_of": day, "open_lots": save_checkpoint(db, day)}
+
+
+@job("changelog_compaction", cron="45 3 * * *")
+def changelog_compaction(db: Session):
+    return {"entries_removed": compact_changelog(db)}
+
+
+@job("idempotency_cleanup", cron="50 3 * * *")
+def idempotency_cleanup(db: Session):
+    return {"keys_removed": purge_idempotency_keys(db)}
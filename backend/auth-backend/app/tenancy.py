@@ -0,0 +1,98 @@
+import threading
+
+from sqlalchemy import MetaData, Table, select, insert, inspect, text
+from sqlalchemy.orm import Session
+
+from .db import Base, SessionLocal, Tenanted, DEFAULT_TENANT, tenant_of
+from .models import User, CustomerBalance, CustomerProductRate, StockCheckpoint, TableVersion, ProductAlias, Job
+from .partitions import archive_tables
+
+# --- 🏢 TENANT KEYS: MIGRATION + PER-TENANT STATE ---
+# The filter itself lives in db.py (Tenanted, session hooks). This module
+# upgrades an existing database and holds what is kept per tenant:
+#   * every Tenanted table gains a tenant column; rows written before it
+#     existed belong to DEFAULT_TENANT
+#   * tables whose primary key / unique constraint now includes the tenant
+#     are rebuilt with their rows (create_all can't change a key)
+#   * changed composite indexes (now led by tenant) are dropped and
+#     recreated by the startup loop (db.drop_changed_indexes)
+# A tenant is a User.company value; each in-memory cache (analytics cube,
+# purchase resolver, hot read cache) is kept per tenant, so
+# a large distributor's history never sits in a small one's lookups.
+
+# Keys changed to lead with tenant
+REKEYED = (CustomerBalance, CustomerProductRate, StockCheckpoint, TableVersion, ProductAlias, Job)
+
+
+def _tenanted_tables() -> list:
+    return [m.local_table for m in Base.registry.mappers if issubclass(m.class_, Tenanted)]
+
+
+def rekey_tables(engine):
+    # Before create_all: copy each old-key table's rows into a rebuilt table, in one transaction
+    names = set(inspect(engine).get_table_names())
+    for model in REKEYED:
+        table = model.__table__
+        if table.name not in names or "tenant" in {c["name"] for c in inspect(engine).get_columns(table.name)}:
+            continue
+        with engine.begin() as conn:
+            old = Table(table.name, MetaData(), autoload_with=conn)
+            keep = [c.name for c in old.columns if c.name in table.c]
+            rows = [dict(r._mapping) for r in conn.execute(select(*(old.c[n] for n in keep)))]
+            old.drop(conn)
+            table.create(conn)
+            if rows:
+                conn.execute(insert(table), [{**r, "tenant": DEFAULT_TENANT} for r in rows])
+            if engine.dialect.name == "postgresql" and "id" in table.c and table.c.id.autoincrement is not False:
+                # Copied ids bypassed the sequence
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"coalesce((SELECT max(id) FROM {table.name}), 0) + 1, false)"
+                ))
+        print(f"Rebuilt {table.name} keyed by tenant ({len(rows)} rows)")
+
+
+def backfill_tenants(engine):
+    # Rows from before the tenant column (hot tables and their archives)
+    tenanted = _tenanted_tables()
+    targets = [t.name for t in tenanted]
+    targets += [name for model, name in archive_tables(engine) if model.__table__ in tenanted]
+    preparer = engine.dialect.identifier_preparer
+    for name in targets:
+        with engine.begin() as conn:
+            filled = conn.execute(
+                text(f"UPDATE {preparer.quote(name)} SET tenant = :tenant WHERE tenant IS NULL"),
+                {"tenant": DEFAULT_TENANT},
+            ).rowcount
+        if filled:
+            print(f"Assigned {filled} {name} rows to tenant {DEFAULT_TENANT}")
+
+
+def tenants(db: Session) -> list:
+    """Every distributor with a login, plus the default tenant."""
+    companies = {c for (c,) in db.execute(select(User.company).distinct()) if c}
+    return sorted(companies | {DEFAULT_TENANT})
+
+
+def tenant_session(tenant: str) -> Session:
+    """A primary session acting for one tenant (jobs, startup backfills)."""
+    return SessionLocal(info={"tenant": tenant})
+
+
+class PerTenant:
+    """One factory() instance per tenant, made on first use."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._items = {}
+
+    def get(self, tenant: str):
+        with self._lock:
+            item = self._items.get(tenant)
+            if item is None:
+                item = self._items[tenant] = self.factory()
+            return item
+
+    def __call__(self, db: Session):
+        return self.get(tenant_of(db))
@@ -1,9 +1,15 @@
-from datetime import datetime
+from datetime import datetime, date
 
-def current_financial_year() -> str:
-    now = datetime.now()
-    year = now.year
-    month = now.month
-    if month >= 4:  # April starts the FY
+def financial_year_of(day) -> str:
+    year = day.year
+    if day.month >= 4:  # April starts the FY
         return f"{year}-{year+1}"
     return f"{year-1}-{year}"
+
+def financial_year_bounds(fy: str):
+    # "2024-2025" -> (2024-04-01, 2025-03-31)
+    start = int(fy.split("-")[0])
+    return date(start, 4, 1), date(start + 1, 3, 31)
+
+def current_financial_year() -> str:
+    return financial_year_of(datetime.now())
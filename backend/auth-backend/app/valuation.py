@@ -0,0 +1,181 @@
+from collections import defaultdict
+from datetime import date
+from heapq import merge
+
+from sqlalchemy import select, func, delete
+from sqlalchemy.orm import Session
+
+from .models import Product, InvoiceProduct, SalesInvoice, SalesInvoiceItem, ValuationCheckpoint, StockCheckpoint
+from .partitions import routed
+
+# --- 📊 FIFO STOCK VALUATION ---
+# Purchases and sales are streamed in date order and replayed against FIFO
+# cost layers kept per product: [batch, qty, unit_cost, lot_date].
+# A sale consumes its own batch first (oldest lot first) and only falls back
+# to the product's oldest other lots when the batch is short. Only open layers
+# are held in memory, never the history.
+
+PURCHASE, SALE = 0, 1  # purchases sort before sales on the same day
+GROUP_KEYS = ("product", "batch", "division", "manufacturer")
+CHUNK = 5000
+
+
+def _purchases(db: Session, after, as_of):
+    rows = routed(db, InvoiceProduct, after, as_of).c
+    day = func.coalesce(rows.entry_date, rows.invoice_date)
+    stmt = select(
+        day, rows.id, rows.product_name, rows.batch_no, rows.quantity, rows.free, rows.rate,
+    ).where(day <= as_of).order_by(day, rows.id)
+    if after is not None:
+        stmt = stmt.where(day > after)
+    for d, row_id, name, batch, qty, free, rate in db.execute(stmt).yield_per(CHUNK):
+        units = (qty or 0) + (free or 0)
+        # Free goods carry no cost of their own: spread the paid amount over all units
+        unit_cost = (rate or 0) * (qty or 0) / units if units else 0.0
+        yield d, PURCHASE, row_id, name, batch, units, unit_cost
+
+
+def _sales(db: Session, after, as_of):
+    invoices = routed(db, SalesInvoice, after, as_of)
+    items = routed(db, SalesInvoiceItem, after, as_of)
+    day = invoices.c.invoice_date
+    stmt = select(
+        day, items.c.id, items.c.name, items.c.batch, items.c.qty, items.c.free,
+    ).select_from(items).join(
+        invoices, invoices.c.invoice_no == items.c.invoice_no
+    ).where(day <= as_of).order_by(day, items.c.id)
+    if after is not None:
+        stmt = stmt.where(day > after)
+    for d, row_id, name, batch, qty, free in db.execute(stmt).yield_per(CHUNK):
+        yield d, SALE, row_id, name, batch, (qty or 0) + (free or 0), None
+
+
+def _consume(lots, batch, qty):
+    # Own batch first, then whatever is oldest
+    for wanted in (batch, None):
+        for lot in lots:
+            if qty <= 0:
+                break
+            if lot[1] <= 0 or (wanted is not None and lot[0] != wanted):
+                continue
+            taken = min(lot[1], qty)
+            lot[1] -= taken
+            qty -= taken
+    lots[:] = [lot for lot in lots if lot[1] > 0]
+    return qty
+
+
+def _load_checkpoint(db: Session, as_of: date):
+    checkpoint = db.query(func.max(ValuationCheckpoint.as_of)).filter(
+        ValuationCheckpoint.as_of <= as_of
+    ).scalar()
+    layers, shortfall = defaultdict(list), defaultdict(int)
+    if checkpoint is None:
+        return None, layers, shortfall
+    rows = db.execute(
+        select(
+            ValuationCheckpoint.product_name, ValuationCheckpoint.batch, ValuationCheckpoint.qty,
+            ValuationCheckpoint.unit_cost, ValuationCheckpoint.lot_date,
+        ).where(ValuationCheckpoint.as_of == checkpoint).order_by(ValuationCheckpoint.id)
+    )
+    for name, batch, qty, unit_cost, lot_date in rows:
+        if qty < 0:
+            shortfall[name] += -qty
+        else:
+            layers[name].append([batch, qty, unit_cost, lot_date])
+    return checkpoint, layers, shortfall
+
+
+def replay(db: Session, as_of: date, use_checkpoints: bool = True):
+    """Open FIFO layers per product plus oversold quantity, as of the date."""
+    if use_checkpoints:
+        start, layers, shortfall = _load_checkpoint(db, as_of)
+    else:
+        start, layers, shortfall = None, defaultdict(list), defaultdict(int)
+
+    events = merge(_purchases(db, start, as_of), _sales(db, start, as_of), key=lambda e: e[:3])
+    for d, kind, _, name, batch, qty, unit_cost in events:
+        name = name or ""
+        if kind == PURCHASE:
+            # Sales booked before their purchase was entered net off first
+            owed = min(shortfall[name], qty)
+            shortfall[name] -= owed
+            if qty - owed > 0:
+                layers[name].append([batch, qty - owed, unit_cost, d])
+        else:
+            shortfall[name] += _consume(layers[name], batch, qty)
+    return layers, shortfall
+
+
+def valuation_report(db: Session, as_of: date, group_by: str = "batch", use_checkpoints: bool = True):
+    if group_by not in GROUP_KEYS:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_KEYS)}")
+    layers, shortfall = replay(db, as_of, use_checkpoints)
+
+    masters = {
+        name: (division, manufacturer)
+        for name, division, manufacturer in db.execute(
+            select(Product.name, Product.division, Product.manufacturer)
+        )
+    }
+
+    totals = defaultdict(lambda: [0, 0.0])
+    for name, lots in layers.items():
+        division, manufacturer = masters.get(name, (None, None))
+        for batch, qty, unit_cost, _ in lots:
+            key = {
+                "product": (name,),
+                "batch": (name, batch),
+                "division": (division,),
+                "manufacturer": (manufacturer,),
+            }[group_by]
+            bucket = totals[key]
+            bucket[0] += qty
+            bucket[1] += qty * unit_cost
+
+    key_names = {"product": ("product",), "batch": ("product", "batch")}.get(group_by, (group_by,))
+    rows = [
+        {**dict(zip(key_names, key)), "qty": qty, "value": round(value, 2)}
+        for key, (qty, value) in sorted(totals.items(), key=lambda kv: tuple(str(k) for k in kv[0]))
+    ]
+    return {
+        "as_of": as_of,
+        "group_by": group_by,
+        "rows": rows,
+        "total_qty": sum(r["qty"] for r in rows),
+        "total_value": round(sum(v for _, v in totals.values()), 2),
+        "oversold": {name: qty for name, qty in shortfall.items() if qty > 0},
+    }
+
+
+def save_checkpoint(db: Session, as_of: date):
+    layers, shortfall = replay(db, as_of)
+    db.execute(delete(ValuationCheckpoint).where(ValuationCheckpoint.as_of == as_of))
+    db.bulk_insert_mappings(ValuationCheckpoint, [
+        {"as_of": as_of, "product_name": name, "batch": batch, "qty": qty,
+         "unit_cost": unit_cost, "lot_date": lot_date}
+        for name, lots in layers.items()
+        for batch, qty, unit_cost, lot_date in lots
+    ] + [
+        # Oversold quantity is kept as a negative, cost-less row
+        {"as_of": as_of, "product_name": name, "batch": None, "qty": -qty, "unit_cost": 0.0, "lot_date": None}
+        for name, qty in shortfall.items() if qty > 0
+    ])
+    db.commit()
+    return sum(len(lots) for lots in layers.values())
+
+
+def invalidate_checkpoints(db: Session, *days):
+    # A back-dated purchase/sale makes every checkpoint on or after it stale.
+    # Caller commits together with the write itself.
+    days = [_as_date(d) for d in days if d]
+    if days:
+        db.execute(delete(ValuationCheckpoint).where(ValuationCheckpoint.as_of >= min(days)))
+        # Stock reconciliation checkpoints go stale under the same rule
+        db.execute(delete(StockCheckpoint).where(StockCheckpoint.as_of >= min(days)))
+
+
+def _as_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
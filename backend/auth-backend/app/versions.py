@@ -0,0 +1,66 @@
+import zlib
+
+from fastapi import Request
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .db import tenant_of
+from .models import TableVersion
+
+# --- 🏷 TABLE-VERSION ETAGS ---
+# Every write to a master table bumps its counter in the same transaction, so
+# the ETag of a list response changes exactly when its rows can have changed.
+# A conditional GET only reads one primary-key row, never the table itself.
+# Counters are per tenant, and the tag carries the tenant too, so a cached
+# list from one distributor never validates against another's.
+# A tenant's first write to a table creates its counter; on PostgreSQL and
+# SQLite that is one INSERT ... ON CONFLICT DO UPDATE, so two first writes
+# at once both count instead of one failing on the primary key.
+
+UPSERT_DIALECTS = {"postgresql": postgresql, "sqlite": sqlite}
+
+
+def _increment(db: Session, table: str) -> int:
+    return db.execute(
+        update(TableVersion)
+        .where(TableVersion.table_name == table)
+        .values(version=TableVersion.version + 1)
+    ).rowcount
+
+
+def bump_version(db: Session, *tables: str):
+    dialect = UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    for table in tables:
+        if dialect is not None:
+            stmt = dialect.insert(TableVersion).values(tenant=tenant_of(db), table_name=table, version=1)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["tenant", "table_name"], set_={"version": TableVersion.version + 1}
+            ))
+            continue
+        if _increment(db, table):
+            continue
+        try:
+            with db.begin_nested():
+                db.add(TableVersion(tenant=tenant_of(db), table_name=table, version=1))
+        except IntegrityError:
+            # Another first write created it in the meantime
+            _increment(db, table)
+    # Caller commits together with the write itself
+
+
+def table_etag(db: Session, table: str) -> str:
+    version = db.query(TableVersion.version).filter(TableVersion.table_name == table).scalar()
+    return f'W/"{table}-{version or 0}-{zlib.crc32(tenant_of(db).encode()):08x}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: ignore the W/ prefix on either side
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return etag.removeprefix("W/") in tags
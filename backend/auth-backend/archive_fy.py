@@ -0,0 +1,48 @@
+"""Move closed financial years out of the hot transaction tables.
+
+    python archive_fy.py 2023-2024 [2024-2025 ...] [--compact]
+    python archive_fy.py --list
+"""
+import sys
+
+from app.db import Base, engine, SessionLocal
+from app.models import ArchivedYear
+from app.partitions import archive_year, compact
+from app.tenancy import tenants, tenant_session
+from app.utils import financial_year_bounds
+from app.valuation import save_checkpoint
+
+
+def run(args):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if "--list" in args:
+            for y in db.query(ArchivedYear).order_by(ArchivedYear.start_date):
+                print(f"{y.fy}: {y.sales_invoices} invoices, {y.sales_invoice_items} items, "
+                      f"{y.invoice_products} purchase lines (archived {y.archived_at:%Y-%m-%d})")
+            return
+
+        for fy in (a for a in args if not a.startswith("--")):
+            try:
+                moved = archive_year(db, fy)
+            except ValueError as e:
+                db.rollback()
+                print(f"❌ {e}")
+                continue
+            # Stock valuation restarts from the FY-end layers instead of replaying the archive;
+            # each distributor's layers are replayed and saved on their own
+            for tenant in tenants(db):
+                with tenant_session(tenant) as t:
+                    save_checkpoint(t, financial_year_bounds(fy)[1])
+            print(f"✅ Archived {fy}: " + ", ".join(f"{n} {t}" for t, n in moved.items()))
+
+        if "--compact" in args:
+            compact(engine)
+            print("✅ Compacted hot tables")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -0,0 +1,66 @@
+"""Payload size and latency of list/search endpoints: full vs ?fields=, plain vs gzip/brotli.
+
+    python bench_payloads.py [rows] [link_kbps]
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file. "transfer" is
+the time the body would take over a link of link_kbps (default 512 kbit/s,
+a typical branch-office line).
+"""
+import os
+import sys
+import tempfile
+import time
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("JOBS_ENABLED", "0")
+
+from fastapi.testclient import TestClient
+
+from app.db import SessionLocal
+from app.main import app
+from app.compression import brotli
+from bench_serialization import seed
+
+CASES = [
+    "/products/?fast=true",
+    "/products/?fields=id,code,name,current_stock",
+    "/api/stock/search?q=Bench",
+    "/api/stock/search?q=Bench&fields=id,name,stock",
+]
+ENCODINGS = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+
+
+def measure(client, url, encoding, repeat=5):
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # stream=True keeps httpx from decoding, so we see bytes on the wire
+        with client.stream("GET", url, headers={"Accept-Encoding": encoding}) as r:
+            body = b"".join(r.iter_raw())
+        best = min(best, time.perf_counter() - start)
+        size = len(body)
+    return best, size
+
+
+def run(n, kbps):
+    db = SessionLocal()
+    try:
+        seed(db, n)
+    finally:
+        db.close()
+    client = TestClient(app)
+    print(f"rows={n}  link={kbps} kbit/s")
+    print(f"{'endpoint':48} {'encoding':9} {'bytes':>10} {'server ms':>10} {'transfer s':>11}")
+    baseline = None  # full /products/ list, uncompressed
+    for url in CASES:
+        for encoding in ENCODINGS:
+            seconds, size = measure(client, url, encoding)
+            baseline = baseline or size
+            transfer = size * 8 / (kbps * 1000)
+            print(f"{url:48} {encoding:9} {size:>10} {seconds * 1000:>10.1f} {transfer:>11.2f}"
+                  f"  ({size / baseline:.0%} of full)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 512)
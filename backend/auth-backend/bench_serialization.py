@@ -0,0 +1,74 @@
+"""Compare the ORM + Pydantic list path with the ?fast=true path.
+
+    python bench_serialization.py [rows]
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file.
+"""
+import os
+import sys
+import json
+import tempfile
+import time
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from app.db import Base, engine, SessionLocal
+from app.models import Product
+from app.schemas import ProductSchema
+from app.serializers import fetch_rows, PRODUCT_FIELDS
+
+
+def seed(db, n):
+    existing = db.query(Product).filter(Product.code.like("BENCH-%")).count()
+    db.bulk_insert_mappings(Product, [
+        {
+            "code": f"BENCH-{i:06d}", "name": f"Bench Product {i}", "current_stock": i % 500,
+            "packing": "10x10", "manufacturer": "Bench Pharma", "division": "General",
+            "category": "Tablet", "genericGroup": "Paracetamol", "maxMRP": 12.5, "maxQty": 100,
+        }
+        for i in range(existing, n)
+    ])
+    db.commit()
+
+
+def slow_path(db):
+    rows = db.query(Product).all()
+    validated = [ProductSchema.model_validate(r) for r in rows]
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+
+def fast_path(db):
+    return orjson.dumps(fetch_rows(db, Product, PRODUCT_FIELDS))
+
+
+def timed(fn, db, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        db.expunge_all()
+        start = time.perf_counter()
+        body = fn(db)
+        best = min(best, time.perf_counter() - start)
+    return best, len(body)
+
+
+def run(n):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        seed(db, n)
+        slow, slow_bytes = timed(slow_path, db)
+        fast, fast_bytes = timed(fast_path, db)
+        print(f"rows={n}")
+        print(f"orm + pydantic + jsonable_encoder: {slow * 1000:8.1f} ms  ({slow_bytes} bytes)")
+        print(f"column tuples + orjson:            {fast * 1000:8.1f} ms  ({fast_bytes} bytes)")
+        print(f"speedup: {slow / fast:.1f}x")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,46 @@
+"""Fan-out broker for the chat backplane (CHAT_BACKPLANE=broker).
+
+    python chat_broker.py [host:port]      # default CHAT_BROKER_ADDR or 127.0.0.1:8765
+
+Every line a worker sends is copied to every connected worker. The broker
+keeps no state; workers rebuild presence from each other's heartbeats after
+a restart.
+"""
+import asyncio
+import sys
+
+from app.backplane import CHAT_BROKER_ADDR
+
+clients = set()
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    clients.add(writer)
+    peer = writer.get_extra_info("peername")
+    print(f"Worker connected: {peer} ({len(clients)} total)")
+    try:
+        while line := await reader.readline():
+            for client in list(clients):
+                try:
+                    client.write(line)
+                except Exception:
+                    clients.discard(client)
+            await asyncio.gather(*(c.drain() for c in list(clients)), return_exceptions=True)
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        clients.discard(writer)
+        writer.close()
+        print(f"Worker disconnected: {peer} ({len(clients)} total)")
+
+
+async def main(addr: str):
+    host, port = addr.rsplit(":", 1)
+    server = await asyncio.start_server(handle, host, int(port))
+    print(f"✅ Chat broker listening on {addr}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else CHAT_BROKER_ADDR))
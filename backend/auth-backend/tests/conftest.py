@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# The app connects and migrates at import time, so point it at a scratch database first
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+os.environ.setdefault("JOBS_ENABLED", "0")
+os.environ.setdefault("ANALYTICS_PRELOAD", "0")
@@ -0,0 +1,32 @@
+from sqlalchemy import delete, insert
+
+from app import changelog, models
+from app.db import SessionLocal
+
+
+def test_counter_is_created_by_the_first_commit_and_advanced_after():
+    with SessionLocal() as db:
+        db.execute(delete(models.ChangeCounter))
+        assert changelog._advance(db, 3) == 3
+        assert changelog._advance(db, 2) == 5
+        db.rollback()
+
+
+def test_counter_race_without_upsert_retries_the_update(monkeypatch):
+    # Other dialects: another commit creates the row between our UPDATE and our INSERT
+    monkeypatch.setattr(changelog, "UPSERT_DIALECTS", {})
+    real = changelog._increment
+    calls = []
+
+    def racing(session, n):
+        calls.append(n)
+        if len(calls) == 1:
+            session.execute(insert(models.ChangeCounter).values(id=1, seq=10))
+            return None
+        return real(session, n)
+
+    monkeypatch.setattr(changelog, "_increment", racing)
+    with SessionLocal() as db:
+        db.execute(delete(models.ChangeCounter))
+        assert changelog._advance(db, 3) == 13
+        db.rollback()
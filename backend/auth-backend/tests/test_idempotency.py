@@ -0,0 +1,65 @@
+from fastapi.testclient import TestClient
+
+from app import idempotency, models
+from app.main import app
+from app.security import create_access_token
+from app.tenancy import tenant_session
+
+client = TestClient(app)
+TOKEN = create_access_token({"sub": "idem-admin", "role": "Admin", "company": "IdemCo"})
+
+
+def _product(name: str) -> int:
+    with tenant_session("IdemCo") as db:
+        product = models.Product(code=name, name=name, current_stock=10)
+        db.add(product)
+        db.commit()
+        return product.id
+
+
+def _stock(product_id: int) -> int:
+    with tenant_session("IdemCo") as db:
+        return db.get(models.Product, product_id).current_stock
+
+
+def _post(no: str, name: str, key: str):
+    invoice = {
+        "header": {"invoiceNo": no, "invoiceDate": "2025-06-01", "tradingAccount": "Sales", "customer": "Idem Co",
+                   "paymentMode": "Cash", "dueDays": 0},
+        "rows": [{"name": name, "batch": "B1", "exp": "2027-01-01", "qty": 2, "free": 0,
+                  "rate": 10, "gst": 12, "discount": 0}],
+        "totals": {"grandTotal": 20},
+    }
+    return client.post("/sales-invoice", json=invoice,
+                       headers={"Authorization": f"Bearer {TOKEN}", "Idempotency-Key": key})
+
+
+def test_retry_replays_the_saved_response():
+    product_id = _product("Idem Balm")
+    first = _post("ID-1", "Idem Balm", "key-1")
+    retry = _post("ID-1", "Idem Balm", "key-1")
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert _stock(product_id) == 8
+
+
+def test_attempt_racing_a_committed_key_replays_it(monkeypatch):
+    # As if the retry reached another worker before the first attempt committed
+    product_id = _product("Idem Oil")
+    assert _post("ID-2", "Idem Oil", "key-2").status_code == 200
+    real = idempotency._saved
+    calls = []
+
+    def before_commit_seen(db, scope, key):
+        calls.append(key)
+        return None if len(calls) == 1 else real(db, scope, key)
+
+    monkeypatch.setattr(idempotency, "_saved", before_commit_seen)
+    retry = _post("ID-2B", "Idem Oil", "key-2")
+    assert retry.status_code == 422  # different payload under the same key
+    calls.clear()
+    retry = _post("ID-2", "Idem Oil", "key-2")
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert _stock(product_id) == 8
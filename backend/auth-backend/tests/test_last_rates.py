@@ -0,0 +1,55 @@
+from datetime import date
+from types import SimpleNamespace
+
+from app import last_rates, models
+from app.db import SessionLocal
+from app.tenancy import tenant_session
+
+
+def _row(name: str, rate: float):
+    return SimpleNamespace(name=name, rate=rate, discount=0, batch="B1")
+
+
+def _stored(customer: str) -> dict:
+    with SessionLocal() as db:
+        return {
+            r.product_name: (r.invoice_no, r.rate)
+            for r in db.query(models.CustomerProductRate).filter_by(tenant="Medivision", customer=customer)
+        }
+
+
+def _later_sale_by_other_counter(customer: str):
+    with tenant_session("Medivision") as other:
+        last_rates.record_sales(other, [(customer, "OTHER", date(2025, 7, 1), [_row("Amla", 99)])])
+        other.commit()
+
+
+def _record(customer: str):
+    with tenant_session("Medivision") as db:
+        last_rates.record_sales(db, [(customer, "MINE", date(2025, 6, 1),
+                                      [_row("Amla", 10), _row("Brahmi", 20), _row("Chyawan", 30)])])
+        db.commit()
+
+
+def test_conflicting_row_keeps_later_sale_and_others_are_saved():
+    _later_sale_by_other_counter("Upsert Co")
+    _record("Upsert Co")
+    assert _stored("Upsert Co") == {"Amla": ("OTHER", 99), "Brahmi": ("MINE", 20), "Chyawan": ("MINE", 30)}
+
+
+def test_insert_race_without_upsert_keeps_non_conflicting_rows(monkeypatch):
+    # Other dialects: the other counter's row appears between our read and our INSERT
+    monkeypatch.setattr(last_rates, "UPSERT_DIALECTS", {})
+    real = last_rates._stored_dates
+    calls = []
+
+    def racing(db, pairs):
+        calls.append(pairs)
+        if len(calls) == 1:
+            _later_sale_by_other_counter("Race Co")
+            return {}
+        return real(db, pairs)
+
+    monkeypatch.setattr(last_rates, "_stored_dates", racing)
+    _record("Race Co")
+    assert _stored("Race Co") == {"Amla": ("OTHER", 99), "Brahmi": ("MINE", 20), "Chyawan": ("MINE", 30)}
@@ -0,0 +1,52 @@
+from fastapi.testclient import TestClient
+
+from app import models
+from app.main import app
+from app.security import create_access_token
+from app.tenancy import tenant_session
+
+client = TestClient(app)
+HEADERS = {"Authorization": "Bearer " + create_access_token({"sub": "stock-admin", "role": "Admin", "company": "StockCo"})}
+
+
+def _twins(name: str) -> tuple:
+    # Two products sharing a name, e.g. the same item from two manufacturers
+    with tenant_session("StockCo") as db:
+        first = models.Product(code=f"{name}-1", name=name, current_stock=10)
+        second = models.Product(code=f"{name}-2", name=name, current_stock=10)
+        db.add_all([first, second])
+        db.commit()
+        return first.id, second.id
+
+
+def _stock(*ids) -> list:
+    with tenant_session("StockCo") as db:
+        return [db.get(models.Product, i).current_stock for i in ids]
+
+
+def _invoice(no: str, name: str, **row) -> dict:
+    return {
+        "header": {"invoiceNo": no, "invoiceDate": "2025-06-01", "tradingAccount": "Sales", "customer": "Twin Co",
+                   "area": "", "city": "", "paymentMode": "Cash", "dueDays": 0},
+        "rows": [{"name": name, "batch": "B1", "exp": "2027-01-01", "qty": 3, "free": 1,
+                  "rate": 10, "gst": 12, "discount": 0, **row}],
+        "notes": "",
+        "totals": {"grandTotal": 30},
+    }
+
+
+def test_sale_moves_only_the_picked_product_and_delete_restores_it():
+    first, second = _twins("Twin Syrup")
+    r = client.post("/sales-invoice", json=_invoice("TW-100", "Twin Syrup", productId=second), headers=HEADERS)
+    assert r.status_code == 200
+    assert _stock(first, second) == [10, 6]
+
+    assert client.delete("/sales-invoice/TW-100", headers=HEADERS).status_code == 200
+    assert _stock(first, second) == [10, 10]
+
+
+def test_sale_by_name_alone_moves_one_product():
+    first, second = _twins("Twin Tonic")
+    r = client.post("/sales-invoice", json=_invoice("TW-200", "Twin Tonic"), headers=HEADERS)
+    assert r.status_code == 200
+    assert _stock(first, second) == [6, 10]
@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from fastapi.testclient import TestClient
+
+from app import db, models
+from app.db import SessionLocal
+from app.main import app
+from app.security import create_access_token
+
+client = TestClient(app)
+
+
+def _headers(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _product_tenants(code: str) -> list:
+    with SessionLocal() as db:
+        return [t for (t,) in db.query(models.Product.tenant).filter(models.Product.code == code)]
+
+
+def test_valid_token_writes_to_its_company():
+    token = create_access_token({"sub": "beta-admin", "role": "Admin", "company": "Beta"})
+    r = client.post("/products/", json={"code": "T-OK", "name": "Tulsi"}, headers=_headers(token))
+    assert r.status_code == 200
+    assert _product_tenants("T-OK") == ["Beta"]
+
+
+def test_expired_token_is_rejected_not_defaulted():
+    token = create_access_token({"sub": "beta-admin", "role": "Admin", "company": "Beta"},
+                                expires_minutes=-1)
+    r = client.post("/products/", json={"code": "T-EXPIRED", "name": "Tulsi"}, headers=_headers(token))
+    assert r.status_code == 401
+    assert _product_tenants("T-EXPIRED") == []
+
+
+def test_bad_signature_is_rejected():
+    token = create_access_token({"sub": "beta-admin", "role": "Admin", "company": "Beta"})
+    r = client.get("/products/", headers=_headers(token[:-2] + "xx"))
+    assert r.status_code == 401
+
+
+def test_no_header_is_rejected():
+    r = client.post("/products/", json={"code": "T-ANON", "name": "Tulsi"})
+    assert r.status_code == 401
+    assert _product_tenants("T-ANON") == []
+
+
+def test_no_header_uses_default_tenant_on_single_tenant_installs(monkeypatch):
+    monkeypatch.setattr(db, "TENANT_REQUIRED", False)
+    r = client.post("/products/", json={"code": "T-SINGLE", "name": "Tulsi"})
+    assert r.status_code == 200
+    assert _product_tenants("T-SINGLE") == ["Medivision"]
@@ -0,0 +1,42 @@
+from app import models, versions
+from app.tenancy import tenant_session
+
+
+def _version(tenant: str, table: str) -> int:
+    with tenant_session(tenant) as db:
+        return db.query(models.TableVersion.version).filter_by(table_name=table).scalar()
+
+
+def _first_write_by_other_counter(tenant: str, table: str):
+    with tenant_session(tenant) as other:
+        versions.bump_version(other, table)
+        other.commit()
+
+
+def test_first_writes_both_count():
+    _first_write_by_other_counter("UpsertCo", "products")
+    with tenant_session("UpsertCo") as db:
+        versions.bump_version(db, "products", "customers")
+        db.commit()
+    assert _version("UpsertCo", "products") == 2
+    assert _version("UpsertCo", "customers") == 1
+
+
+def test_first_write_race_without_upsert_retries_the_update(monkeypatch):
+    # Other dialects: the other counter's row appears between our UPDATE and our INSERT
+    monkeypatch.setattr(versions, "UPSERT_DIALECTS", {})
+    real = versions._increment
+    calls = []
+
+    def racing(db, table):
+        calls.append(table)
+        if len(calls) == 1:
+            _first_write_by_other_counter("RaceCo", table)
+            return 0
+        return real(db, table)
+
+    monkeypatch.setattr(versions, "_increment", racing)
+    with tenant_session("RaceCo") as db:
+        versions.bump_version(db, "products")
+        db.commit()
+    assert _version("RaceCo", "products") == 2
@@ -7,6 +7,7 @@ const API = "http://127.0.0.1:8000";
 
 const emptyRow = () => ({
   pcode: "",
+  productId: null,
   name: "",
   batch: "",
   exp: "", 
@@ -98,7 +99,10 @@ export default function SalesInvoice() {
   };
 
   const handleProductSearch = async (val, i) => {
-    updateRow(i, "name", val);
+    // A typed name no longer points at the product picked before
+    const copy = [...rows];
+    copy[i] = { ...copy[i], name: val, productId: null };
+    setRows(copy);
     if (!val) return;
     try {
       const res = await axios.get(`${API}/products/search?q=${val}`);
@@ -112,6 +116,7 @@ export default function SalesInvoice() {
         ...copy[i], 
         name: p.name, 
         pcode: p.pcode, 
+        productId: p.id, 
         batch: p.batch || "", 
         exp: p.exp || "", 
         rate: p.rate || 0, 
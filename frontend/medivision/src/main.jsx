@@ -3,6 +3,29 @@ import { createRoot } from 'react-dom/client'
 import './index.css'
 import "bootstrap/dist/css/bootstrap.min.css";
 import App from './App.jsx'
+import axios from "axios";
+
+// Every API call carries the login token: the backend picks the distributor's
+// data from it and refuses business calls without one
+axios.interceptors.request.use((config) => {
+  const token = localStorage.getItem("token");
+  if (token && !config.headers.Authorization) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
+// Expired or invalid session: back to the login screen
+axios.interceptors.response.use(
+  (response) => response,
+  (error) => {
+    if (error.response?.status === 401 && localStorage.getItem("token")) {
+      localStorage.removeItem("token");
+      window.location.href = "/";
+    }
+    return Promise.reject(error);
+  }
+);
 
 
 createRoot(document.getElementById('root')).render(